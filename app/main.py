@@ -2,34 +2,344 @@ from fastapi import FastAPI, Depends, HTTPException, status, Form, APIRouter
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from typing import Optional, List
-from datetime import datetime, timedelta
-import uuid
+from datetime import datetime, timedelta, timezone
 import os
 import sqlite3
 import threading
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.templating import Jinja2Templates
-from fastapi import Request
+from fastapi import Request, Response, Header
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import pyotp
+import password_hashing
 import secrets
 import string
+import base64
+import json
+import calendar
+import csv
+import io
+import hashlib
+import re
+import zlib
+import socket
+import atexit
+from bisect import bisect_left
+from collections import OrderedDict, deque
 
 # Configuration
-DB_FILE = "simple_banking.db"
+DB_FILE = os.getenv("DB_FILE", "simple_banking.db")
 SECRET_KEY = os.getenv("SECRET_KEY", "USE_ENV_THATS_MILLIONS_BETTER_WAY_THEN_THIS")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-MAX_ATTEMPTS = 5
+# Extra attempts at BEGIN IMMEDIATE when busy_timeout alone was not enough
+LEDGER_LOCK_RETRIES = 3
+# Group commit: collect ledger operations for up to LEDGER_BATCH_WINDOW_MS (or
+# LEDGER_BATCH_MAX_OPS operations) and apply them in one transaction. A wider
+# window trades per-request latency for fewer fsyncs per second.
+LEDGER_GROUP_COMMIT = os.getenv("LEDGER_GROUP_COMMIT", "false").lower() == "true"
+LEDGER_BATCH_WINDOW_MS = float(os.getenv("LEDGER_BATCH_WINDOW_MS", "2"))
+LEDGER_BATCH_MAX_OPS = int(os.getenv("LEDGER_BATCH_MAX_OPS", "256"))
+# Sharded ledger: with LEDGER_SHARDS > 1 balances and transactions live in
+# SHARD_DIR/ledger_shard_<n>.db, picked by a CRC32 of the account number, so
+# writes to different shards never wait on the same lock. The main database
+# keeps logins, settings and the account directory. Transfers between shards
+# use a two-phase protocol; a leg still in doubt SHARD_RECOVERY_SECONDS after
+# it was prepared (e.g. after a crash) is resolved by the recovery job. Shard
+# files default to synchronous=FULL so a recorded decision survives power loss.
+# Group commit is not supported with shards and is ignored (with a warning at
+# startup) when both are set.
+LEDGER_SHARDS = int(os.getenv("LEDGER_SHARDS", "1"))
+SHARD_DIR = os.getenv("SHARD_DIR", os.path.join(os.path.dirname(DB_FILE), "shards"))
+SHARD_POOL_SIZE = int(os.getenv("SHARD_POOL_SIZE", "4"))
+SHARD_SYNCHRONOUS = os.getenv("SHARD_SYNCHRONOUS", "FULL")
+SHARD_RECOVERY_SECONDS = float(os.getenv("SHARD_RECOVERY_SECONDS", "30"))
 ADMIN_PASSWORD = "admin123"
-# Thread-local storage for database connections
-thread_local = threading.local()
+# Transaction IDs are 64-bit snowflakes: milliseconds since 2020-01-01 UTC,
+# a 10-bit worker number and a 12-bit sequence, so they sort by time. Each
+# process leases a free worker number from the worker_ids table at startup
+# and renews it every WORKER_ID_LEASE_SECONDS / 3; a number whose lease ran
+# out can be taken over. Setting TX_ID_WORKER (0-1023) pins the number
+# instead, and then it must be unique among the processes yourself.
+TX_ID_WORKER = int(os.environ["TX_ID_WORKER"]) if os.getenv("TX_ID_WORKER") else None
+WORKER_ID_LEASE_SECONDS = float(os.getenv("WORKER_ID_LEASE_SECONDS", "60"))
+SNOWFLAKE_EPOCH = "2020-01-01 00:00:00"
+SNOWFLAKE_EPOCH_SECONDS = calendar.timegm((2020, 1, 1, 0, 0, 0))
+SNOWFLAKE_EPOCH_MS = SNOWFLAKE_EPOCH_SECONDS * 1000
+# Hot/cold partitioning: transactions older than the last
+# TRANSACTION_HOT_MONTHS months (counting the current one) are moved by a
+# background job into one SQLite file per month under ARCHIVE_DIR, at most
+# ARCHIVE_BATCH_ROWS rows per write transaction, every
+# ARCHIVE_INTERVAL_MINUTES. 0 keeps everything in the main database.
+# Archiving is off with LEDGER_SHARDS, which warns at startup unless this is 0.
+TRANSACTION_HOT_MONTHS = int(os.getenv("TRANSACTION_HOT_MONTHS", "3"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(DB_FILE), "archive"))
+ARCHIVE_BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "5000"))
+ARCHIVE_INTERVAL_MINUTES = float(os.getenv("ARCHIVE_INTERVAL_MINUTES", "60"))
+# Pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+# Streaming exports read EXPORT_CHUNK_ROWS rows at a time; each running
+# export holds one read connection, so only EXPORT_MAX_CONCURRENT may run
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+# Largest number of payouts accepted by one /transfers/batch request
+MAX_BATCH_TRANSFERS = int(os.getenv("MAX_BATCH_TRANSFERS", "5000"))
+# Bound parameters per IN (...) lookup
+SQL_IN_CHUNK = 500
+# Responses to money-movement requests sent with an Idempotency-Key are kept
+# for IDEMPOTENCY_TTL_HOURS; the most recent IDEMPOTENCY_CACHE_MAX are also
+# held in memory so client retries are answered without touching SQLite
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_CACHE_MAX = int(os.getenv("IDEMPOTENCY_CACHE_MAX", "10000"))
+# Blocking sqlite3 calls run on dedicated, bounded thread pools so a slow
+# query or a busy_timeout wait never stalls the event loop. Writes get their
+# own small pool: SQLite has a single writer, so extra threads would only sit
+# in busy_timeout and starve reads (a sharded ledger has one writer per shard
+# and gets two threads per shard). DB_EXECUTOR_WORKERS=0 runs everything
+# inline on the event loop (only useful for benchmarking).
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+DB_WRITE_EXECUTOR_WORKERS = int(os.getenv("DB_WRITE_EXECUTOR_WORKERS", str(2 * max(LEDGER_SHARDS, 1))))
+# Bcrypt runs in a process pool so logins never burn CPU on the event loop.
+# At most PASSWORD_HASH_WORKERS hashes run at once and up to
+# PASSWORD_HASH_MAX_QUEUE more may wait; beyond that requests get a 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+# Failed-login counters live in memory; login_attempts rows are written by a
+# background task every LOGIN_ATTEMPT_FLUSH_MS. Every FAILED_LOGIN_SYNC_SECONDS
+# each worker adds the failures other workers wrote and forgets users they
+# saw log in, so the lockout tiers count failures on all workers, at most
+# the flush plus the sync interval late.
+LOGIN_ATTEMPT_FLUSH_MS = float(os.getenv("LOGIN_ATTEMPT_FLUSH_MS", "200"))
+FAILED_LOGIN_MAX_KEYS = int(os.getenv("FAILED_LOGIN_MAX_KEYS", "100000"))
+FAILED_LOGIN_SYNC_SECONDS = float(os.getenv("FAILED_LOGIN_SYNC_SECONDS", "1"))
+# Security events are buffered and written in batches every
+# SECURITY_LOG_FLUSH_MS; critical events are still written before the request
+# returns. At most SECURITY_LOG_MAX_PENDING events wait in memory, beyond that
+# SECURITY_LOG_OVERFLOW applies: write_through (the request writes its own
+# event), drop_oldest or drop_newest.
+SECURITY_LOG_FLUSH_MS = float(os.getenv("SECURITY_LOG_FLUSH_MS", "500"))
+SECURITY_LOG_MAX_PENDING = int(os.getenv("SECURITY_LOG_MAX_PENDING", "10000"))
+SECURITY_LOG_OVERFLOW = os.getenv("SECURITY_LOG_OVERFLOW", "write_through").lower()
+if SECURITY_LOG_OVERFLOW not in ("write_through", "drop_oldest", "drop_newest"):
+    print(f"WARNING: Unknown SECURITY_LOG_OVERFLOW {SECURITY_LOG_OVERFLOW!r}, using write_through")
+    SECURITY_LOG_OVERFLOW = "write_through"
+# Authenticated users are cached per worker for up to PRINCIPAL_CACHE_TTL
+# seconds (0 disables the cache). Admins are looked up on every request by
+# default: a deactivated admin must lose access on every worker at once, and
+# admin traffic is light. ADMIN_PRINCIPAL_CACHE_TTL > 0 trades that for
+# fewer queries. Triggers record every lock, 2FA, role or activation change
+# in principal_invalidations, and each worker drops its cached copies of the
+# changed principals every PRINCIPAL_SYNC_SECONDS.
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+PRINCIPAL_CACHE_MAX = int(os.getenv("PRINCIPAL_CACHE_MAX", "10000"))
+ADMIN_PRINCIPAL_CACHE_TTL = float(os.getenv("ADMIN_PRINCIPAL_CACHE_TTL", "0"))
+PRINCIPAL_SYNC_SECONDS = float(os.getenv("PRINCIPAL_SYNC_SECONDS", "1"))
+# Public profiles returned by account-number lookups; account numbers never
+# change, so entries only age out
+RECIPIENT_CACHE_TTL = float(os.getenv("RECIPIENT_CACHE_TTL", "300"))
+RECIPIENT_CACHE_MAX = int(os.getenv("RECIPIENT_CACHE_MAX", "10000"))
+# Dashboard figures come from hourly rollups; each worker reuses a computed
+# snapshot for DASHBOARD_CACHE_TTL seconds
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "5"))
+# system_settings are cached per worker. Every SETTINGS_REFRESH_SECONDS a
+# background task checks PRAGMA data_version and rereads the table only if
+# the database changed, so an edit made through any worker applies
+# everywhere within that delay.
+SETTINGS_REFRESH_SECONDS = float(os.getenv("SETTINGS_REFRESH_SECONDS", "5"))
+# Password changes and "lock all sessions" revoke user tokens at once on the
+# worker that handled them; the other workers read new token_revocations
+# rows every TOKEN_REVOCATION_SYNC_SECONDS.
+TOKEN_REVOCATION_SYNC_SECONDS = float(os.getenv("TOKEN_REVOCATION_SYNC_SECONDS", "1"))
+# Admin live updates (Server-Sent Events). Events are coalesced for
+# EVENT_STREAM_INTERVAL_MS; a client more than EVENT_STREAM_BACKLOG events
+# behind is told to resync. Dashboard snapshots are pushed every
+# EVENT_SNAPSHOT_SECONDS to correct time-based figures.
+EVENT_STREAM_INTERVAL_MS = float(os.getenv("EVENT_STREAM_INTERVAL_MS", "250"))
+EVENT_STREAM_BACKLOG = int(os.getenv("EVENT_STREAM_BACKLOG", "100"))
+EVENT_SNAPSHOT_SECONDS = float(os.getenv("EVENT_SNAPSHOT_SECONDS", "60"))
+EVENT_STREAM_KEEPALIVE = 15
+# Browsers open the stream with a single-use ticket from POST
+# /admin/events/ticket, valid for EVENT_STREAM_TICKET_SECONDS, so the admin
+# token never appears in a URL or an access log.
+EVENT_STREAM_TICKET_SECONDS = int(os.getenv("EVENT_STREAM_TICKET_SECONDS", "30"))
+# Connection pools. Reads and writes use separate pools; read connections
+# are opened with query_only so they can never take the write lock.
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", str(max(DB_EXECUTOR_WORKERS, 1) + 4)))
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", str(max(DB_WRITE_EXECUTOR_WORKERS, 1) + 2)))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_CONN_MAX_AGE = float(os.getenv("DB_CONN_MAX_AGE", "3600"))
+DB_CONN_MAX_USES = int(os.getenv("DB_CONN_MAX_USES", "50000"))
+DB_HEALTHCHECK_IDLE = float(os.getenv("DB_HEALTHCHECK_IDLE", "30"))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+DB_PRAGMAS = {
+    "busy_timeout": os.getenv("DB_BUSY_TIMEOUT_MS", "5000"),
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    "cache_size": os.getenv("DB_CACHE_SIZE", "-20000"),
+    "mmap_size": os.getenv("DB_MMAP_SIZE", "268435456"),
+    "temp_store": os.getenv("DB_TEMP_STORE", "MEMORY"),
+}
+# GET /metrics serves Prometheus text for this worker. Set METRICS_TOKEN to
+# require "Authorization: Bearer <METRICS_TOKEN>" on scrapes.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Opt-in query profiler: per-statement totals (normalized SQL) for
+# GET /admin/system/queries, and statements slower than SLOW_QUERY_MS
+# (including time spent fetching rows) appended to SLOW_QUERY_LOG as JSON
+# lines with their EXPLAIN QUERY PLAN. Parameters are never logged.
+QUERY_PROFILER = os.getenv("QUERY_PROFILER", "false").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.log")
+
+# ===== METRICS =====
+# Latency buckets in seconds, shared by every histogram
+METRIC_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_HELP = {
+    "simplebanking_http_request_duration_seconds": ("histogram", "HTTP request latency by route"),
+    "simplebanking_db_query_duration_seconds": ("histogram", "SQLite statement execution time by statement type"),
+    "simplebanking_db_commit_duration_seconds": ("histogram", "SQLite commit time"),
+    "simplebanking_db_rollbacks_total": ("counter", "SQLite rollbacks"),
+    "simplebanking_db_lock_retries_total": ("counter", "BEGIN IMMEDIATE retries after 'database is locked'"),
+    "simplebanking_db_locked_errors_total": ("counter", "'database is locked' errors raised to callers"),
+    "simplebanking_db_pool_connections": ("gauge", "Pooled SQLite connections by state"),
+    "simplebanking_db_pool_waits_total": ("counter", "Pool checkouts that had to wait for a connection"),
+    "simplebanking_password_hash_duration_seconds": ("histogram", "bcrypt time including queueing, by operation"),
+    "simplebanking_password_hash_queue_depth": ("gauge", "bcrypt operations running or queued"),
+    "simplebanking_cache_hits_total": ("counter", "Cache hits"),
+    "simplebanking_cache_misses_total": ("counter", "Cache misses"),
+    "simplebanking_cache_hit_ratio": ("gauge", "Cache hits / lookups since start"),
+    "simplebanking_cache_entries": ("gauge", "Entries held in the cache"),
+    "simplebanking_settings_reloads_total": ("counter", "system_settings changes picked up by this worker"),
+    "simplebanking_buffered_writes_pending": ("gauge", "Writes waiting in a background writer's buffer"),
+}
+
+class Metrics:
+    """Counters and histograms kept per thread and summed when scraped
+    
+    Each thread only ever updates its own shard, so recording takes no lock;
+    the lock is held only to register a new thread's shard and to list the
+    shards at scrape time. Labels are tuples of (name, value) pairs.
+    """
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.shards = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+    
+    def _shard(self):
+        shard = self.local.shard = ({}, {})
+        with self.lock:
+            self.shards.append(shard)
+        return shard
+    
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        try:
+            counters = self.local.shard[0]
+        except AttributeError:
+            counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+    
+    def observe(self, name: str, labels: tuple, seconds: float):
+        try:
+            histograms = self.local.shard[1]
+        except AttributeError:
+            histograms = self._shard()[1]
+        key = (name, labels)
+        entry = histograms.get(key)
+        if entry is None:
+            # One slot per bucket plus +Inf, then the sum
+            entry = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, seconds)] += 1
+        entry[-1] += seconds
+    
+    def render(self, samples=()) -> str:
+        """Prometheus text format for all shards plus scrape-time (name, labels, value) samples"""
+        counters, histograms = {}, {}
+        with self.lock:
+            shards = list(self.shards)
+        for shard_counters, shard_histograms in shards:
+            # dict.copy() is atomic under the GIL, so owners can keep writing
+            for key, value in shard_counters.copy().items():
+                counters[key] = counters.get(key, 0) + value
+            for key, entry in shard_histograms.copy().items():
+                merged = histograms.setdefault(key, [0] * len(entry))
+                for i, value in enumerate(list(entry)):
+                    merged[i] += value
+        
+        lines = {}
+        for (name, labels), value in list(counters.items()) + [((name, labels), value) for name, labels, value in samples]:
+            lines.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), entry in histograms.items():
+            out = lines.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), entry):
+                cumulative += count
+                out.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            out.append(f"{name}_sum{format_labels(labels)} {entry[-1]}")
+            out.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        
+        text = []
+        for name in sorted(lines):
+            kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+            text.append(f"# HELP {name} {help_text}")
+            text.append(f"# TYPE {name} {kind}")
+            text.extend(lines[name])
+        return "\n".join(text) + "\n"
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+metrics = Metrics(METRIC_BUCKETS)
+
+class MetricsMiddleware:
+    """ASGI middleware recording each HTTP request's latency under its route template"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope (mounts only
+            # extend root_path); unmatched paths share one label so scans
+            # cannot blow up the series count
+            route = getattr(scope.get("route"), "path", None) or scope.get("root_path") or "unmatched"
+            metrics.observe(
+                "simplebanking_http_request_duration_seconds",
+                (("method", scope["method"]), ("route", route),
+                 ("status", str(status_code))),
+                time.perf_counter() - started
+            )
 
 # Security setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 app = FastAPI()
@@ -46,7 +356,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Admin Models
 class AdminLogin(BaseModel):
@@ -100,26 +412,504 @@ class SystemSettings(BaseModel):
     max_attempts: int
     lock_duration: int
     enable_2fa: bool
+    transaction_limit: Optional[float] = None
+    session_timeout: Optional[int] = None
+
+# Transfer Models
+class BatchTransferItem(BaseModel):
+    to_account_number: str
+    amount: float
+
+class BatchTransferRequest(BaseModel):
+    transfers: List[BatchTransferItem]
+    mode: str = "all_or_nothing"
+
+class AccountLookupRequest(BaseModel):
+    account_numbers: List[str]
+
+# Metric labels per SQL text, keyed on the statement string itself
+statement_labels_cache = {}
+
+def statement_labels(sql: str) -> tuple:
+    labels = statement_labels_cache.get(sql)
+    if labels is None:
+        if len(statement_labels_cache) >= 1000:
+            statement_labels_cache.clear()
+        words = sql.split(None, 1)
+        labels = statement_labels_cache[sql] = (("statement", words[0].lower() if words else ""),)
+    return labels
+
+class MetricsCursor(sqlite3.Cursor):
+    """Cursor that times every statement it executes"""
+    
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return sqlite3.Cursor.execute(self, sql, parameters)
+        finally:
+            metrics.observe("simplebanking_db_query_duration_seconds", statement_labels(sql),
+                            time.perf_counter() - started)
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return sqlite3.Cursor.executemany(self, sql, seq_of_parameters)
+        finally:
+            metrics.observe("simplebanking_db_query_duration_seconds", statement_labels(sql),
+                            time.perf_counter() - started)
+
+# Literals and IN lists are folded so one statement shape is one profiler entry
+SQL_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+SQL_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SQL_WHITESPACE = re.compile(r"\s+")
+
+def normalize_sql(sql: str) -> str:
+    sql = SQL_WHITESPACE.sub(" ", sql).strip()
+    sql = SQL_STRING_LITERAL.sub("?", sql)
+    sql = SQL_NUMBER_LITERAL.sub("?", sql)
+    return SQL_PARAMETER_LIST.sub("(?, ...)", sql)
+
+class QueryExecution:
+    """One profiled statement execution and the fetches that follow it"""
+    __slots__ = ("entry", "sql", "parameters", "elapsed", "rows", "logged")
+    
+    def __init__(self, entry: dict, sql: str, parameters, elapsed: float, rows: int):
+        self.entry = entry
+        self.sql = sql
+        self.parameters = parameters
+        self.elapsed = elapsed
+        self.rows = rows
+        self.logged = False
+
+class QueryProfiler:
+    """Per-statement call counts, time and rows, plus the slow-query log"""
+    
+    def __init__(self, enabled: bool, slow_ms: float, log_path: str):
+        self.enabled = enabled
+        self.slow_seconds = slow_ms / 1000.0
+        self.log_path = log_path
+        # Normalized SQL -> totals. Statements come from the code, with
+        # literals folded, so the number of entries stays bounded.
+        self.entries = {}
+        self.lock = threading.Lock()
+    
+    def record(self, conn, sql: str, parameters, elapsed: float, rows: int) -> QueryExecution:
+        query = normalize_sql(sql)
+        with self.lock:
+            entry = self.entries.get(query)
+            if entry is None:
+                entry = self.entries[query] = {
+                    "query": query, "calls": 0, "total": 0.0, "max": 0.0, "rows": 0, "slow": 0, "plan": None
+                }
+            entry["calls"] += 1
+            entry["total"] += elapsed
+            entry["rows"] += rows
+            entry["max"] = max(entry["max"], elapsed)
+        execution = QueryExecution(entry, sql, parameters, elapsed, rows)
+        self._check_slow(conn, execution)
+        return execution
+    
+    def record_fetch(self, conn, execution: QueryExecution, elapsed: float, rows: int):
+        execution.elapsed += elapsed
+        execution.rows += rows
+        entry = execution.entry
+        with self.lock:
+            entry["total"] += elapsed
+            entry["rows"] += rows
+            entry["max"] = max(entry["max"], execution.elapsed)
+        self._check_slow(conn, execution)
+    
+    def _check_slow(self, conn, execution: QueryExecution):
+        if execution.logged or execution.elapsed < self.slow_seconds:
+            return
+        execution.logged = True
+        plan = explain_query_plan(conn, execution.sql, execution.parameters)
+        entry = execution.entry
+        with self.lock:
+            entry["slow"] += 1
+            if plan is not None:
+                entry["plan"] = plan
+        record = {
+            "timestamp": datetime.utcnow().isoformat(timespec="milliseconds"),
+            "duration_ms": round(execution.elapsed * 1000, 2),
+            "rows": execution.rows,
+            "query": entry["query"],
+            "plan": plan,
+        }
+        try:
+            with self.lock, open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"WARNING: Could not write slow query log: {e}")
+    
+    def top(self, limit: int, order: str) -> list:
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries.values()]
+        if order == "mean":
+            key = lambda entry: entry["total"] / entry["calls"]
+        else:
+            key = lambda entry: entry[order]
+        entries.sort(key=key, reverse=True)
+        return [
+            {
+                "query": entry["query"],
+                "calls": entry["calls"],
+                "total_ms": round(entry["total"] * 1000, 2),
+                "mean_ms": round(entry["total"] * 1000 / entry["calls"], 3),
+                "max_ms": round(entry["max"] * 1000, 2),
+                "rows": entry["rows"],
+                "slow": entry["slow"],
+                "plan": entry["plan"],
+            }
+            for entry in entries[:limit]
+        ]
+    
+    def reset(self):
+        with self.lock:
+            self.entries.clear()
+
+query_profiler = QueryProfiler(QUERY_PROFILER, SLOW_QUERY_MS, SLOW_QUERY_LOG)
+
+def explain_query_plan(conn, sql: str, parameters):
+    """EXPLAIN QUERY PLAN detail lines, or None for statements without a plan"""
+    if parameters is None or statement_labels(sql)[0][1] not in ("select", "with", "insert", "update", "delete", "replace"):
+        return None
+    try:
+        # Straight to sqlite3 so the EXPLAIN is neither profiled nor timed
+        rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+    except sqlite3.Error:
+        return None
+    return [row[3] for row in rows]
+
+class ProfilingCursor(MetricsCursor):
+    """MetricsCursor that reports to the query profiler, including fetch time and rows"""
+    
+    execution = None
+    
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return MetricsCursor.execute(self, sql, parameters)
+        finally:
+            self.execution = query_profiler.record(
+                self.connection, sql, parameters, time.perf_counter() - started, max(self.rowcount, 0)
+            )
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return MetricsCursor.executemany(self, sql, seq_of_parameters)
+        finally:
+            # The parameter sequence may be a spent generator, so no plan
+            self.execution = query_profiler.record(
+                self.connection, sql, None, time.perf_counter() - started, max(self.rowcount, 0)
+            )
+    
+    def _fetched(self, started: float, rows: int):
+        if self.execution is not None:
+            query_profiler.record_fetch(self.connection, self.execution, time.perf_counter() - started, rows)
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        row = sqlite3.Cursor.fetchone(self)
+        self._fetched(started, 0 if row is None else 1)
+        return row
+    
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = sqlite3.Cursor.fetchmany(self, self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = sqlite3.Cursor.fetchall(self)
+        self._fetched(started, len(rows))
+        return rows
+    
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = sqlite3.Cursor.__next__(self)
+        except StopIteration:
+            self._fetched(started, 0)
+            raise
+        self._fetched(started, 1)
+        return row
 
-def get_db_connection():
-    """Get database connection with thread-local storage"""
-    if not hasattr(thread_local, "conn"):
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection that remembers its age and use count
+    
+    Admin panel events queued with emit_event() are published only once the
+    transaction that produced them commits, and dropped on rollback.
+    Statements and commits are timed for /metrics.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+        self.pending_events = []
+    
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = ProfilingCursor if query_profiler.enabled else MetricsCursor
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        if query_profiler.enabled:
+            return self.cursor().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return sqlite3.Connection.execute(self, sql, parameters)
+        finally:
+            metrics.observe("simplebanking_db_query_duration_seconds", statement_labels(sql),
+                            time.perf_counter() - started)
+    
+    def executemany(self, sql, seq_of_parameters):
+        if query_profiler.enabled:
+            return self.cursor().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
         try:
-            thread_local.conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-            thread_local.conn.row_factory = sqlite3.Row
+            return sqlite3.Connection.executemany(self, sql, seq_of_parameters)
+        finally:
+            metrics.observe("simplebanking_db_query_duration_seconds", statement_labels(sql),
+                            time.perf_counter() - started)
+    
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        metrics.observe("simplebanking_db_commit_duration_seconds", (), time.perf_counter() - started)
+        if self.pending_events:
+            events, self.pending_events = self.pending_events, []
+            event_hub.publish(events)
+    
+    def rollback(self):
+        super().rollback()
+        metrics.inc("simplebanking_db_rollbacks_total")
+        self.pending_events.clear()
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections with health checks and recycling"""
+    
+    def __init__(self, name: str, size: int, readonly: bool, path: str = None, pragmas: dict = None):
+        self.name = name
+        self.size = size
+        self.readonly = readonly
+        self.path = path
+        self.pragmas = pragmas or DB_PRAGMAS
+        self.idle = deque()
+        self.open_count = 0
+        self.in_use = 0
+        self.cond = threading.Condition()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.recycled = 0
+        self.health_check_failures = 0
+    
+    def _connect(self) -> PooledConnection:
+        conn = sqlite3.connect(
+            self.path or DB_FILE,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+            factory=PooledConnection
+        )
+        conn.row_factory = sqlite3.Row
+        if not self.readonly:
             # Enable WAL mode for better concurrency
-            thread_local.conn.execute("PRAGMA journal_mode=WAL;")
-            thread_local.conn.execute("PRAGMA busy_timeout = 5000;")
-        except sqlite3.Error as e:
+            conn.execute("PRAGMA journal_mode=WAL;")
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value};")
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON;")
+        return conn
+    
+    def _expired(self, conn: PooledConnection) -> bool:
+        return (time.monotonic() - conn.created_at > DB_CONN_MAX_AGE
+                or conn.uses >= DB_CONN_MAX_USES)
+    
+    def _healthy(self, conn: PooledConnection) -> bool:
+        if time.monotonic() - conn.last_used < DB_HEALTHCHECK_IDLE:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            self.health_check_failures += 1
+            return False
+    
+    def acquire(self) -> PooledConnection:
+        started = time.monotonic()
+        waited = False
+        with self.cond:
+            while not self.idle and self.open_count >= self.size:
+                waited = True
+                remaining = DB_POOL_TIMEOUT - (time.monotonic() - started)
+                if remaining <= 0 or not self.cond.wait(remaining):
+                    if not self.idle and self.open_count >= self.size:
+                        raise HTTPException(
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Database is busy, please retry shortly"
+                        )
+            conn = self.idle.pop() if self.idle else None
+            if conn is None:
+                self.open_count += 1
+            self.in_use += 1
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_time += time.monotonic() - started
+        
+        try:
+            if conn is not None and not self._healthy(conn):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception as e:
+            with self.cond:
+                self.open_count -= 1
+                self.in_use -= 1
+                self.cond.notify()
+            if isinstance(e, HTTPException):
+                raise
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Database connection error: {str(e)}"
             )
-    return thread_local.conn
+        return conn
+    
+    def release(self, conn: PooledConnection, discard: bool = False):
+        conn.uses += 1
+        conn.last_used = time.monotonic()
+        if not discard and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+        if not discard and self._expired(conn):
+            self.recycled += 1
+            discard = True
+        if discard:
+            self._close(conn)
+        with self.cond:
+            self.in_use -= 1
+            if discard:
+                self.open_count -= 1
+            else:
+                self.idle.append(conn)
+            self.cond.notify()
+    
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    
+    def close_idle(self):
+        with self.cond:
+            while self.idle:
+                self._close(self.idle.pop())
+                self.open_count -= 1
+    
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "size": self.size,
+                "open": self.open_count,
+                "in_use": self.in_use,
+                "idle": len(self.idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time_ms": round(self.wait_time * 1000, 2),
+                "recycled": self.recycled,
+                "health_check_failures": self.health_check_failures,
+            }
+
+read_pool = ConnectionPool("read", DB_READ_POOL_SIZE, readonly=True)
+write_pool = ConnectionPool("write", DB_WRITE_POOL_SIZE, readonly=False)
+
+def db_connection(readonly: bool = False):
+    """Check a connection out of the read or write pool for the duration of a block"""
+    return pool_connection(read_pool if readonly else write_pool)
+
+@contextmanager
+def pool_connection(pool: ConnectionPool):
+    """Check a connection out of a pool for the duration of a block"""
+    conn = pool.acquire()
+    discard = False
+    try:
+        yield conn
+    except sqlite3.DatabaseError as e:
+        # Drop connections that hit low-level errors rather than reuse them
+        discard = not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError))
+        if isinstance(e, sqlite3.OperationalError) and "locked" in str(e):
+            metrics.inc("simplebanking_db_locked_errors_total")
+        raise
+    finally:
+        pool.release(conn, discard)
+
+db_executor = None
+db_write_executor = None
+if DB_EXECUTOR_WORKERS > 0:
+    db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db-read")
+    db_write_executor = ThreadPoolExecutor(max_workers=max(1, DB_WRITE_EXECUTOR_WORKERS), thread_name_prefix="db-write")
+
+async def run_db(func, *args):
+    """Run a blocking, read-mostly database function off the event loop"""
+    if db_executor is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+
+async def run_db_write(func, *args):
+    """Run a blocking database function that writes off the event loop"""
+    if db_write_executor is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(db_write_executor, func, *args)
+
+def db_execute(query: str, params=()):
+    """Execute a single write statement and commit, returning the row count"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return cursor.rowcount
+
+def db_fetchall(query: str, params=()):
+    """Run a query and return every row as a dict"""
+    with db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+def db_fetchone(query: str, params=()):
+    """Run a query and return the first row as a dict (or None)"""
+    with db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        return dict(row) if row else None
 
 def init_db():
     """Initialize database tables"""
-    conn = get_db_connection()
+    with db_connection() as conn:
+        create_tables(conn)
+        run_migrations(conn)
+        missing = check_schema_indexes(conn)
+    
+    for table, indexes in missing.items():
+        print(f"WARNING: table {table} is missing expected indexes: {', '.join(indexes)}")
+
+def create_tables(conn):
+    """Create the base (version 0) schema and seed data"""
     cursor = conn.cursor()
     
     try:
@@ -211,6 +1001,7 @@ def init_db():
         default_settings = [
             ('max_login_attempts', '5'),
             ('lockout_duration_minutes', '15'),
+            ('lockout_tier_minutes', '5,60,1440'),
             ('require_2fa_admins', 'true'),
             ('transaction_limit', '10000'),
             ('session_timeout_minutes', '30')
@@ -226,7 +1017,7 @@ def init_db():
         cursor.execute("SELECT * FROM admins WHERE username = 'admin'")
         admin_exists = cursor.fetchone()
         if not admin_exists:
-            default_admin_password = pwd_context.hash(ADMIN_PASSWORD)
+            default_admin_password = password_hashing.hash_password(ADMIN_PASSWORD)
             cursor.execute('''
                 INSERT INTO admins (username, hashed_password, email, role)
                 VALUES (?, ?, ?, ?)
@@ -236,200 +1027,3104 @@ def init_db():
     except Exception as e:
         conn.rollback()
         raise e
-    finally:
-        # Don't close the connection - keep it in thread-local storage
-        pass
 
-# Helper functions
-def verify_password_complexity(password: str) -> bool:
-    """Verify password meets complexity requirements"""
-    if len(password) < 8:
-        return False
-    if not any(c.islower() for c in password):
-        return False
-    if not any(c.isupper() for c in password):
-        return False
-    if not any(c.isdigit() for c in password):
-        return False
-    if not any(c in "!@#$%^&*()-_=+[]{}|;:'\",.<>?/`~" for c in password):
-        return False
-    return True
+# Dashboard rollups
+# stats_hourly holds per-hour counters (UTC) that the write paths bump inside
+# their own transactions, so the dashboard reads at most 24 rows instead of
+# scanning transactions and login_attempts. Rollups outlive the raw rows, and
+# rebuild_dashboard_rollups() recomputes them from the raw tables.
+STATS_COLUMNS = ("new_users", "transactions", "transaction_total", "failed_logins", "locks")
+# Last computed dashboard for this worker: {"expires": ..., "stats": ...}
+dashboard_cache = {}
+dashboard_cache_stats = {"hits": 0, "misses": 0}
+
+def stats_hour(when: datetime = None) -> str:
+    """Rollup bucket for a UTC time"""
+    return (when or datetime.utcnow()).strftime("%Y-%m-%d %H:00:00")
+
+def last_24h_start() -> str:
+    """First hourly bucket of the trailing 24 hours (the current hour plus the 23 before it)"""
+    return stats_hour(datetime.utcnow() - timedelta(hours=23))
+
+def stats_upsert(**deltas):
+    """Build the statement adding deltas to the current hour's rollup row"""
+    columns = [column for column in STATS_COLUMNS if column in deltas]
+    if len(columns) != len(deltas):
+        raise ValueError(f"Unknown rollup columns: {set(deltas) - set(columns)}")
+    query = (
+        f"INSERT INTO stats_hourly (hour, {', '.join(columns)}) VALUES (?{', ?' * len(columns)}) "
+        "ON CONFLICT(hour) DO UPDATE SET "
+        + ", ".join(f"{column} = {column} + excluded.{column}" for column in columns)
+    )
+    return query, (stats_hour(), *(deltas[column] for column in columns))
+
+def bump_stats(cursor, **deltas):
+    """Add deltas to the current hour's rollup inside the caller's transaction"""
+    cursor.execute(*stats_upsert(**deltas))
+
+def create_stats_tables(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_hourly (
+        hour TEXT PRIMARY KEY,
+        new_users INTEGER NOT NULL DEFAULT 0,
+        transactions INTEGER NOT NULL DEFAULT 0,
+        transaction_total REAL NOT NULL DEFAULT 0,
+        failed_logins INTEGER NOT NULL DEFAULT 0,
+        locks INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_totals (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+
+def rebuild_dashboard_rollups(cursor):
+    """Recompute every rollup from the raw tables"""
+    rebuild_stats_rollups(cursor)
+    rebuild_failed_login_rollups(cursor)
+
+def rebuild_stats_rollups(cursor):
+    """Recompute stats_hourly and stats_totals (locks are not derivable and are kept)"""
+    cursor.execute("UPDATE stats_hourly SET new_users = 0, transactions = 0, transaction_total = 0, failed_logins = 0")
+    cursor.execute("""
+        INSERT INTO stats_hourly (hour, new_users)
+        SELECT strftime('%Y-%m-%d %H:00:00', created_at), COUNT(*) FROM users
+        WHERE created_at IS NOT NULL GROUP BY 1
+        ON CONFLICT(hour) DO UPDATE SET new_users = excluded.new_users
+    """)
+    cursor.execute("""
+        INSERT INTO stats_hourly (hour, transactions, transaction_total)
+        SELECT strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*), COALESCE(SUM(amount), 0) FROM transactions
+        WHERE timestamp IS NOT NULL GROUP BY 1
+        ON CONFLICT(hour) DO UPDATE SET transactions = excluded.transactions,
+                                        transaction_total = excluded.transaction_total
+    """)
+    cursor.executemany("""
+        INSERT INTO stats_hourly (hour, transactions, transaction_total) VALUES (?, ?, ?)
+        ON CONFLICT(hour) DO UPDATE SET transactions = transactions + excluded.transactions,
+                                        transaction_total = transaction_total + excluded.transaction_total
+    """, archived_hourly_totals(cursor))
+    cursor.execute("""
+        INSERT INTO stats_hourly (hour, failed_logins)
+        SELECT strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*) FROM login_attempts
+        WHERE success = 0 AND timestamp IS NOT NULL GROUP BY 1
+        ON CONFLICT(hour) DO UPDATE SET failed_logins = excluded.failed_logins
+    """)
+    cursor.execute("""
+        DELETE FROM stats_hourly
+        WHERE new_users = 0 AND transactions = 0 AND transaction_total = 0
+          AND failed_logins = 0 AND locks = 0
+    """)
+    cursor.execute("INSERT OR REPLACE INTO stats_totals (name, value) SELECT 'users', COUNT(*) FROM users")
+
+def archived_hourly_totals(cursor) -> list:
+    """(hour, transactions, transaction_total) of every archived transaction
+    
+    Each archive is read on its own connection, since ATTACH is not allowed
+    inside the caller's transaction.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transaction_archives'")
+    if cursor.fetchone() is None:
+        # Rebuilding from a migration that runs before the archives exist
+        return []
+    cursor.execute("SELECT month, archived_before FROM transaction_archives")
+    totals = []
+    for month, archived_before in cursor.fetchall():
+        path = archive_path(month)
+        if not os.path.exists(path):
+            print(f"WARNING: transaction archive {path} is missing, its hours are not recounted")
+            continue
+        archive = sqlite3.connect(path)
+        try:
+            totals.extend(archive.execute("""
+                SELECT strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*), COALESCE(SUM(amount), 0)
+                FROM transactions WHERE id < ? AND timestamp IS NOT NULL GROUP BY 1
+            """, (archived_before,)).fetchall())
+        finally:
+            archive.close()
+    return totals
+
+def create_failed_login_rollups(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS failed_logins_hourly (
+        username TEXT NOT NULL,
+        hour TEXT NOT NULL,
+        failures INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (username, hour)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_failed_logins_hourly_hour ON failed_logins_hourly (hour)")
+
+def create_idempotency_table(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        username TEXT NOT NULL,
+        idempotency_key TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        status_code INTEGER NOT NULL,
+        response TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (username, idempotency_key)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)")
+
+def rebuild_transactions_table(cursor):
+    """Re-key transactions on a snowflake INTEGER PRIMARY KEY, keeping old string IDs as legacy_id"""
+    cursor.execute('''
+    CREATE TABLE transactions_v2 (
+        id INTEGER PRIMARY KEY,
+        legacy_id TEXT,
+        user_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        amount REAL NOT NULL,
+        description TEXT,
+        balance_after REAL,
+        related_account TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_flagged BOOLEAN DEFAULT 0
+    )
+    ''')
+    # Existing rows get IDs built from their own timestamps (numbered within
+    # each second), so rowid order matches time order for old and new rows
+    cursor.execute(f'''
+        INSERT INTO transactions_v2 (id, legacy_id, user_id, type, amount, description,
+                                     balance_after, related_account, timestamp, is_flagged)
+        SELECT
+            (((CAST(strftime('%s', COALESCE(timestamp, '{SNOWFLAKE_EPOCH}')) AS INTEGER)
+               - {SNOWFLAKE_EPOCH_SECONDS}) * 1000) << 22)
+            + ROW_NUMBER() OVER (PARTITION BY timestamp ORDER BY id) - 1,
+            id, user_id, type, amount, description, balance_after, related_account, timestamp, is_flagged
+        FROM transactions
+    ''')
+    cursor.execute("DROP TABLE transactions")
+    cursor.execute("ALTER TABLE transactions_v2 RENAME TO transactions")
+    # The rowid already orders each user's rows by time
+    cursor.execute("CREATE INDEX idx_transactions_user ON transactions (user_id)")
+    cursor.execute(
+        "CREATE UNIQUE INDEX idx_transactions_legacy_id ON transactions (legacy_id) WHERE legacy_id IS NOT NULL"
+    )
+
+def create_transaction_archives_table(cursor):
+    # Archive rows with id < archived_before are authoritative; anything above
+    # it was copied by a batch whose delete from the main table never committed
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transaction_archives (
+        month TEXT PRIMARY KEY,
+        first_id INTEGER NOT NULL,
+        end_id INTEGER NOT NULL,
+        archived_before INTEGER NOT NULL,
+        rows INTEGER NOT NULL DEFAULT 0,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+def create_transaction_archive_users_table(cursor):
+    # Archived rows per user and month, so a user's history only opens the
+    # archives that hold some of it. Filled in for months archived earlier.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transaction_archive_users (
+        user_id TEXT NOT NULL,
+        month TEXT NOT NULL,
+        rows INTEGER NOT NULL,
+        PRIMARY KEY (user_id, month)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("SELECT month, archived_before FROM transaction_archives")
+    for month, archived_before in cursor.fetchall():
+        path = archive_path(month)
+        if not os.path.exists(path):
+            continue
+        # ATTACH is not allowed inside the migration's transaction
+        archive = sqlite3.connect(path)
+        try:
+            counts = archive.execute(
+                "SELECT user_id, COUNT(*) FROM transactions WHERE id < ? GROUP BY user_id", (archived_before,)
+            ).fetchall()
+        finally:
+            archive.close()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO transaction_archive_users (user_id, month, rows) VALUES (?, ?, ?)",
+            [(user_id, month, count) for user_id, count in counts]
+        )
+
+def create_token_revocations_table(cursor):
+    # One row per revocation; username is NULL when every user's tokens were
+    # revoked. Per-user rows are pruned once they expire, global rows are kept
+    # because they hold the current global generation.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS token_revocations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT,
+        generation INTEGER NOT NULL,
+        expires_at DATETIME NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_revocations_expires ON token_revocations (expires_at)")
+
+def create_worker_ids_table(cursor):
+    # last_ms is the holder's latest snowflake millisecond, so whoever takes
+    # the number over next never reissues its IDs even if its clock is behind
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS worker_ids (
+        worker_id INTEGER PRIMARY KEY,
+        owner TEXT NOT NULL,
+        heartbeat_at DATETIME NOT NULL,
+        last_ms INTEGER NOT NULL DEFAULT -1
+    )
+    ''')
+
+def rebuild_failed_login_rollups(cursor):
+    """Recompute per-user failed logins for the last 24 hours from login_attempts"""
+    cursor.execute("DELETE FROM failed_logins_hourly")
+    cursor.execute("""
+        INSERT INTO failed_logins_hourly (username, hour, failures)
+        SELECT username, strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*) FROM login_attempts
+        WHERE success = 0 AND username IS NOT NULL AND timestamp >= ?
+        GROUP BY 1, 2
+    """, (last_24h_start(),))
+
+def run_dashboard_rebuild():
+    """Rebuild the dashboard rollups in one write transaction (plus one per ledger shard)"""
+    with db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rebuild_dashboard_rollups(conn.cursor())
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if ledger_shards is not None:
+        for shard in range(ledger_shards.count):
+            ledger_shards.transaction(shard, rebuild_shard_stats)
+    dashboard_cache.clear()
+
+# Schema migrations
+# Each entry is (version, description, steps). A step is either an SQL string
+# or a callable taking a cursor. Applied versions are recorded in
+# schema_version, so append new migrations - never edit ones already shipped.
+MIGRATIONS = [
+    (1, "Indexes for transaction history, login throttling, dashboard and audit queries", [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_time ON transactions (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_time ON transactions (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_login_attempts_user ON login_attempts (username, success, timestamp, ip)",
+        "CREATE INDEX IF NOT EXISTS idx_login_attempts_time ON login_attempts (success, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_users_last_login ON users (last_login)",
+        "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_users_locked_until ON users (locked_until)",
+        "CREATE INDEX IF NOT EXISTS idx_security_logs_time ON security_logs (timestamp)",
+    ]),
+    (2, "Add id as tie-breaker to transaction time indexes for keyset pagination", [
+        "DROP INDEX IF EXISTS idx_transactions_user_time",
+        "DROP INDEX IF EXISTS idx_transactions_time",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_time_id ON transactions (user_id, timestamp, id)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_time_id ON transactions (timestamp, id)",
+    ]),
+    (3, "Hourly rollups and running totals for the admin dashboard", [
+        create_stats_tables,
+        rebuild_stats_rollups,
+    ]),
+    (4, "Per-user hourly failed-login counts for the admin user listings", [
+        create_failed_login_rollups,
+        rebuild_failed_login_rollups,
+    ]),
+    (5, "Stored responses for Idempotency-Key replays", [
+        create_idempotency_table,
+    ]),
+    (6, "Snowflake INTEGER PRIMARY KEY for transactions, old string IDs kept as legacy_id", [
+        rebuild_transactions_table,
+    ]),
+    # Must match the expression in account lookups exactly for SQLite to use it
+    (7, "Index account numbers without dashes for recipient lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_users_account_number_norm ON users (REPLACE(account_number, '-', ''))",
+    ]),
+    (8, "Registry of monthly transaction archive files", [
+        create_transaction_archives_table,
+    ]),
+    (9, "Token generations for access token revocation", [
+        "ALTER TABLE users ADD COLUMN token_generation INTEGER NOT NULL DEFAULT 0",
+        create_token_revocations_table,
+    ]),
+    (10, "Leases on snowflake worker numbers", [
+        create_worker_ids_table,
+    ]),
+    (11, "Per-user row counts of transaction archives", [
+        create_transaction_archive_users_table,
+    ]),
+    # The worker that wrote a login attempt, so the others know which rows to count
+    (12, "Record which worker wrote each login attempt", [
+        "ALTER TABLE login_attempts ADD COLUMN origin TEXT",
+    ]),
+    (13, "Single-use tickets for the admin event stream", [
+        """CREATE TABLE IF NOT EXISTS admin_stream_tickets (
+            ticket_hash TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            token_expires INTEGER NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        )""",
+    ]),
+    # Rows older than an hour are pruned by the triggers themselves
+    (14, "Record principal changes so every worker drops its cached copy", [
+        """CREATE TABLE IF NOT EXISTS principal_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            username TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS users_principal_changed
+        AFTER UPDATE OF email, role, is_active, locked_until, totp_secret, token_generation ON users
+        BEGIN
+            INSERT INTO principal_invalidations (kind, username) VALUES ('user', NEW.username);
+            DELETE FROM principal_invalidations WHERE created_at < datetime('now', '-1 hour');
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS users_principal_deleted AFTER DELETE ON users
+        BEGIN
+            INSERT INTO principal_invalidations (kind, username) VALUES ('user', OLD.username);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS admins_principal_changed
+        AFTER UPDATE OF email, role, is_active, permissions ON admins
+        BEGIN
+            INSERT INTO principal_invalidations (kind, username) VALUES ('admin', NEW.username);
+            DELETE FROM principal_invalidations WHERE created_at < datetime('now', '-1 hour');
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS admins_principal_deleted AFTER DELETE ON admins
+        BEGIN
+            INSERT INTO principal_invalidations (kind, username) VALUES ('admin', OLD.username);
+        END""",
+    ]),
+]
+
+# Secondary indexes every table must have once all migrations are applied
+EXPECTED_INDEXES = {
+    "users": ["idx_users_last_login", "idx_users_created_at", "idx_users_locked_until",
+              "idx_users_account_number_norm"],
+    "transactions": ["idx_transactions_user", "idx_transactions_legacy_id"],
+    "login_attempts": ["idx_login_attempts_user", "idx_login_attempts_time"],
+    "security_logs": ["idx_security_logs_time"],
+    "failed_logins_hourly": ["idx_failed_logins_hourly_hour"],
+    "idempotency_keys": ["idx_idempotency_keys_created"],
+    "token_revocations": ["idx_token_revocations_expires"],
+}
+
+def get_schema_version(cursor) -> int:
+    """Return the highest applied migration version"""
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+def run_migrations(conn):
+    """Apply pending migrations, one transaction per version"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.commit()
+    
+    for version, description, steps in MIGRATIONS:
+        if version <= get_schema_version(cursor):
+            continue
+        # Take the write lock first so concurrently starting workers
+        # apply each migration exactly once
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_schema_version(cursor):
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied schema migration {version}: {description}")
+
+def check_schema_indexes(conn) -> dict:
+    """Return {table: [missing index names]} for tables lacking expected indexes"""
+    missing = {}
+    for table, expected in EXPECTED_INDEXES.items():
+        present = {row["name"] for row in conn.execute(f"PRAGMA index_list({table})")}
+        absent = [name for name in expected if name not in present]
+        if absent:
+            missing[table] = absent
+    return missing
+
+class PasswordHasher:
+    """Bounded process pool for bcrypt hashing and verification"""
+    
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_pending = max(1, workers) + max_queue
+        self.pending = 0
+        self.pool = None
+    
+    def start(self):
+        if self.pool is None and self.workers > 0:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+    
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+    
+    async def _submit(self, func, labels: tuple, *args):
+        # pending is only touched from the event loop thread
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        self.start()
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            # workers=0 falls back to the default thread pool
+            return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+        finally:
+            self.pending -= 1
+            metrics.observe("simplebanking_password_hash_duration_seconds", labels, time.perf_counter() - started)
+    
+    async def hash(self, password: str) -> str:
+        return await self._submit(password_hashing.hash_password, (("operation", "hash"),), password)
+    
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._submit(
+            password_hashing.verify_password, (("operation", "verify"),), password, hashed_password
+        )
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
+class BufferedWriter:
+    """Queue of writes flushed in order by a background task
+    
+    Items are (sql, params) pairs unless a write function taking a list of
+    items is given. With max_pending set the buffer is bounded and a full
+    buffer follows the overflow policy: "drop_oldest" and "drop_newest"
+    discard an item, "write_through" makes add() return False so the
+    caller writes the item itself.
+    """
+    
+    def __init__(self, flush_interval_ms: float, batch_size: int = 500, max_pending: int = 0,
+                 overflow: str = "drop_oldest", write=None):
+        self.interval = flush_interval_ms / 1000.0
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.write = write or self._write
+        self.pending = deque()
+        self.dropped = 0
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.wakeup = None
+    
+    def add(self, *item) -> bool:
+        if self.max_pending and len(self.pending) >= self.max_pending:
+            if self.overflow == "write_through":
+                return False
+            self.dropped += 1
+            if self.overflow == "drop_newest":
+                return True
+            self.pending.popleft()
+        self.pending.append(item)
+        if len(self.pending) >= self.batch_size and self.wakeup is not None:
+            self.wakeup.set()
+        return True
+    
+    async def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+    
+    async def flush(self):
+        # Serialized so concurrent flushes commit their batches in order
+        async with self.lock:
+            if self.dropped:
+                print(f"WARNING: Write buffer full, dropped {self.dropped} buffered writes")
+                self.dropped = 0
+            if not self.pending:
+                return
+            batch = list(self.pending)
+            self.pending.clear()
+            try:
+                await run_db_write(self.write, batch)
+            except Exception as e:
+                # Log error but don't crash the writer
+                print(f"Error flushing buffered writes: {e}")
+    
+    @staticmethod
+    def _write(batch):
+        """Apply a batch in one transaction, grouping runs of the same statement"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                start = 0
+                while start < len(batch):
+                    query = batch[start][0]
+                    end = start
+                    while end < len(batch) and batch[end][0] == query:
+                        end += 1
+                    cursor.executemany(query, [params for _, params in batch[start:end]])
+                    start = end
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+class SlidingWindowCounter:
+    """Event counts over several trailing windows, in per-minute buckets
+    
+    Each key keeps a deque of [minute, count] buckets plus a running total
+    and a head position per window, so recording an event and reading every
+    window are amortized O(1). Keys are evicted LRU-style beyond max_keys and
+    dropped once their newest bucket leaves the widest window.
+    """
+    
+    def __init__(self, windows_minutes, max_keys: int):
+        self.windows = tuple(windows_minutes)
+        self.widest = max(range(len(self.windows)), key=lambda i: self.windows[i])
+        self.max_keys = max_keys
+        self.series = OrderedDict()
+    
+    def add(self, key, when: float = None):
+        minute = int((when if when is not None else time.time()) // 60)
+        entry = self.series.get(key)
+        if entry is None:
+            # [buckets, offset of buckets[0], totals per window, head per window]
+            entry = [deque(), 0, [0] * len(self.windows), [0] * len(self.windows)]
+            self.series[key] = entry
+            if len(self.series) > self.max_keys:
+                self.series.popitem(last=False)
+        else:
+            self.series.move_to_end(key)
+        
+        buckets, offset, totals, heads = entry
+        if buckets and buckets[-1][0] == minute:
+            buckets[-1][1] += 1
+        else:
+            buckets.append([minute, 1])
+        for i in range(len(totals)):
+            totals[i] += 1
+    
+    def counts(self, key, now: float = None):
+        """Return the event count for every window, narrowest first"""
+        entry = self.series.get(key)
+        if entry is None:
+            return tuple(0 for _ in self.windows)
+        
+        minute = int((now if now is not None else time.time()) // 60)
+        buckets, offset, totals, heads = entry
+        for i, window in enumerate(self.windows):
+            while heads[i] - offset < len(buckets) and buckets[heads[i] - offset][0] <= minute - window:
+                totals[i] -= buckets[heads[i] - offset][1]
+                heads[i] += 1
+        # Buckets behind the widest window's head are no longer needed
+        while buckets and offset < heads[self.widest]:
+            buckets.popleft()
+            offset += 1
+        entry[1] = offset
+        if not buckets:
+            del self.series[key]
+        return tuple(totals)
+    
+    def clear(self, key):
+        self.series.pop(key, None)
+
+login_attempt_writer = BufferedWriter(LOGIN_ATTEMPT_FLUSH_MS)
+# Failed logins per username over 15 min, 30 min and 24 h
+failed_login_counter = SlidingWindowCounter((15, 30, 60*24), FAILED_LOGIN_MAX_KEYS)
+# Highest login_attempts id this worker's counters include
+login_attempts_synced_id = 0
+
+class PrincipalCache:
+    """Bounded TTL/LRU cache of authenticated principals keyed by username
+    
+    Also holds public profiles keyed by normalized account number.
+    Writers call invalidate() after committing. A load of the same key that
+    was already in flight when an invalidation happened is returned but not
+    stored, so a row read just before a write can never outlive it in the
+    cache. Invalidation stamps are kept per key, so a write to one user does
+    not stop loads of other users from being cached.
+    """
+    
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generation = 0
+        # Generation at which each key was last invalidated; loads that
+        # started before `floor` are never stored
+        self.invalidated = OrderedDict()
+        self.floor = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    async def load(self, username: str, loader):
+        """Return the cached principal, or fetch it with loader in the read executor"""
+        principal, generation = self.get(username)
+        if principal is not None:
+            return principal
+        
+        principal = await run_db(loader, username)
+        if principal is not None:
+            self.put(username, principal, generation)
+        return principal
+    
+    def get(self, key: str):
+        """Return (cached value or None, generation to hand back to put)"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], self.generation
+            self.misses += 1
+            return None, self.generation
+    
+    def put(self, key: str, value, generation: int):
+        """Store a value read after get() unless an invalidation happened since"""
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            if generation >= self.floor and self.invalidated.get(key, 0) <= generation:
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+    
+    def invalidate(self, username: str):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(username, None)
+            self.invalidated[username] = self.generation
+            self.invalidated.move_to_end(username)
+            if len(self.invalidated) > self.max_entries:
+                # Forgetting a stamp must not let an older load in
+                _, stamp = self.invalidated.popitem(last=False)
+                self.floor = max(self.floor, stamp)
+    
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.invalidated.clear()
+            self.floor = self.generation
+    
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+user_principals = PrincipalCache(PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_MAX)
+admin_principals = PrincipalCache(ADMIN_PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_MAX)
+recipient_profiles = PrincipalCache(RECIPIENT_CACHE_TTL, RECIPIENT_CACHE_MAX)
+# Highest principal_invalidations id this worker has applied
+principal_invalidations_synced_id = None
+
+def sync_principal_invalidations():
+    """Drop cached principals that any worker (or a manual edit) changed since the last sync"""
+    global principal_invalidations_synced_id
+    if principal_invalidations_synced_id is None:
+        # Caches start empty, so earlier changes need no replay
+        row = db_fetchone("SELECT COALESCE(MAX(id), 0) AS last_id FROM principal_invalidations")
+        principal_invalidations_synced_id = row["last_id"]
+        return 0
+    rows = db_fetchall(
+        "SELECT id, kind, username FROM principal_invalidations WHERE id > ? ORDER BY id",
+        (principal_invalidations_synced_id,)
+    )
+    for row in rows:
+        (admin_principals if row["kind"] == "admin" else user_principals).invalidate(row["username"])
+    if rows:
+        principal_invalidations_synced_id = rows[-1]["id"]
+    return len(rows)
+
+async def run_principal_sync():
+    """Background job: apply principal changes made by other workers"""
+    while True:
+        await asyncio.sleep(max(PRINCIPAL_SYNC_SECONDS, 0.1))
+        try:
+            await run_db(sync_principal_invalidations)
+        except Exception as e:
+            print(f"WARNING: principal cache sync failed: {e}")
+
+principal_sync = None
+
+# Typed defaults for every system_settings key the application reads; also
+# used when a stored value does not parse
+SETTING_DEFAULTS = {
+    "max_login_attempts": 5,
+    "lockout_duration_minutes": 15,
+    "lockout_tier_minutes": (5, 60, 1440),
+    "require_2fa_admins": True,
+    "transaction_limit": 10000.0,
+    "session_timeout_minutes": ACCESS_TOKEN_EXPIRE_MINUTES,
+}
+
+def parse_setting(key: str, value: str):
+    """Convert a stored setting to the type of its default"""
+    default = SETTING_DEFAULTS[key]
+    if isinstance(default, bool):
+        return value.strip().lower() == "true"
+    if isinstance(default, tuple):
+        parsed = tuple(int(part) for part in value.split(","))
+        if len(parsed) != len(default):
+            raise ValueError(f"expected {len(default)} comma-separated values")
+        return parsed
+    return type(default)(value)
+
+class SettingsCache:
+    """Per-worker copy of system_settings
+    
+    Request handlers read values from memory and never query the table.
+    refresh() runs on a dedicated read-only connection: PRAGMA data_version
+    only changes when another connection has committed, so an idle database
+    costs one pragma per check and a changed one a single small SELECT.
+    """
+    
+    def __init__(self):
+        self.values = dict(SETTING_DEFAULTS)
+        self.conn = None
+        self.data_version = None
+        self.lock = threading.Lock()
+        self.reloads = 0
+        self.warned = set()
+    
+    def get(self, key: str):
+        return self.values[key]
+    
+    def refresh(self) -> bool:
+        """Reread the table if the database changed since the last check; True if a value changed"""
+        with self.lock:
+            if self.conn is None:
+                self.conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+                self.conn.execute("PRAGMA query_only = ON;")
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self.data_version:
+                return False
+            self.data_version = version
+            rows = self.conn.execute("SELECT setting_key, setting_value FROM system_settings").fetchall()
+        
+        values = dict(SETTING_DEFAULTS)
+        for key, value in rows:
+            if key not in values:
+                continue
+            try:
+                values[key] = parse_setting(key, value)
+            except ValueError as e:
+                if (key, value) not in self.warned:
+                    self.warned.add((key, value))
+                    print(f"WARNING: Ignoring invalid setting {key}={value!r} ({e}), using {values[key]!r}")
+        if values == self.values:
+            return False
+        # Swap the whole dict so readers never see a half-applied update
+        self.values = values
+        self.reloads += 1
+        return True
+    
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+                self.data_version = None
+
+settings_cache = SettingsCache()
+
+async def run_settings_refresh():
+    """Background job: pick up system_settings changes made by any worker"""
+    while True:
+        await asyncio.sleep(max(SETTINGS_REFRESH_SECONDS, 0.1))
+        try:
+            await run_db(settings_cache.refresh)
+        except Exception as e:
+            print(f"WARNING: settings refresh failed: {e}")
+
+settings_refresher = None
+
+class TokenRevocations:
+    """Per-worker view of revoked user token generations
+    
+    User tokens carry the user's generation ("gen") and the global
+    generation ("ggen") at the time they were issued. Revoking bumps one of
+    them, and any token issued before that is rejected. Checking a token is
+    two dict lookups and two int comparisons.
+    
+    Per-user entries only make a revocation take effect before cached
+    principals expire: get_current_user also compares "gen" with the
+    token_generation loaded with the principal, so pruning an entry early
+    (for example after session_timeout_minutes was lowered) never brings a
+    revoked token back.
+    """
+    
+    def __init__(self):
+        self.users = {}
+        self.global_generation = 0
+        self.last_id = 0
+        self.lock = threading.Lock()
+    
+    def is_revoked(self, username: str, payload: dict) -> bool:
+        if payload.get("ggen", 0) < self.global_generation:
+            return True
+        entry = self.users.get(username)
+        return entry is not None and payload.get("gen", 0) < entry[0]
+    
+    def apply(self, revocations):
+        """Merge (username, generation, expires_at) rows; username None is global"""
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            # Copy on write: requests read self.users without the lock
+            users = {name: entry for name, entry in self.users.items() if entry[1] > now}
+            for username, generation, expires_at in revocations:
+                if username is None:
+                    self.global_generation = max(self.global_generation, generation)
+                elif expires_at > now and generation > users.get(username, (0,))[0]:
+                    users[username] = (generation, expires_at)
+            self.users = users
+    
+    def sync(self):
+        """Pick up revocations committed by any worker since the last sync"""
+        rows = db_fetchall(
+            "SELECT id, username, generation, expires_at FROM token_revocations WHERE id > ? ORDER BY id",
+            (self.last_id,)
+        )
+        # Also drops expired entries when nothing new arrived
+        self.apply([(row["username"], row["generation"], row["expires_at"]) for row in rows])
+        if rows:
+            self.last_id = rows[-1]["id"]
+        return len(rows)
+    
+    def stats(self):
+        return {"users": len(self.users), "global_generation": self.global_generation}
+
+token_revocations = TokenRevocations()
+
+async def run_token_revocation_sync():
+    """Background job: apply token revocations made by other workers"""
+    while True:
+        await asyncio.sleep(max(TOKEN_REVOCATION_SYNC_SECONDS, 0.1))
+        try:
+            await run_db(token_revocations.sync)
+        except Exception as e:
+            print(f"WARNING: token revocation sync failed: {e}")
+
+token_revocation_sync = None
+
+class EventSubscriber:
+    """One live admin stream: a bounded backlog plus coalesced counters"""
+    
+    def __init__(self, backlog: int):
+        self.items = deque(maxlen=backlog)
+        self.counts = {}
+        self.snapshot = None
+        self.dropped = 0
+        self.closed = False
+        self.wakeup = asyncio.Event()
+    
+    def drain(self):
+        """Take everything queued so far as (event, data) pairs"""
+        self.wakeup.clear()
+        if self.dropped:
+            # Too far behind to replay; the client reloads everything once
+            events = [("resync", {"dropped": self.dropped})]
+            self.items.clear()
+            self.counts = {}
+            self.snapshot = None
+            self.dropped = 0
+            return events
+        
+        events = []
+        if self.snapshot is not None:
+            events.append(("dashboard", self.snapshot))
+            self.snapshot = None
+        events.extend(self.items)
+        self.items.clear()
+        if self.counts:
+            events.append(("counts", self.counts))
+            self.counts = {}
+        return events
+
+class EventHub:
+    """In-process fan-out of admin panel events to live streams
+    
+    Publishing never blocks and never touches the database. Each worker
+    computes one dashboard snapshot per interval for all of its subscribers,
+    so extra admin tabs add no query load.
+    """
+    
+    # Events delivered as a running count instead of one by one
+    COALESCED = ("failed_login",)
+    
+    def __init__(self, backlog: int, snapshot_interval: float):
+        self.backlog = backlog
+        self.snapshot_interval = snapshot_interval
+        self.subscribers = set()
+        self.loop = None
+        self.loop_thread = None
+        self.task = None
+    
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.task = asyncio.create_task(self._snapshots())
+    
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self._close_streams()
+        self.loop = None
+    
+    def _close_streams(self):
+        for subscriber in self.subscribers:
+            subscriber.closed = True
+            subscriber.wakeup.set()
+    
+    def subscribe(self) -> EventSubscriber:
+        subscriber = EventSubscriber(self.backlog)
+        self.subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber: EventSubscriber):
+        self.subscribers.discard(subscriber)
+    
+    def publish(self, events):
+        """Fan out (event, data) pairs; safe to call from any thread"""
+        loop = self.loop
+        if loop is None:
+            return
+        if threading.get_ident() == self.loop_thread:
+            self._deliver(events)
+            return
+        try:
+            loop.call_soon_threadsafe(self._deliver, events)
+        except RuntimeError:
+            # Loop already closed during shutdown
+            pass
+    
+    def _deliver(self, events):
+        for subscriber in self.subscribers:
+            for event, data in events:
+                if event in self.COALESCED:
+                    subscriber.counts[event] = subscriber.counts.get(event, 0) + 1
+                elif event == "dashboard":
+                    subscriber.snapshot = data
+                else:
+                    if len(subscriber.items) == subscriber.items.maxlen:
+                        subscriber.dropped += 1
+                    subscriber.items.append((event, data))
+            subscriber.wakeup.set()
+    
+    async def _snapshots(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            if not self.subscribers:
+                continue
+            try:
+                stats = await run_db(compute_dashboard_stats)
+            except Exception as e:
+                print(f"WARNING: dashboard snapshot failed: {e}")
+                continue
+            dashboard_cache.update(expires=time.monotonic() + DASHBOARD_CACHE_TTL, stats=stats)
+            self._deliver([("dashboard", stats.model_dump())])
+
+event_hub = EventHub(EVENT_STREAM_BACKLOG, EVENT_SNAPSHOT_SECONDS)
+
+def emit_event(cursor, event: str, data: dict):
+    """Queue an admin panel event that is published when the cursor's transaction commits"""
+    cursor.connection.pending_events.append((event, data))
+
+# Helper functions
+def verify_password_complexity(password: str) -> bool:
+    """Verify password meets complexity requirements"""
+    if len(password) < 8:
+        return False
+    if not any(c.islower() for c in password):
+        return False
+    if not any(c.isupper() for c in password):
+        return False
+    if not any(c.isdigit() for c in password):
+        return False
+    if not any(c in "!@#$%^&*()-_=+[]{}|;:'\",.<>?/`~" for c in password):
+        return False
+    return True
+
+def encode_cursor(*values) -> str:
+    """Encode the sort key of the last row on a page as an opaque cursor"""
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[list]:
+    """Decode a cursor produced by encode_cursor, validating its shape"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+    return values
+
+def clamp_page_size(limit: int) -> int:
+    """Keep requested page sizes within sane bounds"""
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+# Streaming exports
+class ExportCursor:
+    """A query on a read-only pooled connection, fetched chunk by chunk in the read executor
+    
+    The lock keeps close() from returning the connection to the pool while
+    a fetch is still running in another thread after the client went away.
+    A query with a {transactions} placeholder is run against every archive
+    overlapping [lower_id, upper_id) (and holding rows of user_id, if given),
+    oldest first, and then the main table; with a sharded ledger, against
+    each of the given shards (default all).
+    """
+    
+    def __init__(self, query: str, params, lower_id: int = None, upper_id: int = None, shards: list = None,
+                 user_id: str = None):
+        self.query = query
+        self.params = params
+        self.lower_id = lower_id
+        self.upper_id = upper_id
+        self.shards = shards
+        self.user_id = user_id
+        self.partitions = []
+        self.attached = False
+        self.conn = None
+        self.cursor = None
+        self.lock = threading.Lock()
+    
+    def open(self):
+        """Start the query and return its column names"""
+        with self.lock:
+            self.conn = read_pool.acquire()
+            if "{transactions}" in self.query and ledger_shards is not None:
+                self.partitions = ledger_shards.partitions(self.shards)
+            elif "{transactions}" in self.query:
+                self.partitions = transaction_partitions(self.conn, self.lower_id, self.upper_id, self.user_id)
+            else:
+                self.partitions = [(None, None)]
+            self._next_partition()
+            return [column[0] for column in self.cursor.description]
+    
+    def _next_partition(self):
+        if self.attached:
+            self.cursor.close()
+            self.conn.execute("DETACH DATABASE archive")
+            self.attached = False
+        path, table = self.partitions.pop()
+        if path is not None:
+            # Set first: if ATTACH fails part-way, close() finds out by detaching
+            self.attached = True
+            self.conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        query = self.query.format(transactions=table) if table else self.query
+        self.cursor = self.conn.execute(query, self.params)
+    
+    def fetch(self, size: int):
+        with self.lock:
+            rows = self.cursor.fetchmany(size)
+            while not rows and self.partitions:
+                self._next_partition()
+                rows = self.cursor.fetchmany(size)
+            return rows
+    
+    def close(self):
+        with self.lock:
+            if self.conn is None:
+                return
+            conn, self.conn = self.conn, None
+            discard = False
+            try:
+                # open() may have failed before the query started
+                if self.cursor is not None:
+                    self.cursor.close()
+                    self.cursor = None
+                if self.attached:
+                    conn.execute("DETACH DATABASE archive")
+                    self.attached = False
+            except sqlite3.Error:
+                # Unknown attachment state: do not hand the connection out again
+                discard = True
+            finally:
+                read_pool.release(conn, discard)
+
+active_exports = 0
+
+class ExportSlot:
+    """One of the EXPORT_MAX_CONCURRENT export slots, reserved before the response is returned
+    
+    release() is idempotent. The stream releases it when it ends; the
+    response's background task and garbage collection cover streams that
+    never start, for example when the client disconnects first.
+    """
+    
+    def __init__(self):
+        global active_exports
+        active_exports += 1
+        self.held = True
+    
+    def release(self):
+        global active_exports
+        if self.held:
+            self.held = False
+            active_exports -= 1
+    
+    def __del__(self):
+        self.release()
+
+def parse_export_bound(value: Optional[str], name: str) -> Optional[str]:
+    """Normalize an ISO 8601 date or datetime to the stored UTC timestamp format"""
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid {name}: use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS"
+        )
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+def export_response(query: str, params, export_format: str, filename: str,
+                    lower_id: int = None, upper_id: int = None, shards: list = None,
+                    user_id: str = None) -> StreamingResponse:
+    """Stream a query's rows as CSV or NDJSON without materializing them"""
+    if export_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    if active_exports >= EXPORT_MAX_CONCURRENT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many exports running, try again shortly",
+            headers={"Retry-After": "30"}
+        )
+    slot = ExportSlot()
+    
+    async def stream():
+        export = ExportCursor(query, params, lower_id, upper_id, shards, user_id)
+        try:
+            columns = await run_db(export.open)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if export_format == "csv":
+                writer.writerow(columns)
+            while True:
+                rows = await run_db(export.fetch, EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                if export_format == "csv":
+                    writer.writerows(rows)
+                else:
+                    for row in rows:
+                        buffer.write(json.dumps(dict(zip(columns, row))))
+                        buffer.write("\n")
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        finally:
+            slot.release()
+            # Never await here: the stream may be closing because it was cancelled
+            if db_executor is None:
+                export.close()
+            else:
+                db_executor.submit(export.close)
+    
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    extension = "csv" if export_format == "csv" else "ndjson"
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'},
+        background=BackgroundTask(slot.release)
+    )
+
+def record_login_attempt(username: str, ip: str, success: bool):
+    """Record login attempt in the in-memory counters; the row is written in the background"""
+    if not success:
+        failed_login_counter.add(username)
+    login_attempt_writer.add(
+        "INSERT INTO login_attempts (username, ip, success, origin) VALUES (?, ?, ?, ?)",
+        (username, ip, 1 if success else 0, worker_id_lease.owner)
+    )
+    if not success:
+        login_attempt_writer.add(*stats_upsert(failed_logins=1))
+        queue_failed_login_rollup(username)
+
+# Hour in which failed_logins_hourly was last pruned by this worker
+failed_login_rollup_pruned = None
+
+def queue_failed_login_rollup(username: str):
+    """Count a failed login in the per-user hourly rollup, pruning expired hours once an hour"""
+    global failed_login_rollup_pruned
+    hour = stats_hour()
+    login_attempt_writer.add('''
+        INSERT INTO failed_logins_hourly (username, hour, failures) VALUES (?, ?, 1)
+        ON CONFLICT(username, hour) DO UPDATE SET failures = failures + 1
+    ''', (username, hour))
+    if failed_login_rollup_pruned != hour:
+        failed_login_rollup_pruned = hour
+        login_attempt_writer.add("DELETE FROM failed_logins_hourly WHERE hour < ?", (last_24h_start(),))
+
+def fetch_user_infos(query: str, params=()):
+    """Run a users query and attach each row's failed logins from the last 24 hours
+    
+    The counts come from failed_logins_hourly in one indexed lookup for the
+    whole page instead of a login_attempts subquery per row.
+    """
+    with db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        users = [dict(row) for row in cursor.fetchall()]
+        if not users:
+            return users
+        
+        usernames = [user["username"] for user in users]
+        cursor.execute(f"""
+            SELECT username, SUM(failures) FROM failed_logins_hourly
+            WHERE username IN ({", ".join("?" * len(usernames))}) AND hour >= ?
+            GROUP BY username
+        """, (*usernames, last_24h_start()))
+        failures = dict(cursor.fetchall())
+    
+    if ledger_shards is not None:
+        balances = ledger_shards.balances(users)
+        for user in users:
+            user["balance"] = balances.get(user["username"], user["balance"])
+    for user in users:
+        user["failed_attempts"] = failures.get(user["username"], 0)
+        user["is_locked"] = bool(user.get("is_locked", 0))
+        user["two_factor_enabled"] = bool(user.get("two_factor_enabled", 0))
+    return users
+
+def count_failed_attempts(username: str):
+    """Failed attempts in the last 15 min, 30 min and 24 h for a username"""
+    return failed_login_counter.counts(username)
+
+def apply_login_attempts(rows):
+    """Replay login_attempts rows in id order: a failure counts, a success clears the user"""
+    for row in rows:
+        if row["success"]:
+            failed_login_counter.clear(row["username"])
+            continue
+        try:
+            when = calendar.timegm(time.strptime(row["timestamp"], "%Y-%m-%d %H:%M:%S"))
+        except (TypeError, ValueError):
+            continue
+        failed_login_counter.add(row["username"], when)
+
+def load_failed_login_counters():
+    """Rebuild the in-memory counters from the last 24 hours of login_attempts"""
+    global login_attempts_synced_id
+    with db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM login_attempts")
+        last_id = cursor.fetchone()[0]
+        # Successes too, so failures a login cleared stay cleared
+        cursor.execute("""
+            SELECT id, username, success, timestamp FROM login_attempts
+            WHERE success IN (0, 1) AND timestamp >= datetime('now', '-24 hours') AND id <= ?
+            ORDER BY id
+        """, (last_id,))
+        apply_login_attempts(cursor.fetchall())
+    login_attempts_synced_id = last_id
+
+def fetch_login_attempts(after_id: int) -> list:
+    """Login attempts written after after_id, oldest first"""
+    return db_fetchall(
+        "SELECT id, username, success, timestamp, origin FROM login_attempts WHERE id > ? ORDER BY id LIMIT 10000",
+        (after_id,)
+    )
+
+async def sync_failed_login_counters():
+    """Fold in the login attempts other workers wrote since the last sync"""
+    global login_attempts_synced_id
+    rows = await run_db(fetch_login_attempts, login_attempts_synced_id)
+    if rows:
+        login_attempts_synced_id = rows[-1]["id"]
+        # This worker's own attempts are already counted
+        apply_login_attempts([row for row in rows if row["origin"] != worker_id_lease.owner])
+    return len(rows)
+
+async def run_failed_login_sync():
+    """Background job: count failed logins seen by other workers"""
+    while True:
+        await asyncio.sleep(max(FAILED_LOGIN_SYNC_SECONDS, 0.1))
+        try:
+            await sync_failed_login_counters()
+        except Exception as e:
+            print(f"WARNING: failed-login counter sync failed: {e}")
+
+failed_login_sync = None
+
+def lock_user(username: str, minutes: int):
+    """Lock user account - FIXED"""
+    locked_until = (datetime.utcnow() + timedelta(minutes=minutes)).isoformat()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE users SET locked_until = ? WHERE username = ?",
+            (locked_until, username)
+        )
+        bump_stats(cursor, locks=1)
+        emit_event(cursor, "lock", {"username": username, "locked_until": locked_until})
+        conn.commit()
+    user_principals.invalidate(username)
+
+def is_user_locked(user_row):
+    """Check if user is locked - FIXED VERSION"""
+    locked = user_row.get("locked_until")
+    if not locked:
+        return False, None
+    
+    try:
+        # Try parsing with timezone
+        locked_dt = datetime.fromisoformat(locked)
+    except ValueError:
+        try:
+            # Try without timezone
+            locked_dt = datetime.strptime(locked, "%Y-%m-%d %H:%M:%S")
+        except Exception:
+            # Invalid format, clear it
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE users SET locked_until = NULL WHERE username = ?", (user_row["username"],))
+                conn.commit()
+            user_principals.invalidate(user_row["username"])
+            return False, None
+    
+    # Check if lock is expired
+    if locked_dt > datetime.utcnow():
+        return True, locked_dt
+    else:
+        # Lock expired, clear it
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE users SET locked_until = NULL WHERE username = ?", (user_row["username"],))
+            conn.commit()
+        user_principals.invalidate(user_row["username"])
+        return False, None
+def clear_failed_attempts(username: str, ip: str):
+    """Record a successful login and delete the user's failed attempts in one transaction"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO login_attempts (username, ip, success, origin) VALUES (?, ?, 1, ?)",
+            (username, ip, worker_id_lease.owner)
+        )
+        cursor.execute("DELETE FROM login_attempts WHERE username = ? AND success = 0", (username,))
+        cursor.execute("DELETE FROM failed_logins_hourly WHERE username = ?", (username,))
+        conn.commit()
+
+async def register_failed_login(username: str, ip: str):
+    """Record a failed login and apply the tiered lockout policy"""
+    record_login_attempt(username, ip, False)
+    event_hub.publish([("failed_login", {"username": username, "ip": ip})])
+    fails_15m, fails_30m, fails_24h = count_failed_attempts(username)
+    # Tiers trip at one, two and three times max_login_attempts
+    attempts = settings_cache.get("max_login_attempts")
+    short_lock, long_lock, day_lock = settings_cache.get("lockout_tier_minutes")
+    
+    if attempts <= fails_15m < 2 * attempts:
+        await run_db_write(lock_user, username, short_lock)
+    elif 2 * attempts <= fails_30m < 3 * attempts:
+        await run_db_write(lock_user, username, long_lock)
+    elif fails_24h >= 3 * attempts:
+        await run_db_write(lock_user, username, day_lock)
+
+async def register_successful_login(username: str, ip: str):
+    """Record a successful login and reset the failure count
+    
+    The rows are deleted before the login returns, after any queued failures
+    are written, so a worker restarting right after cannot count them again.
+    """
+    failed_login_counter.clear(username)
+    await login_attempt_writer.flush()
+    await run_db_write(clear_failed_attempts, username, ip)
+
+def update_last_login(username: str, table: str = "users"):
+    """Stamp last_login for a user or admin"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"UPDATE {table} SET last_login = CURRENT_TIMESTAMP WHERE username = ?",
+            (username,)
+        )
+        conn.commit()
+    (admin_principals if table == "admins" else user_principals).invalidate(username)
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    """Create JWT access token"""
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(minutes=settings_cache.get("session_timeout_minutes"))
+    to_encode.update({"exp": expire, "ggen": token_revocations.global_generation})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+def revoke_tokens(cursor, username: Optional[str] = None):
+    """Bump one user's token generation, or the global one, and record it for the other workers
+    
+    Returns the (username, generation, expires_at) revocation, or None if the
+    user does not exist. The row is kept for a session lifetime, and at
+    least as long as a principal stays cached.
+    """
+    now = datetime.utcnow()
+    if username is None:
+        cursor.execute("SELECT COALESCE(MAX(generation), 0) + 1 FROM token_revocations WHERE username IS NULL")
+    else:
+        cursor.execute(
+            "UPDATE users SET token_generation = token_generation + 1 WHERE username = ? RETURNING token_generation",
+            (username,)
+        )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    
+    # Outlive every cached principal that predates the bump; after that the
+    # principal's token_generation rejects old tokens by itself
+    lifetime = max(settings_cache.get("session_timeout_minutes") * 60, PRINCIPAL_CACHE_TTL)
+    expires_at = (now + timedelta(seconds=lifetime)).strftime("%Y-%m-%d %H:%M:%S")
+    cursor.execute(
+        "DELETE FROM token_revocations WHERE username IS NOT NULL AND expires_at <= ?",
+        (now.strftime("%Y-%m-%d %H:%M:%S"),)
+    )
+    cursor.execute(
+        "INSERT INTO token_revocations (username, generation, expires_at) VALUES (?, ?, ?)",
+        (username, row[0], expires_at)
+    )
+    return username, row[0], expires_at
+
+def set_user_password(username: str, hashed_password: str, unlock: bool = False) -> int:
+    """Store a new password hash and revoke every token issued so far; returns the new generation"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE users SET hashed_password = ?"
+            + (", locked_until = NULL" if unlock else "")
+            + " WHERE username = ?",
+            (hashed_password, username)
+        )
+        revocation = revoke_tokens(cursor, username)
+        conn.commit()
+    user_principals.invalidate(username)
+    if revocation is None:
+        return 0
+    token_revocations.apply([revocation])
+    return revocation[1]
+
+def revoke_all_user_tokens() -> int:
+    """Revoke every user token issued so far; returns the new global generation"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        revocation = revoke_tokens(cursor)
+        conn.commit()
+    token_revocations.apply([revocation])
+    return revocation[1]
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """Get current user from JWT token"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+    
+    if token_revocations.is_revoked(username, payload):
+        raise credentials_exception
+    
+    user = await user_principals.load(username, get_user_principal)
+    
+    if user is None or payload.get("gen", 0) < user["token_generation"]:
+        raise credentials_exception
+    
+    return user
+
+def get_user_by_username(username: str):
+    """Get user by username"""
+    with db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+        user_row = cursor.fetchone()
+        return dict(user_row) if user_row else None
+
+def get_user_principal(username: str):
+    """Get the cacheable view of a user: no secrets and no balance"""
+    return db_fetchone(
+        "SELECT id, username, account_number, email, role, is_active, created_at, last_login, "
+        "locked_until, totp_secret IS NOT NULL AS has_2fa, token_generation FROM users WHERE username = ?",
+        (username,)
+    )
+
+def generate_account_number(username: str) -> str:
+    """Generate unique account number from username"""
+    import hashlib
+    hash_object = hashlib.sha256(username.encode())
+    hex_dig = hash_object.hexdigest()
+    raw_number = hex_dig[:16].upper()
+    account_number = '-'.join(raw_number[i:i+4] for i in range(0, 16, 4))
+    return account_number
+
+class SnowflakeGenerator:
+    """Thread-safe generator of time-ordered 64-bit IDs"""
+    
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id & 0x3FF
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+    
+    def next_id(self) -> int:
+        with self.lock:
+            # Never step backwards if the wall clock does
+            now_ms = max(int(time.time() * 1000) - SNOWFLAKE_EPOCH_MS, self.last_ms)
+            if now_ms == self.last_ms:
+                self.sequence = (self.sequence + 1) & 0xFFF
+                if self.sequence == 0:
+                    # 4096 IDs this millisecond; borrow the next one
+                    now_ms += 1
+            else:
+                self.sequence = 0
+            self.last_ms = now_ms
+            return (now_ms << 22) | (self.worker_id << 12) | self.sequence
+
+# The worker number is set by worker_id_lease.claim() once the schema exists
+transaction_ids = SnowflakeGenerator(0)
+
+class WorkerIdLease:
+    """This process's lease on a snowflake worker number
+    
+    Two processes sharing a worker number would generate the same IDs in
+    the same millisecond. claim() takes the number whose lease expired
+    longest ago (or an unused one) inside BEGIN IMMEDIATE, so concurrently
+    starting workers never get the same one. A daemon thread renews the
+    lease, also in processes that never run the ASGI startup hooks.
+    """
+    
+    def __init__(self):
+        self.worker_id = None
+        self.owner = None
+        self.pid = None
+        self.thread = None
+        self.stop = threading.Event()
+    
+    def claim(self):
+        """Lease a worker number (or record TX_ID_WORKER) and point transaction_ids at it"""
+        self.pid = os.getpid()
+        self.owner = f"{socket.gethostname()}:{self.pid}:{secrets.token_hex(4)}"
+        now = datetime.utcnow()
+        stamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        cutoff = (now - timedelta(seconds=WORKER_ID_LEASE_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                if TX_ID_WORKER is not None:
+                    worker_id = TX_ID_WORKER & 0x3FF
+                    cursor.execute("SELECT owner, heartbeat_at, last_ms FROM worker_ids WHERE worker_id = ?",
+                                   (worker_id,))
+                    row = cursor.fetchone()
+                    if row is not None and row["heartbeat_at"] >= cutoff:
+                        print(f"WARNING: TX_ID_WORKER={worker_id} is also leased by {row['owner']}; "
+                              "transaction IDs may collide")
+                else:
+                    cursor.execute(
+                        "SELECT worker_id, last_ms FROM worker_ids WHERE heartbeat_at < ? "
+                        "ORDER BY heartbeat_at LIMIT 1",
+                        (cutoff,)
+                    )
+                    row = cursor.fetchone()
+                    if row is not None:
+                        worker_id = row["worker_id"]
+                    else:
+                        # Numbers are never deleted, so the unused ones start at the row count
+                        cursor.execute("SELECT COUNT(*) FROM worker_ids")
+                        worker_id = cursor.fetchone()[0]
+                        if worker_id > 0x3FF:
+                            raise RuntimeError(
+                                "All 1024 transaction ID worker numbers are leased; "
+                                "stop some processes or wait for their leases to expire"
+                            )
+                last_ms = row["last_ms"] if row is not None else -1
+                cursor.execute("""
+                    INSERT INTO worker_ids (worker_id, owner, heartbeat_at, last_ms) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (worker_id) DO UPDATE SET owner = excluded.owner,
+                        heartbeat_at = excluded.heartbeat_at
+                """, (worker_id, self.owner, stamp, last_ms))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        
+        with transaction_ids.lock:
+            transaction_ids.worker_id = worker_id
+            transaction_ids.last_ms = max(transaction_ids.last_ms, last_ms)
+        if self.worker_id is None:
+            atexit.register(self.release)
+        self.worker_id = worker_id
+        if self.thread is None or not self.thread.is_alive():
+            self.stop.clear()
+            self.thread = threading.Thread(target=self._renew, name="worker-id-lease", daemon=True)
+            self.thread.start()
+        return worker_id
+    
+    def heartbeat(self) -> bool:
+        """Renew the lease; False if another process has taken the number over"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE worker_ids SET heartbeat_at = ?, last_ms = ? WHERE worker_id = ? AND owner = ?",
+                (datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), transaction_ids.last_ms,
+                 self.worker_id, self.owner)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+    
+    def _renew(self):
+        while not self.stop.wait(max(WORKER_ID_LEASE_SECONDS / 3, 1)):
+            if os.getpid() != self.pid:
+                return
+            try:
+                if not self.heartbeat():
+                    # Stalled past the lease (e.g. suspended); never keep using a number someone else holds
+                    print(f"WARNING: lost the lease on transaction ID worker {self.worker_id}, claiming another")
+                    self.claim()
+            except Exception as e:
+                print(f"WARNING: renewing the transaction ID worker lease failed: {e}")
+    
+    def release(self):
+        """Let the next process take the number over at once, keeping last_ms"""
+        self.stop.set()
+        if self.worker_id is None or os.getpid() != self.pid:
+            return
+        try:
+            self._release()
+        except Exception as e:
+            print(f"WARNING: releasing transaction ID worker {self.worker_id} failed: {e}")
+    
+    def _release(self):
+        with db_connection() as conn:
+            conn.execute(
+                "UPDATE worker_ids SET heartbeat_at = ?, last_ms = ? WHERE worker_id = ? AND owner = ?",
+                ("1970-01-01 00:00:00", transaction_ids.last_ms, self.worker_id, self.owner)
+            )
+            conn.commit()
+
+worker_id_lease = WorkerIdLease()
+
+def generate_transaction_id() -> int:
+    """Generate a unique, time-ordered transaction ID"""
+    return transaction_ids.next_id()
+
+def snowflake_timestamp(transaction_id: int) -> str:
+    """UTC timestamp (stored format) encoded in a transaction ID"""
+    when = datetime.utcfromtimestamp(SNOWFLAKE_EPOCH_SECONDS) + timedelta(milliseconds=transaction_id >> 22)
+    return when.strftime("%Y-%m-%d %H:%M:%S")
+
+def snowflake_floor(timestamp: str) -> int:
+    """Smallest transaction ID created at or after a stored-format UTC timestamp"""
+    when = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    floor = (int(when.timestamp() * 1000) - SNOWFLAKE_EPOCH_MS) << 22
+    # Keep far-off bounds within SQLite's 64-bit integers
+    return max(-(1 << 63), min(floor, (1 << 63) - 1))
+
+def public_transaction_id(row: dict) -> str:
+    """ID shown to clients: the original string for migrated rows, else the snowflake as a string
+    
+    Snowflakes exceed 2**53, so they are sent as strings to stay exact in JavaScript.
+    """
+    return row.get("legacy_id") or str(row["id"])
+
+def insert_transactions(cursor, transactions: list):
+    """Insert transaction rows in one executemany on the caller's cursor without committing"""
+    ids = [generate_transaction_id() for _ in transactions]
+    cursor.executemany('''
+        INSERT INTO transactions (id, user_id, type, amount, description, balance_after, related_account, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (
+            transaction_id,
+            transaction["user_id"],
+            transaction["type"],
+            transaction["amount"],
+            transaction.get("description"),
+            transaction.get("balance_after"),
+            transaction.get("related_account"),
+            snowflake_timestamp(transaction_id)
+        )
+        for transaction_id, transaction in zip(ids, transactions)
+    ])
+    bump_stats(
+        cursor,
+        transactions=len(transactions),
+        transaction_total=sum(transaction["amount"] for transaction in transactions)
+    )
+    for transaction_id, transaction in zip(ids, transactions):
+        emit_event(cursor, "transaction", {
+            "id": str(transaction_id),
+            "from_account": transaction["user_id"],
+            "to_account": transaction.get("related_account"),
+            "amount": transaction["amount"],
+            "transaction_type": transaction["type"],
+            "status": "completed",
+            "timestamp": snowflake_timestamp(transaction_id).replace(" ", "T"),
+            "is_flagged": False
+        })
+    return ids
+
+def insert_transaction(cursor, transaction: dict):
+    """Insert a transaction row on the caller's cursor without committing"""
+    return insert_transactions(cursor, [transaction])[0]
+
+def save_transaction(transaction: dict):
+    """Save transaction to database"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            insert_transaction(cursor, transaction)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+
+# Ledger engine
+# Every money movement runs as one BEGIN IMMEDIATE transaction: the write lock
+# is taken up front (so two writers can never deadlock upgrading a read lock),
+# balances are changed with conditional UPDATEs instead of read-modify-write,
+# and the whole movement is committed exactly once.
+def run_ledger_transaction(operation, *args):
+    """Run a ledger operation inside a single write transaction"""
+    return run_pool_transaction(write_pool, operation, *args)
+
+def run_pool_transaction(pool: ConnectionPool, operation, *args):
+    """Run an operation inside a single write transaction on a connection from pool"""
+    with pool_connection(pool) as conn:
+        for attempt in range(LEDGER_LOCK_RETRIES + 1):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == LEDGER_LOCK_RETRIES:
+                    raise
+                metrics.inc("simplebanking_db_lock_retries_total")
+                time.sleep(0.01 * (attempt + 1))
+        
+        try:
+            result = operation(conn.cursor(), *args)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return result
+
+def ledger_deposit(cursor, username: str, account_number: str, amount: float):
+    """Credit an account (runs inside a ledger transaction)"""
+    cursor.execute(
+        "UPDATE users SET balance = balance + ? WHERE username = ? RETURNING balance",
+        (amount, username)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    new_balance = float(row[0])
+    
+    insert_transaction(cursor, {
+        "user_id": username,
+        "type": "deposit",
+        "amount": amount,
+        "description": f"Deposit: ${amount:.2f}",
+        "balance_after": new_balance,
+        "related_account": account_number
+    })
+    
+    return {
+        "message": f"Deposited ${amount:.2f} successfully",
+        "new_balance": new_balance
+    }
+
+def ledger_withdraw(cursor, username: str, account_number: str, amount: float):
+    """Debit an account if it holds enough funds (runs inside a ledger transaction)"""
+    cursor.execute(
+        "UPDATE users SET balance = balance - ? WHERE username = ? AND balance >= ? RETURNING balance",
+        (amount, username, amount)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    new_balance = float(row[0])
+    
+    insert_transaction(cursor, {
+        "user_id": username,
+        "type": "withdrawal",
+        "amount": -amount,
+        "description": f"Withdrawal: ${amount:.2f}",
+        "balance_after": new_balance,
+        "related_account": account_number
+    })
+    
+    return {
+        "message": f"Withdrew ${amount:.2f} successfully",
+        "new_balance": new_balance
+    }
+
+def ledger_transfer(cursor, username: str, account_number: str,
+                    to_account_number: str, amount: float):
+    """Move funds between two accounts (runs inside a ledger transaction)"""
+    cursor.execute(
+        "SELECT username FROM users WHERE account_number = ?",
+        (to_account_number,)
+    )
+    recipient_row = cursor.fetchone()
+    if recipient_row is None:
+        raise HTTPException(status_code=404, detail="Recipient account not found")
+    recipient_username = recipient_row[0]
+    
+    cursor.execute(
+        "UPDATE users SET balance = balance - ? WHERE username = ? AND balance >= ? RETURNING balance",
+        (amount, username, amount)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    new_sender_balance = float(row[0])
+    
+    cursor.execute(
+        "UPDATE users SET balance = balance + ? WHERE username = ? RETURNING balance",
+        (amount, recipient_username)
+    )
+    new_recipient_balance = float(cursor.fetchone()[0])
+    
+    insert_transaction(cursor, {
+        "user_id": username,
+        "type": "transfer_sent",
+        "amount": -amount,
+        "description": f"Transfer to {to_account_number}",
+        "balance_after": new_sender_balance,
+        "related_account": to_account_number
+    })
+    insert_transaction(cursor, {
+        "user_id": recipient_username,
+        "type": "transfer_received",
+        "amount": amount,
+        "description": f"Transfer from {account_number}",
+        "balance_after": new_recipient_balance,
+        "related_account": account_number
+    })
+    
+    return {
+        "message": f"Transferred ${amount:.2f} to account {to_account_number}",
+        "new_balance": new_sender_balance
+    }
+
+def lookup_recipients(cursor, account_numbers) -> dict:
+    """Map account numbers to usernames with chunked IN (...) lookups"""
+    account_numbers = list(account_numbers)
+    recipients = {}
+    for start in range(0, len(account_numbers), SQL_IN_CHUNK):
+        chunk = account_numbers[start:start + SQL_IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(
+            f"SELECT account_number, username FROM users WHERE account_number IN ({placeholders})",
+            chunk
+        )
+        recipients.update(cursor.fetchall())
+    return recipients
+
+def ledger_transfer_batch(cursor, username: str, account_number: str,
+                          transfers: list, mode: str):
+    """Pay many recipients from one account (runs inside a ledger transaction)"""
+    recipients = lookup_recipients(cursor, {item["to_account_number"] for item in transfers})
+    results = []
+    limit = settings_cache.get("transaction_limit")
+    for index, item in enumerate(transfers):
+        error = None
+        if item["amount"] <= 0:
+            error = "Amount must be positive"
+        elif item["amount"] > limit:
+            error = f"Amount exceeds the transaction limit of ${limit:,.2f}"
+        elif item["to_account_number"] == account_number:
+            error = "Cannot transfer to yourself"
+        elif item["to_account_number"] not in recipients:
+            error = "Recipient account not found"
+        results.append({
+            "index": index,
+            "to_account_number": item["to_account_number"],
+            "amount": item["amount"],
+            "status": "failed" if error else "completed",
+            "error": error
+        })
+    
+    cursor.execute("SELECT balance FROM users WHERE username = ?", (username,))
+    row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    balance = float(row[0])
+    
+    # The write lock is held, so the balance cannot move under us. In
+    # best-effort mode payouts are accepted in request order while funds last.
+    total = 0.0
+    for result in results:
+        if result["error"] is None and mode == "best_effort" and total + result["amount"] > balance:
+            result["status"] = "failed"
+            result["error"] = "Insufficient funds"
+        elif result["error"] is None:
+            total += result["amount"]
+    
+    accepted = [result for result in results if result["error"] is None]
+    if mode == "all_or_nothing":
+        if len(accepted) < len(results):
+            for result in accepted:
+                result["status"] = "skipped"
+            raise HTTPException(
+                status_code=400,
+                detail={"message": "Batch rejected; no transfers were made", "results": results}
+            )
+        if total > balance:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
+    
+    if accepted:
+        cursor.execute(
+            "UPDATE users SET balance = balance - ? WHERE username = ? AND balance >= ? RETURNING balance",
+            (total, username, total)
+        )
+        if cursor.fetchone() is None:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
+        
+        credits = {}
+        for result in accepted:
+            recipient = recipients[result["to_account_number"]]
+            credits[recipient] = credits.get(recipient, 0.0) + result["amount"]
+        cursor.executemany(
+            "UPDATE users SET balance = balance + ? WHERE username = ?",
+            [(amount, recipient) for recipient, amount in credits.items()]
+        )
+        
+        # Recover each recipient's balance before the batch so every
+        # transfer_received row carries its own running balance
+        recipient_balances = {}
+        recipient_names = list(credits)
+        for start in range(0, len(recipient_names), SQL_IN_CHUNK):
+            chunk = recipient_names[start:start + SQL_IN_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(
+                f"SELECT username, balance FROM users WHERE username IN ({placeholders})",
+                chunk
+            )
+            for recipient, final_balance in cursor.fetchall():
+                recipient_balances[recipient] = float(final_balance) - credits[recipient]
+        
+        rows = []
+        sender_balance = balance
+        for result in accepted:
+            recipient = recipients[result["to_account_number"]]
+            sender_balance -= result["amount"]
+            recipient_balances[recipient] += result["amount"]
+            rows.append({
+                "user_id": username,
+                "type": "transfer_sent",
+                "amount": -result["amount"],
+                "description": f"Transfer to {result['to_account_number']}",
+                "balance_after": sender_balance,
+                "related_account": result["to_account_number"]
+            })
+            rows.append({
+                "user_id": recipient,
+                "type": "transfer_received",
+                "amount": result["amount"],
+                "description": f"Transfer from {account_number}",
+                "balance_after": recipient_balances[recipient],
+                "related_account": account_number
+            })
+        ids = insert_transactions(cursor, rows)
+        for result, transaction_id in zip(accepted, ids[::2]):
+            result["transaction_id"] = str(transaction_id)
+        balance -= total
+    
+    return {
+        "mode": mode,
+        "transferred": len(accepted),
+        "failed": len(results) - len(accepted),
+        "total_amount": total,
+        "new_balance": balance,
+        "results": results
+    }
+
+def apply_ledger_batch(cursor, batch):
+    """Apply queued ledger operations, isolating each one in a savepoint"""
+    outcomes = []
+    events = cursor.connection.pending_events
+    for operation, args in batch:
+        cursor.execute("SAVEPOINT ledger_op")
+        mark = len(events)
+        try:
+            result = operation(cursor, *args)
+        except Exception as e:
+            cursor.execute("ROLLBACK TO ledger_op")
+            del events[mark:]
+            cursor.execute("RELEASE ledger_op")
+            outcomes.append((False, e))
+            continue
+        cursor.execute("RELEASE ledger_op")
+        outcomes.append((True, result))
+    return outcomes
+
+class LedgerBatcher:
+    """Single writer task that group-commits ledger operations"""
+    
+    def __init__(self, window_ms: float, max_ops: int):
+        self.window = window_ms / 1000.0
+        self.max_ops = max_ops
+        self.queue = None
+        self.task = None
+    
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+    
+    async def submit(self, operation, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((operation, args, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_ops:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+    
+    async def _flush(self, batch):
+        futures = [future for _, _, future in batch]
+        try:
+            outcomes = await run_db_write(
+                run_ledger_transaction, apply_ledger_batch,
+                [(operation, args) for operation, args, _ in batch]
+            )
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for future, (ok, value) in zip(futures, outcomes):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+ledger_batcher = (
+    LedgerBatcher(LEDGER_BATCH_WINDOW_MS, LEDGER_BATCH_MAX_OPS)
+    if LEDGER_GROUP_COMMIT and LEDGER_SHARDS <= 1 else None
+)
+
+async def execute_ledger_operation(operation, *args):
+    """Apply a ledger operation, through the group-commit batcher or the shards when enabled"""
+    if ledger_shards is not None:
+        return await run_db_write(run_sharded_operation, operation, args)
+    if ledger_batcher is not None:
+        return await ledger_batcher.submit(operation, *args)
+    return await run_db_write(run_ledger_transaction, operation, *args)
+
+# Idempotency keys
+# A money-movement request sent with an Idempotency-Key stores its response
+# in idempotency_keys inside the same ledger transaction, so a key is applied
+# at most once even when retries race each other. Replays are answered from
+# an in-memory LRU first, then from the table, and never reach the ledger;
+# a retry arriving while the original is still running waits for it.
+# Failed requests roll back and store nothing, so they may be retried.
+class IdempotencyCache:
+    """Bounded LRU of stored responses keyed by (username, idempotency key)"""
+    
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, username: str, key: str):
+        with self.lock:
+            entry = self.entries.get((username, key))
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return None
+            self.entries.move_to_end((username, key))
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, username: str, key: str, stored: dict, created: float = None):
+        with self.lock:
+            self.entries[(username, key)] = ((created or time.time()) + self.ttl, stored)
+            self.entries.move_to_end((username, key))
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_TTL_HOURS * 3600, IDEMPOTENCY_CACHE_MAX)
+
+# Hour in which expired idempotency keys were last purged by this worker
+idempotency_keys_pruned = None
+# status_code of a key held by a cross-shard transfer that has not committed yet
+IDEMPOTENCY_PENDING = 0
+
+def idempotency_cutoff() -> str:
+    """Oldest created_at of a stored response that is still valid"""
+    cutoff = datetime.utcnow() - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    return cutoff.strftime("%Y-%m-%d %H:%M:%S")
+
+def load_idempotent_response(username: str, key: str, account_number: str):
+    """Fetch an unexpired stored response (from the account's shard when sharded)"""
+    query = '''
+        SELECT fingerprint, status_code, response, created_at FROM idempotency_keys
+        WHERE username = ? AND idempotency_key = ? AND created_at >= ?
+    '''
+    params = (username, key, idempotency_cutoff())
+    if ledger_shards is None:
+        row = db_fetchone(query, params)
+    else:
+        row = ledger_shards.fetchone(ledger_shards.index(account_number), query, params)
+    if row is None:
+        return None
+    created = datetime.strptime(row["created_at"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    return {
+        "fingerprint": row["fingerprint"],
+        "status_code": row["status_code"],
+        "response": json.loads(row["response"]),
+        "created": created.timestamp()
+    }
+
+def ledger_idempotent(cursor, username: str, key: str, fingerprint: str, operation, args):
+    """Run a ledger operation once per key, storing its response in the same transaction"""
+    global idempotency_keys_pruned
+    cursor.execute('''
+        SELECT fingerprint, status_code, response FROM idempotency_keys
+        WHERE username = ? AND idempotency_key = ? AND created_at >= ?
+    ''', (username, key, idempotency_cutoff()))
+    row = cursor.fetchone()
+    if row is not None:
+        # A concurrent retry committed first
+        return {"fingerprint": row[0], "status_code": row[1], "response": json.loads(row[2]), "replayed": True}
+    
+    result = operation(cursor, *args)
+    cursor.execute('''
+        INSERT OR REPLACE INTO idempotency_keys (username, idempotency_key, fingerprint, status_code, response)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (username, key, fingerprint, 200, json.dumps(result)))
+    
+    hour = stats_hour()
+    if idempotency_keys_pruned != hour:
+        idempotency_keys_pruned = hour
+        cursor.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (idempotency_cutoff(),))
+    return {"fingerprint": fingerprint, "status_code": 200, "response": result, "replayed": False}
+
+def replay_response(stored: dict, fingerprint: str):
+    """Return a stored response, refusing a key reused for a different request"""
+    if stored["fingerprint"] != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request"
+        )
+    if stored["status_code"] == IDEMPOTENCY_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still being processed"
+        )
+    return JSONResponse(
+        content=stored["response"],
+        status_code=stored["status_code"],
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+async def execute_idempotent(idempotency_key: Optional[str], username: str, endpoint: str, operation, *args):
+    """Apply a ledger operation, replaying the stored response for a repeated Idempotency-Key"""
+    if not idempotency_key:
+        return await execute_ledger_operation(operation, *args)
+    if len(idempotency_key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be at most 255 characters")
+    
+    fingerprint = hashlib.sha256(json.dumps([endpoint, args], default=str).encode()).hexdigest()
+    cache_key = (username, idempotency_key)
+    while True:
+        stored = idempotency_cache.get(username, idempotency_key)
+        if stored is None:
+            # Every ledger operation takes (username, account_number, ...)
+            stored = await run_db(load_idempotent_response, username, idempotency_key, args[1])
+            if stored is not None and stored["status_code"] != IDEMPOTENCY_PENDING:
+                idempotency_cache.put(username, idempotency_key, stored, stored["created"])
+        if stored is not None:
+            return replay_response(stored, fingerprint)
+        
+        running = idempotency_cache.inflight.get(cache_key)
+        if running is None:
+            break
+        # Wait for the original; if it failed nothing was stored and we run it ourselves
+        await asyncio.wait([running])
+    
+    running = asyncio.get_running_loop().create_future()
+    idempotency_cache.inflight[cache_key] = running
+    try:
+        stored = await execute_ledger_operation(
+            ledger_idempotent, username, idempotency_key, fingerprint, operation, args
+        )
+        if stored["status_code"] != IDEMPOTENCY_PENDING:
+            idempotency_cache.put(username, idempotency_key, stored)
+    finally:
+        del idempotency_cache.inflight[cache_key]
+        running.set_result(None)
+    if stored.pop("replayed"):
+        return replay_response(stored, fingerprint)
+    return stored["response"]
+
+# Transaction archives
+# Months older than the hot window live in their own SQLite files
+# (ARCHIVE_DIR/transactions_YYYY_MM.db) listed in transaction_archives.
+# Readers ATTACH them on demand, newest first, only until a page is full,
+# so the main table and its indexes stay small. transaction_archive_users
+# records which months hold rows of each user, so per-user reads skip the
+# archives they have nothing in. The dashboard rollups are kept for archived
+# hours, and rebuild-stats recounts the archives too. A sharded ledger
+# neither archives nor reads archives.
+def archive_path(month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"transactions_{month.replace('-', '_')}.db")
+
+def month_start(year: int, month: int) -> str:
+    """Stored-format timestamp of the first instant of a month, normalizing month overflow"""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return f"{year:04d}-{month:02d}-01 00:00:00"
+
+def transaction_partitions(conn, lower_id: int = None, upper_id: int = None, user_id: str = None) -> list:
+    """(archive path or None, table expression) for every partition overlapping [lower_id, upper_id), newest first
+    
+    With user_id, only archives holding rows of that user are listed.
+    """
+    partitions = [(None, "main.transactions")]
+    if user_id is None:
+        archives = conn.execute(
+            "SELECT month, first_id, archived_before FROM transaction_archives ORDER BY first_id DESC"
+        ).fetchall()
+    else:
+        archives = conn.execute('''
+            SELECT a.month, a.first_id, a.archived_before FROM transaction_archives a
+            JOIN transaction_archive_users u ON u.month = a.month AND u.user_id = ?
+            ORDER BY a.first_id DESC
+        ''', (user_id,)).fetchall()
+    for month, first_id, archived_before in archives:
+        if lower_id is not None and archived_before <= lower_id:
+            break
+        if upper_id is not None and first_id >= upper_id:
+            continue
+        path = archive_path(month)
+        if not os.path.exists(path):
+            print(f"WARNING: transaction archive {path} is missing")
+            continue
+        partitions.append((path, f"(SELECT * FROM archive.transactions WHERE id < {int(archived_before)})"))
+    return partitions
+
+def query_transactions(query: str, params, limit: int, lower_id: int = None, upper_id: int = None,
+                       shards: list = None, user_id: str = None) -> list:
+    """Run a newest-first transactions query across partitions until limit rows are found
+    
+    query must read from {transactions}, order by id DESC and end with LIMIT ?
+    (bound after params). Pass user_id when the query only matches that
+    user's rows, so archives without any are skipped. With a sharded ledger
+    it runs on the given shards (default all) instead, and archives are not
+    read.
+    """
+    if ledger_shards is not None:
+        return ledger_shards.query_transactions(query, params, limit, shards)
+    rows = []
+    with db_connection(readonly=True) as conn:
+        for path, table in transaction_partitions(conn, lower_id, upper_id, user_id):
+            if path is None:
+                cursor = conn.execute(query.format(transactions=table), [*params, limit])
+                rows.extend(dict(row) for row in cursor.fetchall())
+            else:
+                conn.execute("ATTACH DATABASE ? AS archive", (path,))
+                try:
+                    cursor = conn.execute(query.format(transactions=table), [*params, limit - len(rows)])
+                    rows.extend(dict(row) for row in cursor.fetchall())
+                    cursor.close()
+                finally:
+                    conn.execute("DETACH DATABASE archive")
+            if len(rows) >= limit:
+                break
+    return rows
+
+def create_archive_schema(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY,
+        legacy_id TEXT,
+        user_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        amount REAL NOT NULL,
+        description TEXT,
+        balance_after REAL,
+        related_account TEXT,
+        timestamp DATETIME,
+        is_flagged BOOLEAN DEFAULT 0
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id)")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_legacy_id ON transactions (legacy_id) WHERE legacy_id IS NOT NULL"
+    )
+
+def ledger_archive_batch(cursor, cutoff_id: int, batch_rows: int) -> int:
+    """Move the oldest batch of pre-cutoff transactions to its month's archive (runs inside a ledger transaction)
+    
+    The write lock on the main database is held throughout, so the rows cannot
+    change between the copy and the delete. The copy commits first: a crash
+    in between leaves only unregistered copies, which the next run replaces.
+    """
+    cursor.execute("SELECT id FROM transactions WHERE id < ? ORDER BY id LIMIT 1", (cutoff_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return 0
+    when = datetime.strptime(snowflake_timestamp(row[0]), "%Y-%m-%d %H:%M:%S")
+    month = when.strftime("%Y-%m")
+    first_id = snowflake_floor(month_start(when.year, when.month))
+    end_id = min(snowflake_floor(month_start(when.year, when.month + 1)), cutoff_id)
+    
+    cursor.execute('''
+        SELECT MIN(id), MAX(id), COUNT(*) FROM (
+            SELECT id FROM transactions WHERE id >= ? AND id < ? ORDER BY id LIMIT ?
+        )
+    ''', (first_id, end_id, batch_rows))
+    low, high, count = cursor.fetchone()
+    
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archive = sqlite3.connect(archive_path(month), timeout=DB_POOL_TIMEOUT)
+    try:
+        create_archive_schema(archive)
+        archive.execute("ATTACH DATABASE ? AS hot", (DB_FILE,))
+        archive.execute('''
+            INSERT OR REPLACE INTO main.transactions
+            SELECT id, legacy_id, user_id, type, amount, description, balance_after,
+                   related_account, timestamp, is_flagged
+            FROM hot.transactions WHERE id >= ? AND id <= ?
+        ''', (low, high))
+        archive.commit()
+    finally:
+        archive.close()
+    
+    cursor.execute('''
+        INSERT INTO transaction_archives (month, first_id, end_id, archived_before, rows)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(month) DO UPDATE SET archived_before = excluded.archived_before,
+                                         rows = rows + excluded.rows,
+                                         updated_at = CURRENT_TIMESTAMP
+    ''', (month, first_id, end_id, high + 1, count))
+    cursor.execute('''
+        INSERT INTO transaction_archive_users (user_id, month, rows)
+        SELECT user_id, ?, COUNT(*) FROM transactions WHERE id >= ? AND id <= ? GROUP BY user_id
+        ON CONFLICT(user_id, month) DO UPDATE SET rows = rows + excluded.rows
+    ''', (month, low, high))
+    cursor.execute("DELETE FROM transactions WHERE id >= ? AND id <= ?", (low, high))
+    return count
+
+def archive_cutoff_id() -> int:
+    """First transaction ID that stays in the main database"""
+    now = datetime.utcnow()
+    return snowflake_floor(month_start(now.year, now.month - TRANSACTION_HOT_MONTHS + 1))
+
+def archive_transactions_batch() -> int:
+    """Archive one batch in its own write transaction; returns the rows moved"""
+    if TRANSACTION_HOT_MONTHS <= 0:
+        return 0
+    return run_ledger_transaction(ledger_archive_batch, archive_cutoff_id(), ARCHIVE_BATCH_ROWS)
+
+async def run_transaction_archiver():
+    """Background job: move cold transactions out of the main database"""
+    while True:
+        moved = 0
+        try:
+            # One batch per write-executor call so ledger writes interleave
+            while True:
+                count = await run_db_write(archive_transactions_batch)
+                if not count:
+                    break
+                moved += count
+        except Exception as e:
+            print(f"WARNING: transaction archiving failed: {e}")
+        if moved:
+            print(f"Archived {moved} transactions older than {TRANSACTION_HOT_MONTHS} months")
+        await asyncio.sleep(ARCHIVE_INTERVAL_MINUTES * 60)
+
+transaction_archiver = None
+
+def set_transaction_flag(tx_id: str, flagged: bool) -> bool:
+    """Flag a transaction in whichever partition holds it; False if there is none"""
+    # Rows created before the snowflake migration keep their tx_... string IDs
+    column, value = ("id", int(tx_id)) if tx_id.isdigit() else ("legacy_id", tx_id)
+    if ledger_shards is not None:
+        return any(
+            ledger_shards.execute(shard, f"UPDATE transactions SET is_flagged = ? WHERE {column} = ?",
+                                  (1 if flagged else 0, value))
+            for shard in range(ledger_shards.count)
+        )
+    with db_connection() as conn:
+        cursor = conn.execute(
+            f"UPDATE transactions SET is_flagged = ? WHERE {column} = ?", (1 if flagged else 0, value)
+        )
+        conn.commit()
+        if cursor.rowcount:
+            return True
+        archives = conn.execute(
+            "SELECT month, first_id, archived_before FROM transaction_archives ORDER BY first_id DESC"
+        ).fetchall()
+    
+    for month, first_id, archived_before in archives:
+        if column == "id" and not first_id <= value < archived_before:
+            continue
+        path = archive_path(month)
+        if not os.path.exists(path):
+            continue
+        archive = sqlite3.connect(path, timeout=DB_POOL_TIMEOUT)
+        try:
+            cursor = archive.execute(
+                f"UPDATE transactions SET is_flagged = ? WHERE {column} = ? AND id < ?",
+                (1 if flagged else 0, value, archived_before)
+            )
+            archive.commit()
+            if cursor.rowcount:
+                return True
+        finally:
+            archive.close()
+    return False
+
+# Ledger shards
+# With LEDGER_SHARDS > 1 each account's balance, history, idempotency keys and
+# transaction rollups live in one shard file. A shard reuses the main schema's
+# table names (users holds only username, account_number and balance), so the
+# ledger operations above run unchanged on a shard cursor. Shard rows are
+# created on first use; the main database stays the account directory.
+#
+# A transfer between shards is a two-phase commit in which the payer's shard
+# acts as coordinator and every step is its own local transaction:
+#   1. prepare: debit the payer and record the pending debit on the payer's
+#      shard, then record the pending credit on the payee's shard
+#   2. commit: mark the debit leg committed and write the payer's history row
+#      (this is the durable decision), then credit the payee
+# A credit leg therefore never exists without its debit leg. All state changes
+# are conditional on state = 'prepared', so the request and the recovery job
+# can race without applying a leg twice. No lock is ever held on two shards
+# at once.
+def create_shard_schema(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        account_number TEXT UNIQUE NOT NULL,
+        balance REAL NOT NULL DEFAULT 0
+    )
+    ''')
+    create_archive_schema(conn)
+    create_stats_tables(conn.cursor())
+    create_idempotency_table(conn.cursor())
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS shard_transfers (
+        id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'prepared',
+        peer_shard INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        account_number TEXT NOT NULL,
+        peer_account TEXT NOT NULL,
+        amount REAL NOT NULL,
+        balance_after REAL,
+        idempotency_key TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME,
+        PRIMARY KEY (id, role)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_shard_transfers_prepared ON shard_transfers (created_at) "
+        "WHERE state = 'prepared'"
+    )
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS shard_meta (
+        shard_index INTEGER NOT NULL,
+        shard_count INTEGER NOT NULL,
+        migrated_at DATETIME
+    )
+    ''')
+
+class LedgerShards:
+    """The ledger split over several SQLite files by a hash of the account number"""
+    
+    def __init__(self, count: int, directory: str):
+        self.count = count
+        self.directory = directory
+        self.paths = [os.path.join(directory, f"ledger_shard_{index}.db") for index in range(count)]
+        pragmas = {**DB_PRAGMAS, "synchronous": SHARD_SYNCHRONOUS}
+        self.write_pools = [
+            ConnectionPool(f"shard{index}_write", SHARD_POOL_SIZE, False, path, pragmas)
+            for index, path in enumerate(self.paths)
+        ]
+        self.read_pools = [
+            ConnectionPool(f"shard{index}_read", SHARD_POOL_SIZE, True, path, pragmas)
+            for index, path in enumerate(self.paths)
+        ]
+    
+    def index(self, account_number: str) -> int:
+        return zlib.crc32(account_number.encode()) % self.count
+    
+    def pools(self) -> list:
+        return self.write_pools + self.read_pools
+    
+    def transaction(self, shard: int, operation, *args):
+        """Run an operation in one write transaction on a shard"""
+        return run_pool_transaction(self.write_pools[shard], operation, *args)
+    
+    def execute(self, shard: int, query: str, params=()) -> int:
+        """Execute a single write statement on a shard and commit, returning the row count"""
+        with pool_connection(self.write_pools[shard]) as conn:
+            cursor = conn.execute(query, params)
+            conn.commit()
+            return cursor.rowcount
+    
+    def fetchone(self, shard: int, query: str, params=()):
+        with pool_connection(self.read_pools[shard]) as conn:
+            row = conn.execute(query, params).fetchone()
+            return dict(row) if row else None
+    
+    def open(self):
+        """Create the shard files, refusing a shard count that differs from the one they were made with"""
+        os.makedirs(self.directory, exist_ok=True)
+        existing = [os.path.exists(path) for path in self.paths]
+        if any(existing) and not all(existing):
+            raise RuntimeError(f"Only some ledger shards exist in {self.directory}; LEDGER_SHARDS cannot be changed")
+        for index, pool in enumerate(self.write_pools):
+            with pool_connection(pool) as conn:
+                create_shard_schema(conn)
+                row = conn.execute("SELECT shard_index, shard_count FROM shard_meta").fetchone()
+                if row is None:
+                    conn.execute("INSERT INTO shard_meta (shard_index, shard_count) VALUES (?, ?)", (index, self.count))
+                elif tuple(row) != (index, self.count):
+                    raise RuntimeError(
+                        f"{self.paths[index]} is shard {row[0]} of {row[1]}, not {index} of {self.count}"
+                    )
+                conn.commit()
+        self.migrate()
+    
+    def migrate(self):
+        """Move balances and history from the main database into shards that have not been filled yet
+        
+        Runs under the main write lock so concurrently starting workers take
+        turns; every step is repeatable in case a crash interrupts it.
+        """
+        with db_connection() as conn:
+            conn.create_function("ledger_shard", 1, self.index, deterministic=True)
+            archived = conn.execute("SELECT COUNT(*) FROM transaction_archives").fetchone()[0]
+            if archived:
+                print("WARNING: archived transaction months are not read by a sharded ledger")
+            for index, path in enumerate(self.paths):
+                conn.execute("ATTACH DATABASE ? AS shard", (path,))
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    if conn.execute("SELECT migrated_at FROM shard.shard_meta").fetchone()[0] is None:
+                        conn.execute('''
+                            INSERT OR IGNORE INTO shard.users (username, account_number, balance)
+                            SELECT username, account_number, COALESCE(balance, 0) FROM main.users
+                            WHERE account_number IS NOT NULL AND ledger_shard(account_number) = ?
+                        ''', (index,))
+                        conn.execute('''
+                            INSERT OR IGNORE INTO shard.transactions
+                            SELECT t.id, t.legacy_id, t.user_id, t.type, t.amount, t.description,
+                                   t.balance_after, t.related_account, t.timestamp, t.is_flagged
+                            FROM main.transactions t JOIN shard.users u ON u.username = t.user_id
+                        ''')
+                        conn.execute('''
+                            DELETE FROM main.transactions
+                            WHERE user_id IN (SELECT username FROM shard.users)
+                        ''')
+                        conn.execute("UPDATE shard.shard_meta SET migrated_at = CURRENT_TIMESTAMP")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute("DETACH DATABASE shard")
+    
+    def reset(self):
+        """Restore every non-admin balance to 1000 and wipe shard activity (reset-test)"""
+        with db_connection() as conn:
+            conn.create_function("ledger_shard", 1, self.index, deterministic=True)
+            for index, path in enumerate(self.paths):
+                conn.execute("ATTACH DATABASE ? AS shard", (path,))
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute('''
+                        INSERT OR REPLACE INTO shard.users (username, account_number, balance)
+                        SELECT username, account_number, 1000 FROM main.users
+                        WHERE role != 'admin' AND account_number IS NOT NULL AND ledger_shard(account_number) = ?
+                    ''', (index,))
+                    conn.execute("DELETE FROM shard.transactions WHERE type != 'system'")
+                    conn.execute("DELETE FROM shard.idempotency_keys")
+                    conn.execute("DELETE FROM shard.shard_transfers")
+                    conn.execute("DELETE FROM shard.stats_hourly")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute("DETACH DATABASE shard")
+    
+    def query_transactions(self, query: str, params, limit: int, shards: list = None) -> list:
+        """Run a newest-first transactions query on each shard and merge the pages by id
+        
+        A single shard is read through its own pool. Across shards the query
+        runs on a main connection with each shard attached in turn, so it may
+        join the main users table.
+        """
+        if shards is not None and len(shards) == 1:
+            with pool_connection(self.read_pools[shards[0]]) as conn:
+                cursor = conn.execute(query.format(transactions="main.transactions"), [*params, limit])
+                return [dict(row) for row in cursor.fetchall()]
+        
+        rows = []
+        with db_connection(readonly=True) as conn:
+            for shard in range(self.count) if shards is None else shards:
+                conn.execute("ATTACH DATABASE ? AS shard", (self.paths[shard],))
+                try:
+                    cursor = conn.execute(query.format(transactions="shard.transactions"), [*params, limit])
+                    rows.extend(dict(row) for row in cursor.fetchall())
+                    cursor.close()
+                finally:
+                    conn.execute("DETACH DATABASE shard")
+        rows.sort(key=lambda row: row["id"], reverse=True)
+        return rows[:limit]
+    
+    def partitions(self, shards: list = None) -> list:
+        """ExportCursor partitions for the given shards; it pops from the end, so shard 0 is read first"""
+        shards = range(self.count) if shards is None else shards
+        return [(self.paths[shard], "archive.transactions") for shard in reversed(shards)]
+    
+    def balances(self, users: list) -> dict:
+        """Current balance by username for rows carrying username and account_number"""
+        by_shard = {}
+        for user in users:
+            if user.get("account_number"):
+                by_shard.setdefault(self.index(user["account_number"]), []).append(user["username"])
+        balances = {}
+        for shard, usernames in by_shard.items():
+            with pool_connection(self.read_pools[shard]) as conn:
+                for start in range(0, len(usernames), SQL_IN_CHUNK):
+                    chunk = usernames[start:start + SQL_IN_CHUNK]
+                    cursor = conn.execute(
+                        f"SELECT username, balance FROM users WHERE username IN ({','.join('?' * len(chunk))})",
+                        chunk
+                    )
+                    balances.update(cursor.fetchall())
+        return balances
+    
+    def stats_since(self, hour: str) -> tuple:
+        """Transactions and their total across shards from the given rollup hour on"""
+        count, total = 0, 0.0
+        for shard in range(self.count):
+            row = self.fetchone(shard, '''
+                SELECT COALESCE(SUM(transactions), 0) AS transactions,
+                       COALESCE(SUM(transaction_total), 0) AS transaction_total
+                FROM stats_hourly WHERE hour >= ?
+            ''', (hour,))
+            count += row["transactions"]
+            total += row["transaction_total"]
+        return count, total
+    
+    def close_idle(self):
+        for pool in self.pools():
+            pool.close_idle()
+
+ledger_shards = LedgerShards(LEDGER_SHARDS, SHARD_DIR) if LEDGER_SHARDS > 1 else None
 
-def record_login_attempt(username: str, ip: str, success: bool):
-    """Record login attempt - FIXED to use thread-local connection"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO login_attempts (username, ip, success) VALUES (?, ?, ?)",
-            (username, ip, 1 if success else 0)
+def account_shards(account_number: str) -> Optional[list]:
+    """The shard holding an account, as a list for query_transactions (None when not sharded)"""
+    return None if ledger_shards is None else [ledger_shards.index(account_number)]
+
+def fetch_balance(username: str, account_number: str) -> float:
+    """An account's committed balance, from its shard when the ledger is sharded"""
+    row = None
+    if ledger_shards is not None:
+        row = ledger_shards.fetchone(
+            ledger_shards.index(account_number), "SELECT balance FROM users WHERE username = ?", (username,)
         )
-        conn.commit()
-    except Exception as e:
-        # Log error but don't crash
-        print(f"Error recording login attempt: {e}")
+    if row is None:
+        # Not sharded, or the account has had no ledger activity since sharding
+        row = db_fetchone("SELECT balance FROM users WHERE username = ?", (username,))
+    return row["balance"]
 
-def count_failed_attempts(username: str, minutes: int = 15, ip: str = None):
-    """Count failed login attempts"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    since = (datetime.utcnow() - timedelta(minutes=minutes)).strftime("%Y-%m-%d %H:%M:%S")
-    if ip:
-        cursor.execute(
-            "SELECT COUNT(*) FROM login_attempts WHERE username = ? AND ip = ? AND success = 0 AND timestamp >= ?",
-            (username, ip, since)
+def rebuild_shard_stats(cursor):
+    """Recompute a shard's transaction rollups from its transactions table"""
+    cursor.execute("UPDATE stats_hourly SET transactions = 0, transaction_total = 0")
+    cursor.execute("""
+        INSERT INTO stats_hourly (hour, transactions, transaction_total)
+        SELECT strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*), COALESCE(SUM(amount), 0) FROM transactions
+        WHERE timestamp IS NOT NULL GROUP BY 1
+        ON CONFLICT(hour) DO UPDATE SET transactions = excluded.transactions,
+                                        transaction_total = excluded.transaction_total
+    """)
+    cursor.execute("DELETE FROM stats_hourly WHERE transactions = 0 AND transaction_total = 0")
+
+def ledger_on_shard(cursor, accounts: list, operation, args):
+    """Create any missing shard rows for the accounts involved, then run the operation"""
+    cursor.executemany("INSERT OR IGNORE INTO users (username, account_number) VALUES (?, ?)", accounts)
+    return operation(cursor, *args)
+
+def run_sharded_operation(operation, args):
+    """Run a ledger operation on the payer's shard, or as a two-phase transfer across shards"""
+    idempotency = None
+    if operation is ledger_idempotent:
+        username, key, fingerprint, operation, args = args
+        idempotency = (key, fingerprint)
+    username, account_number = args[0], args[1]
+    shard = ledger_shards.index(account_number)
+    accounts = [(username, account_number)]
+    
+    if operation is ledger_transfer:
+        recipient = db_fetchone(
+            "SELECT username, account_number FROM users WHERE account_number = ?", (args[2],)
         )
-    else:
-        cursor.execute(
-            "SELECT COUNT(*) FROM login_attempts WHERE username = ? AND success = 0 AND timestamp >= ?",
-            (username, since)
+        if recipient is None:
+            raise HTTPException(status_code=404, detail="Recipient account not found")
+        recipient_shard = ledger_shards.index(recipient["account_number"])
+        if recipient_shard != shard:
+            return transfer_across_shards(shard, recipient_shard, username, account_number,
+                                          recipient["username"], recipient["account_number"], args[3], idempotency)
+        accounts.append((recipient["username"], recipient["account_number"]))
+    elif operation is ledger_transfer_batch:
+        with db_connection(readonly=True) as conn:
+            recipients = lookup_recipients(conn.cursor(), {item["to_account_number"] for item in args[2]})
+        elsewhere = [account for account in recipients if ledger_shards.index(account) != shard]
+        if elsewhere:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Batch transfers can only pay accounts on the payer's ledger shard; "
+                       f"{len(elsewhere)} recipients are on other shards"
+            )
+        accounts.extend((name, account) for account, name in recipients.items())
+    
+    if idempotency is not None:
+        operation, args = ledger_idempotent, (username, key, fingerprint, operation, args)
+    return ledger_shards.transaction(shard, ledger_on_shard, accounts, operation, args)
+
+def shard_prepare_credit(cursor, transfer_id: int, peer_shard: int, username: str, account_number: str,
+                         peer_account: str, amount: float):
+    """Phase one on the payee's shard: record the pending credit"""
+    cursor.execute("INSERT OR IGNORE INTO users (username, account_number) VALUES (?, ?)", (username, account_number))
+    cursor.execute('''
+        INSERT INTO shard_transfers (id, role, peer_shard, username, account_number, peer_account, amount)
+        VALUES (?, 'credit', ?, ?, ?, ?, ?)
+    ''', (transfer_id, peer_shard, username, account_number, peer_account, amount))
+
+def shard_prepare_debit(cursor, transfer_id: int, peer_shard: int, username: str, account_number: str,
+                        peer_account: str, amount: float, idempotency):
+    """Phase one on the payer's shard: reserve the funds and record the pending debit
+    
+    Returns the stored response instead when the Idempotency-Key was already
+    used; otherwise the key is held as pending until the transfer commits.
+    """
+    key = None
+    if idempotency is not None:
+        key, fingerprint = idempotency
+        cursor.execute('''
+            SELECT fingerprint, status_code, response FROM idempotency_keys
+            WHERE username = ? AND idempotency_key = ? AND created_at >= ?
+        ''', (username, key, idempotency_cutoff()))
+        row = cursor.fetchone()
+        if row is not None:
+            return {"fingerprint": row[0], "status_code": row[1], "response": json.loads(row[2]), "replayed": True}
+    
+    cursor.execute("INSERT OR IGNORE INTO users (username, account_number) VALUES (?, ?)", (username, account_number))
+    cursor.execute(
+        "UPDATE users SET balance = balance - ? WHERE username = ? AND balance >= ? RETURNING balance",
+        (amount, username, amount)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    cursor.execute('''
+        INSERT INTO shard_transfers (id, role, peer_shard, username, account_number, peer_account, amount,
+                                     balance_after, idempotency_key)
+        VALUES (?, 'debit', ?, ?, ?, ?, ?, ?, ?)
+    ''', (transfer_id, peer_shard, username, account_number, peer_account, amount, float(row[0]), key))
+    if key is not None:
+        cursor.execute('''
+            INSERT OR REPLACE INTO idempotency_keys (username, idempotency_key, fingerprint, status_code, response)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (username, key, fingerprint, IDEMPOTENCY_PENDING, json.dumps({"transfer_id": str(transfer_id)})))
+    return None
+
+def shard_commit_debit(cursor, transfer_id: int):
+    """Phase two on the payer's shard: record the decision and the payer's history row"""
+    cursor.execute('''
+        UPDATE shard_transfers SET state = 'committed', updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND role = 'debit' AND state = 'prepared'
+        RETURNING username, peer_account, amount, balance_after, idempotency_key
+    ''', (transfer_id,))
+    row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Transfer timed out and was rolled back, please retry"
         )
-    cnt = cursor.fetchone()[0]
-    return cnt
+    username, peer_account, amount, balance_after, key = row[0], row[1], float(row[2]), float(row[3]), row[4]
+    insert_transaction(cursor, {
+        "user_id": username,
+        "type": "transfer_sent",
+        "amount": -amount,
+        "description": f"Transfer to {peer_account}",
+        "balance_after": balance_after,
+        "related_account": peer_account
+    })
+    response = {
+        "message": f"Transferred ${amount:.2f} to account {peer_account}",
+        "new_balance": balance_after
+    }
+    if key is not None:
+        cursor.execute('''
+            UPDATE idempotency_keys SET status_code = 200, response = ?
+            WHERE username = ? AND idempotency_key = ?
+        ''', (json.dumps(response), username, key))
+    return response
 
-def lock_user(username: str, minutes: int):
-    """Lock user account - FIXED"""
-    locked_until = (datetime.utcnow() + timedelta(minutes=minutes)).isoformat()
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def shard_commit_credit(cursor, transfer_id: int) -> bool:
+    """Phase two on the payee's shard: apply the credit once"""
+    cursor.execute('''
+        UPDATE shard_transfers SET state = 'committed', updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND role = 'credit' AND state = 'prepared'
+        RETURNING username, peer_account, amount
+    ''', (transfer_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    username, peer_account, amount = row[0], row[1], float(row[2])
     cursor.execute(
-        "UPDATE users SET locked_until = ? WHERE username = ?",
-        (locked_until, username)
+        "UPDATE users SET balance = balance + ? WHERE username = ? RETURNING balance",
+        (amount, username)
     )
-    conn.commit()
+    insert_transaction(cursor, {
+        "user_id": username,
+        "type": "transfer_received",
+        "amount": amount,
+        "description": f"Transfer from {peer_account}",
+        "balance_after": float(cursor.fetchone()[0]),
+        "related_account": peer_account
+    })
+    return True
 
-def is_user_locked(user_row):
-    """Check if user is locked - FIXED VERSION"""
-    locked = user_row.get("locked_until")
-    if not locked:
-        return False, None
+def shard_abort_leg(cursor, transfer_id: int, role: str) -> bool:
+    """Roll back a leg that is still prepared, returning reserved funds and releasing its key"""
+    cursor.execute('''
+        UPDATE shard_transfers SET state = 'aborted', updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND role = ? AND state = 'prepared'
+        RETURNING username, amount, idempotency_key
+    ''', (transfer_id, role))
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    username, amount, key = row
+    if role == "debit":
+        cursor.execute("UPDATE users SET balance = balance + ? WHERE username = ?", (amount, username))
+        if key is not None:
+            cursor.execute(
+                "DELETE FROM idempotency_keys WHERE username = ? AND idempotency_key = ? AND status_code = ?",
+                (username, key, IDEMPOTENCY_PENDING)
+            )
+    return True
+
+def transfer_across_shards(shard: int, recipient_shard: int, username: str, account_number: str,
+                           recipient: str, to_account_number: str, amount: float, idempotency=None):
+    """Two-phase transfer between accounts on different shards"""
+    transfer_id = generate_transaction_id()
+    replay = ledger_shards.transaction(shard, shard_prepare_debit, transfer_id, recipient_shard,
+                                       username, account_number, to_account_number, amount, idempotency)
+    if replay is not None:
+        return replay
     
     try:
-        # Try parsing with timezone
-        locked_dt = datetime.fromisoformat(locked)
-    except ValueError:
+        ledger_shards.transaction(recipient_shard, shard_prepare_credit, transfer_id, shard,
+                                  recipient, to_account_number, account_number, amount)
+        response = ledger_shards.transaction(shard, shard_commit_debit, transfer_id)
+    except Exception:
         try:
-            # Try without timezone
-            locked_dt = datetime.strptime(locked, "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            # Invalid format, clear it
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET locked_until = NULL WHERE username = ?", (user_row["username"],))
-            conn.commit()
-            return False, None
+            resolve_shard_transfer(transfer_id, shard, recipient_shard)
+        except Exception as e:
+            print(f"WARNING: cross-shard transfer {transfer_id} left for recovery: {e}")
+        raise
+    # The decision is durable; if the credit fails here the recovery job applies it
+    try:
+        ledger_shards.transaction(recipient_shard, shard_commit_credit, transfer_id)
+    except Exception as e:
+        print(f"WARNING: credit of cross-shard transfer {transfer_id} left for recovery: {e}")
     
-    # Check if lock is expired
-    if locked_dt > datetime.utcnow():
-        return True, locked_dt
-    else:
-        # Lock expired, clear it
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET locked_until = NULL WHERE username = ?", (user_row["username"],))
-        conn.commit()
-        return False, None
-def clear_failed_attempts(username: str):
-    """Clear failed login attempts"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM login_attempts WHERE username = ? AND success = 0", (username,))
-    conn.commit()
+    if idempotency is None:
+        return response
+    return {"fingerprint": idempotency[1], "status_code": 200, "response": response, "replayed": False}
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    """Create JWT access token"""
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+def resolve_shard_transfer(transfer_id: int, shard: int, recipient_shard: int):
+    """Finish or roll back a cross-shard transfer from the state of its debit leg
+    
+    A debit still prepared has no decision and is aborted (this loses to a
+    concurrent commit, since both are conditional); a committed debit means
+    the credit must be applied, an aborted one that it must be dropped.
+    """
+    ledger_shards.transaction(shard, shard_abort_leg, transfer_id, "debit")
+    row = ledger_shards.fetchone(
+        shard, "SELECT state FROM shard_transfers WHERE id = ? AND role = 'debit'", (transfer_id,)
+    )
+    if row is not None and row["state"] == "committed":
+        ledger_shards.transaction(recipient_shard, shard_commit_credit, transfer_id)
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+        ledger_shards.transaction(recipient_shard, shard_abort_leg, transfer_id, "credit")
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    """Get current user from JWT token"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user_row = cursor.fetchone()
-    
-    if user_row is None:
-        raise credentials_exception
+def recover_shard_transfers(max_age_seconds: float = SHARD_RECOVERY_SECONDS) -> int:
+    """Resolve cross-shard transfers with a leg prepared more than max_age_seconds ago
     
-    return dict(user_row)
-
-def get_user_by_username(username: str):
-    """Get user by username"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user_row = cursor.fetchone()
-    return dict(user_row) if user_row else None
-
-def generate_account_number(username: str) -> str:
-    """Generate unique account number from username"""
-    import hashlib
-    hash_object = hashlib.sha256(username.encode())
-    hex_dig = hash_object.hexdigest()
-    raw_number = hex_dig[:16].upper()
-    account_number = '-'.join(raw_number[i:i+4] for i in range(0, 16, 4))
-    return account_number
+    Finished legs are kept as long as idempotency keys, then pruned.
+    """
+    cutoff = (datetime.utcnow() - timedelta(seconds=max_age_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+    resolved = 0
+    for shard in range(ledger_shards.count):
+        ledger_shards.execute(
+            shard, "DELETE FROM shard_transfers WHERE state != 'prepared' AND updated_at < ?", (idempotency_cutoff(),)
+        )
+        with pool_connection(ledger_shards.read_pools[shard]) as conn:
+            legs = conn.execute(
+                "SELECT id, role, peer_shard FROM shard_transfers WHERE state = 'prepared' AND created_at < ?",
+                (cutoff,)
+            ).fetchall()
+        for transfer_id, role, peer_shard in legs:
+            if role == "debit":
+                resolve_shard_transfer(transfer_id, shard, peer_shard)
+            else:
+                resolve_shard_transfer(transfer_id, peer_shard, shard)
+            resolved += 1
+    return resolved
 
-def generate_transaction_id():
-    """Generate unique transaction ID"""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    unique_id = str(uuid.uuid4())[:8]
-    return f"tx_{timestamp}_{unique_id}"
+async def run_shard_recovery():
+    """Background job: resolve in-doubt cross-shard transfers, starting right after startup"""
+    while True:
+        try:
+            resolved = await run_db_write(recover_shard_transfers)
+            if resolved:
+                print(f"Resolved {resolved} in-doubt cross-shard transfer legs")
+        except Exception as e:
+            print(f"WARNING: cross-shard transfer recovery failed: {e}")
+        await asyncio.sleep(max(SHARD_RECOVERY_SECONDS, 1))
 
-def save_transaction(transaction: dict):
-    """Save transaction to database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    transaction_id = generate_transaction_id()
-    try:
-        cursor.execute('''
-            INSERT INTO transactions (id, user_id, type, amount, description, balance_after, related_account)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            transaction_id,
-            transaction["user_id"],
-            transaction["type"],
-            transaction["amount"],
-            transaction.get("description"),
-            transaction.get("balance_after"),
-            transaction.get("related_account")
-        ))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
+shard_recovery = None
 
 # Admin helper functions
 def get_admin_by_username(username: str):
     """Get admin by username"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM admins WHERE username = ?", (username,))
-    admin_row = cursor.fetchone()
-    return dict(admin_row) if admin_row else None
+    with db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM admins WHERE username = ?", (username,))
+        admin_row = cursor.fetchone()
+        return dict(admin_row) if admin_row else None
+
+def get_admin_principal(username: str):
+    """Get the cacheable view of an admin, without password or TOTP secret"""
+    return db_fetchone(
+        "SELECT id, username, email, role, permissions, is_active, created_at, last_login "
+        "FROM admins WHERE username = ?",
+        (username,)
+    )
 
 async def verify_admin(token: str = Depends(oauth2_scheme)):
     """Verify admin JWT token"""
+    return await authenticate_admin(token)
+
+async def authenticate_admin(token: str):
+    """Resolve an admin from a JWT, raising 401 if it is not a valid admin token"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate admin credentials",
@@ -444,8 +4139,8 @@ async def verify_admin(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    admin = get_admin_by_username(username)
-    if admin is None:
+    admin = await admin_principals.load(username, get_admin_principal)
+    if admin is None or not admin["is_active"]:
         raise credentials_exception
     
     return admin
@@ -456,25 +4151,117 @@ def create_admin_access_token(data: dict, expires_delta: Optional[timedelta] = N
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.utcnow() + timedelta(minutes=settings_cache.get("session_timeout_minutes"))
     to_encode.update({"exp": expire, "role": "admin"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def log_security_event(event_type: str, username: str = None, 
-                       ip_address: str = None, details: str = "", 
-                       severity: str = "info"):
-    """Log security event to database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO security_logs (event_type, username, ip_address, details, severity)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (event_type, username, ip_address, details, severity))
-    conn.commit()
+def write_security_events(events):
+    """Insert security events in one transaction"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        for event_type, username, ip_address, details, severity, timestamp in events:
+            cursor.execute('''
+                INSERT INTO security_logs (event_type, username, ip_address, details, severity, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (event_type, username, ip_address, details, severity, timestamp))
+            emit_event(cursor, "security", {
+                "id": cursor.lastrowid,
+                "timestamp": timestamp.replace(" ", "T"),
+                "event_type": event_type,
+                "username": username,
+                "ip_address": ip_address,
+                "details": details,
+                "severity": severity
+            })
+        conn.commit()
+
+security_log_writer = BufferedWriter(SECURITY_LOG_FLUSH_MS, max_pending=SECURITY_LOG_MAX_PENDING,
+                                     overflow=SECURITY_LOG_OVERFLOW, write=write_security_events)
+
+async def log_security_event(event_type: str, username: str = None, 
+                             ip_address: str = None, details: str = "", 
+                             severity: str = "info"):
+    """Log security event; only critical events are written before returning"""
+    event = (event_type, username, ip_address, details, severity,
+             datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+    if severity != "critical" and security_log_writer.add(*event):
+        return
+    # Flush what is queued first so the log stays in order
+    await security_log_writer.flush()
+    await run_db_write(write_security_events, [event])
+
+def open_storage():
+    """Create or migrate the database and ledger shards and lease a transaction ID worker number
+    
+    Called by the startup hook; scripts that use the ledger without serving
+    requests (the CLI commands, the benchmarks) call it themselves. Importing
+    main.py touches no files.
+    """
+    init_db()
+    if ledger_shards is not None:
+        ledger_shards.open()
+    if worker_id_lease.pid != os.getpid():
+        # Not claimed yet, or forked after claiming: the parent's number is taken
+        worker_id_lease.claim()
 
-# Initialize database
-init_db()
+@app.on_event("startup")
+async def start_background_workers():
+    """Open the database and start background writer tasks"""
+    if LEDGER_GROUP_COMMIT and ledger_shards is not None:
+        print("WARNING: LEDGER_GROUP_COMMIT is not supported with LEDGER_SHARDS, ignoring it")
+    if TRANSACTION_HOT_MONTHS > 0 and ledger_shards is not None:
+        print("WARNING: transaction archiving is not supported with LEDGER_SHARDS, disabling it "
+              "(set TRANSACTION_HOT_MONTHS=0 to silence this)")
+    await run_db_write(open_storage)
+    password_hasher.start()
+    await run_db(settings_cache.refresh)
+    await run_db(token_revocations.sync)
+    await run_db(sync_principal_invalidations)
+    await run_db(load_failed_login_counters)
+    await login_attempt_writer.start()
+    await security_log_writer.start()
+    if ledger_batcher is not None:
+        await ledger_batcher.start()
+    await event_hub.start()
+    global transaction_archiver, shard_recovery, settings_refresher, token_revocation_sync, failed_login_sync
+    global principal_sync
+    settings_refresher = asyncio.create_task(run_settings_refresh())
+    token_revocation_sync = asyncio.create_task(run_token_revocation_sync())
+    failed_login_sync = asyncio.create_task(run_failed_login_sync())
+    principal_sync = asyncio.create_task(run_principal_sync())
+    if ledger_shards is not None:
+        shard_recovery = asyncio.create_task(run_shard_recovery())
+    elif TRANSACTION_HOT_MONTHS > 0:
+        transaction_archiver = asyncio.create_task(run_transaction_archiver())
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    """Drain background writer tasks"""
+    await event_hub.stop()
+    if settings_refresher is not None:
+        settings_refresher.cancel()
+    if token_revocation_sync is not None:
+        token_revocation_sync.cancel()
+    if failed_login_sync is not None:
+        failed_login_sync.cancel()
+    if principal_sync is not None:
+        principal_sync.cancel()
+    if transaction_archiver is not None:
+        transaction_archiver.cancel()
+    if shard_recovery is not None:
+        shard_recovery.cancel()
+    if ledger_batcher is not None:
+        await ledger_batcher.stop()
+    await login_attempt_writer.stop()
+    await security_log_writer.stop()
+    password_hasher.shutdown()
+    settings_cache.close()
+    await run_db_write(worker_id_lease.release)
+    read_pool.close_idle()
+    write_pool.close_idle()
+    if ledger_shards is not None:
+        ledger_shards.close_idle()
 
 # ===== REGULAR USER ENDPOINTS =====
 @app.get("/", response_class=HTMLResponse)
@@ -502,10 +4289,34 @@ async def signup_page(request: Request):
     """Signup page"""
     return templates.TemplateResponse("signup.html", {"request": request})
 
+def create_user(username: str, hashed_password: str, account_number: str):
+    """Insert a new user row"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                INSERT INTO users (username, hashed_password, account_number, balance)
+                VALUES (?, ?, ?, ?)
+            ''', (username, hashed_password, account_number, 0.0))
+            bump_stats(cursor, new_users=1)
+            cursor.execute("UPDATE stats_totals SET value = value + 1 WHERE name = 'users'")
+            emit_event(cursor, "user", {
+                "id": cursor.lastrowid,
+                "username": username,
+                "account_number": account_number,
+                "balance": 0.0,
+                "is_locked": False,
+                "created_at": datetime.utcnow().isoformat(timespec="seconds")
+            })
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
 @app.post("/signup")
 async def signup(username: str = Form(...), password: str = Form(...)):
     """User registration endpoint"""
-    existing_user = get_user_by_username(username)
+    existing_user = await run_db(get_user_by_username, username)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -518,19 +4329,12 @@ async def signup(username: str = Form(...), password: str = Form(...)):
             detail="Password must be at least 8 characters with uppercase, lowercase, number, and special character"
         )
     
-    hashed_password = pwd_context.hash(password)
+    hashed_password = await password_hasher.hash(password)
     account_number = generate_account_number(username)
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            INSERT INTO users (username, hashed_password, account_number, balance)
-            VALUES (?, ?, ?, ?)
-        ''', (username, hashed_password, account_number, 0.0))
-        conn.commit()
+        await run_db_write(create_user, username, hashed_password, account_number)
     except Exception as e:
-        conn.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create user: {str(e)}"
@@ -541,36 +4345,24 @@ async def signup(username: str = Form(...), password: str = Form(...)):
 @app.post("/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), request: Request = None):
     client_ip = request.client.host if request else "unknown"
-    user = get_user_by_username(form_data.username)
+    user = await run_db(get_user_by_username, form_data.username)
     
     if user:
-        locked, until = is_user_locked(user)
+        locked, until = await run_db(is_user_locked, user)
         if locked:
             raise HTTPException(
                 status_code=403,
                 detail=f"Account locked until {until.strftime('%Y-%m-%d %H:%M:%S')} UTC due to multiple failed login attempts"
             )
             
-    if not user or not pwd_context.verify(form_data.password, user["hashed_password"]):
-        record_login_attempt(form_data.username, client_ip, False)
-        fails_15m = count_failed_attempts(form_data.username, minutes=15)
-        fails_30m = count_failed_attempts(form_data.username, minutes=30)
-        fails_24h = count_failed_attempts(form_data.username, minutes=60*24)
-
-        if fails_15m >= 5 and fails_15m < 10:
-            lock_user(form_data.username, minutes=5)
-        elif fails_30m >= 10 and fails_30m < 15:
-            lock_user(form_data.username, minutes=60)
-        elif fails_24h >= 15:
-            lock_user(form_data.username, minutes=1440)
-
+    if not user or not await password_hasher.verify(form_data.password, user["hashed_password"]):
+        await register_failed_login(form_data.username, client_ip)
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    record_login_attempt(form_data.username, client_ip, True)
-    clear_failed_attempts(form_data.username)
+    await register_successful_login(form_data.username, client_ip)
 
     if user.get("totp_secret"):
         raise HTTPException(
@@ -578,17 +4370,11 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="2FA required"
         )
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE username = ?",
-        (user["username"],)
-    )
-    conn.commit()
+    await run_db_write(update_last_login, user["username"])
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token_expires = timedelta(minutes=settings_cache.get("session_timeout_minutes"))
     access_token = create_access_token(
-        data={"sub": user["username"]},
+        data={"sub": user["username"], "gen": user["token_generation"]},
         expires_delta=access_token_expires
     )
 
@@ -606,18 +4392,18 @@ async def login_2fa(
     otp: Optional[str] = Form(None)
 ):
     client_ip = request.client.host
-    user = get_user_by_username(form_data.username)
+    user = await run_db(get_user_by_username, form_data.username)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    locked, until = is_user_locked(user)
+    locked, until = await run_db(is_user_locked, user)
     if locked:
         raise HTTPException(
             status_code=403,
             detail=f"Account locked until {until.strftime('%Y-%m-%d %H:%M:%S')} UTC"
         )
 
-    if not pwd_context.verify(form_data.password, user["hashed_password"]):
+    if not await password_hasher.verify(form_data.password, user["hashed_password"]):
         record_login_attempt(form_data.username, client_ip, False)
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
@@ -629,34 +4415,15 @@ async def login_2fa(
             )
     totp = pyotp.TOTP(user["totp_secret"])
     if not totp.verify(otp):
-        record_login_attempt(form_data.username, client_ip, False)
-        fails_15m = count_failed_attempts(form_data.username, 15)
-        fails_30m = count_failed_attempts(form_data.username, 30)
-        fails_24h = count_failed_attempts(form_data.username, 60*24)
-
-        if fails_15m >= 5 and fails_15m < 10:
-            lock_user(form_data.username, 5)
-        elif fails_30m >= 10 and fails_30m < 15:
-            lock_user(form_data.username, 60)
-        elif fails_24h >= 15:
-            lock_user(form_data.username, 1440)
-
+        await register_failed_login(form_data.username, client_ip)
         raise HTTPException(status_code=401, detail="Invalid 2FA code")
 
-    record_login_attempt(form_data.username, client_ip, True)
-    clear_failed_attempts(form_data.username)
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE username = ?",
-        (user["username"],)
-    )
-    conn.commit()
+    await register_successful_login(form_data.username, client_ip)
+    await run_db_write(update_last_login, user["username"])
     
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token_expires = timedelta(minutes=settings_cache.get("session_timeout_minutes"))
     access_token = create_access_token(
-        data={"sub": user["username"]},
+        data={"sub": user["username"], "gen": user["token_generation"]},
         expires_delta=access_token_expires
     )
     
@@ -669,7 +4436,7 @@ async def login_2fa(
 
 @app.post("/enable_2fa")
 async def enable_2fa(current_user: dict = Depends(get_current_user)):
-    if current_user.get("totp_secret"):
+    if current_user["has_2fa"]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="2FA already enabled"
@@ -685,7 +4452,7 @@ async def enable_2fa(current_user: dict = Depends(get_current_user)):
 @app.get("/2fa/status")
 async def get_2fa_status(current_user: dict = Depends(get_current_user)):
     return {
-        "has_2fa": bool(current_user.get("totp_secret")),
+        "has_2fa": bool(current_user["has_2fa"]),
         "username": current_user["username"]
     }
 
@@ -695,7 +4462,7 @@ async def setup_2fa(
     otp: str = Form(...),
     current_user: dict = Depends(get_current_user)
 ):
-    if current_user.get("totp_secret"):
+    if current_user["has_2fa"]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="2FA already enabled"
@@ -708,13 +4475,12 @@ async def setup_2fa(
             detail="Invalid OTP code"
         )
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
+    await run_db_write(
+        db_execute,
         "UPDATE users SET totp_secret = ? WHERE username = ?",
         (secret, current_user["username"])
     )
-    conn.commit()
+    user_principals.invalidate(current_user["username"])
     
     return {"message": "2FA enabled successfully"}
 
@@ -723,285 +4489,365 @@ async def disable_2fa(
     otp: str = Form(...),
     current_user: dict = Depends(get_current_user)
 ):
-    if not current_user.get("totp_secret"):
+    user = await run_db(
+        db_fetchone,
+        "SELECT totp_secret FROM users WHERE username = ?",
+        (current_user["username"],)
+    )
+    if not user or not user["totp_secret"]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="2FA is not enabled for this user"
         )
     
-    totp = pyotp.TOTP(current_user["totp_secret"])
+    totp = pyotp.TOTP(user["totp_secret"])
     if not totp.verify(otp, valid_window=1):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid OTP code"
         )
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
+    await run_db_write(
+        db_execute,
         "UPDATE users SET totp_secret = NULL WHERE username = ?",
         (current_user["username"],)
     )
-    conn.commit()
+    user_principals.invalidate(current_user["username"])
     
     return {"message": "2FA disabled successfully"}
 
 @app.get("/balance")
 async def get_balance(current_user: dict = Depends(get_current_user)):
+    # Balances are never cached with the principal; always read the committed value
+    balance = await run_db(fetch_balance, current_user["username"], current_user["account_number"])
     return {
         "username": current_user["username"],
-        "balance": current_user["balance"],
+        "balance": balance,
         "account_number": current_user["account_number"]
     }
 
+def check_transaction_limit(amount: float):
+    """Reject a single ledger operation above the transaction_limit setting"""
+    limit = settings_cache.get("transaction_limit")
+    if amount > limit:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Amount exceeds the transaction limit of ${limit:,.2f}"
+        )
+
 @app.post("/deposit")
 async def make_deposit(
     amount: float = Form(...),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     if amount <= 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Amount must be positive"
         )
+    check_transaction_limit(amount)
 
-    conn = get_db_connection()
     try:
-        # Get current balance
-        cursor = conn.cursor()
-        cursor.execute("SELECT balance FROM users WHERE username = ?", (current_user["username"],))
-        current_balance = cursor.fetchone()[0]
-        new_balance = current_balance + amount
-        
-        # Update balance
-        cursor.execute(
-            "UPDATE users SET balance = ? WHERE username = ?",
-            (new_balance, current_user["username"])
+        return await execute_idempotent(
+            idempotency_key, current_user["username"], "deposit",
+            ledger_deposit, current_user["username"], current_user["account_number"], amount
         )
-        
-        # Log transaction
-        transaction = {
-            "user_id": current_user["username"],
-            "type": "deposit",
-            "amount": amount,
-            "description": f"Deposit: ${amount:.2f}",
-            "balance_after": new_balance,
-            "related_account": current_user["account_number"]
-        }
-        save_transaction(transaction)
-
-        conn.commit()
+    except HTTPException:
+        raise
     except Exception as e:
-        conn.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Deposit failed: {str(e)}"
         )
-    
-    return {
-        "message": f"Deposited ${amount:.2f} successfully",
-        "new_balance": new_balance
-    }
 
 @app.post("/withdraw")
 async def make_withdrawal(
     amount: float = Form(...),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     if amount <= 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Amount must be positive"
         )
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT balance FROM users WHERE username = ?", (current_user["username"],))
-    current_balance = cursor.fetchone()[0]
-    
-    if current_balance < amount:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Insufficient funds"
-        )
+    check_transaction_limit(amount)
 
     try:
-        new_balance = current_balance - amount
-        
-        cursor.execute(
-            "UPDATE users SET balance = ? WHERE username = ?",
-            (new_balance, current_user["username"])
+        return await execute_idempotent(
+            idempotency_key, current_user["username"], "withdraw",
+            ledger_withdraw, current_user["username"], current_user["account_number"], amount
         )
-        
-        transaction = {
-            "user_id": current_user["username"],
-            "type": "withdrawal",
-            "amount": -amount,
-            "description": f"Withdrawal: ${amount:.2f}",
-            "balance_after": new_balance,
-            "related_account": current_user["account_number"]
-        }
-        save_transaction(transaction)
-
-        conn.commit()
+    except HTTPException:
+        raise
     except Exception as e:
-        conn.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Withdrawal failed: {str(e)}"
         )
-    
-    return {
-        "message": f"Withdrew ${amount:.2f} successfully",
-        "new_balance": new_balance
-    }
 
 @app.post("/transfer")
 async def transfer_money(
     to_account_number: str = Form(...),
     amount: float = Form(...),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
+    check_transaction_limit(amount)
     
     if current_user["account_number"] == to_account_number:
         raise HTTPException(status_code=400, detail="Cannot transfer to yourself")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        # 1. Find recipient
-        cursor.execute(
-            "SELECT * FROM users WHERE account_number = ?",
-            (to_account_number,)
+        return await execute_idempotent(
+            idempotency_key, current_user["username"], "transfer",
+            ledger_transfer, current_user["username"], current_user["account_number"],
+            to_account_number, amount
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Transfer failed: {str(e)}")
+
+@app.post("/transfers/batch")
+async def batch_transfer(
+    batch: BatchTransferRequest,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    if batch.mode not in ("all_or_nothing", "best_effort"):
+        raise HTTPException(status_code=400, detail="mode must be 'all_or_nothing' or 'best_effort'")
+    if not batch.transfers:
+        raise HTTPException(status_code=400, detail="No transfers given")
+    if len(batch.transfers) > MAX_BATCH_TRANSFERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_TRANSFERS} transfers per batch"
         )
-        recipient_row = cursor.fetchone()
-        if recipient_row is None:
-            raise HTTPException(status_code=404, detail="Recipient account not found")
-        recipient = dict(recipient_row)
-        
-        # 2. Check sender balance
-        cursor.execute("SELECT balance FROM users WHERE username = ?", (current_user["username"],))
-        sender_balance = cursor.fetchone()[0]
-        if sender_balance < amount:
-            raise HTTPException(status_code=400, detail="Insufficient funds")
 
-        # 3. Update balances
-        new_sender_balance = sender_balance - amount
-        new_recipient_balance = recipient["balance"] + amount
-        
-        cursor.execute(
-            "UPDATE users SET balance = ? WHERE username = ?",
-            (new_sender_balance, current_user["username"])
+    try:
+        return await execute_idempotent(
+            idempotency_key, current_user["username"], "transfers/batch",
+            ledger_transfer_batch, current_user["username"], current_user["account_number"],
+            [item.model_dump() for item in batch.transfers], batch.mode
         )
-        
-        cursor.execute(
-            "UPDATE users SET balance = ? WHERE username = ?",
-            (new_recipient_balance, recipient["username"])
-        )
-
-        # 4. Log transactions
-        sender_tx = {
-            "user_id": current_user["username"],
-            "type": "transfer_sent",
-            "amount": -amount,
-            "description": f"Transfer to {to_account_number}",
-            "balance_after": new_sender_balance,
-            "related_account": to_account_number
-        }
-        save_transaction(sender_tx)
-        
-        recipient_tx = {
-            "user_id": recipient["username"],
-            "type": "transfer_received",
-            "amount": amount,
-            "description": f"Transfer from {current_user['account_number']}",
-            "balance_after": new_recipient_balance,
-            "related_account": current_user["account_number"]
-        }
-        save_transaction(recipient_tx)
-        
-        conn.commit()
-        
     except HTTPException:
-        conn.rollback()
         raise
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=f"Transfer failed: {str(e)}")
-    
-    return {
-        "message": f"Transferred ${amount:.2f} to account {to_account_number}",
-        "new_balance": new_sender_balance
-    }
+        raise HTTPException(status_code=500, detail=f"Batch transfer failed: {str(e)}")
 
 @app.get("/transactions")
-async def get_transactions(current_user: dict = Depends(get_current_user)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM transactions 
-        WHERE user_id = ?
-        ORDER BY timestamp DESC
-        LIMIT 100
-    ''', (current_user["username"],))
+async def get_transactions(
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    limit = clamp_page_size(limit)
+    after = decode_cursor(cursor, 1)
+    
+    query = "SELECT * FROM {transactions} WHERE user_id = ?"
+    params = [current_user["username"]]
+    if after:
+        query += " AND id < ?"
+        params.extend(after)
+    query += " ORDER BY id DESC LIMIT ?"
+    
+    transactions = await run_db(query_transactions, query, params, limit + 1, None, None,
+                                account_shards(current_user["account_number"]), current_user["username"])
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_cursor(transactions[-1]["id"])
     
-    transactions = [dict(row) for row in cursor.fetchall()]
+    for tx in transactions:
+        tx["id"] = public_transaction_id(tx)
+        del tx["legacy_id"]
+    return {"transactions": transactions, "next_cursor": next_cursor}
+
+@app.get("/transactions/export")
+async def export_transactions(
+    format: str = "csv",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream the user's transactions, oldest first (start inclusive, end exclusive, UTC)"""
+    query = """
+        SELECT COALESCE(t.legacy_id, CAST(t.id AS TEXT)) AS id, t.type, t.amount, t.description,
+               t.balance_after, t.related_account, t.timestamp, t.is_flagged
+        FROM {transactions} t WHERE t.user_id = ?
+    """
+    params = [current_user["username"]]
+    start, end = parse_export_bound(start, "start"), parse_export_bound(end, "end")
+    # IDs are time-ordered, so time bounds become a rowid range
+    lower_id = snowflake_floor(start) if start else None
+    upper_id = snowflake_floor(end) if end else None
+    if lower_id is not None:
+        query += " AND t.id >= ?"
+        params.append(lower_id)
+    if upper_id is not None:
+        query += " AND t.id < ?"
+        params.append(upper_id)
+    query += " ORDER BY t.id"
     
-    return {"transactions": transactions}
+    return export_response(query, params, format, f"transactions_{current_user['username']}",
+                           lower_id, upper_id, account_shards(current_user["account_number"]),
+                           current_user["username"])
 
 @app.get("/users/me")
 async def read_users_me(current_user: dict = Depends(get_current_user)):
+    balance = await run_db(fetch_balance, current_user["username"], current_user["account_number"])
     return {
         "username": current_user["username"],
         "account_number": current_user["account_number"],
-        "balance": current_user["balance"],
-        "has_2fa": bool(current_user.get("totp_secret")),
+        "balance": balance,
+        "has_2fa": bool(current_user["has_2fa"]),
         "created_at": current_user.get("created_at"),
         "last_login": current_user.get("last_login")
     }
 
+def normalize_account_number(account_number: str) -> str:
+    """Account number without dashes, as indexed by idx_users_account_number_norm"""
+    return account_number.replace("-", "").strip().upper()
+
+def fetch_public_profiles(normalized: list) -> dict:
+    """Map normalized account numbers to public profiles with chunked, indexed IN (...) lookups"""
+    profiles = {}
+    with db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        for start in range(0, len(normalized), SQL_IN_CHUNK):
+            chunk = normalized[start:start + SQL_IN_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f'''
+                SELECT REPLACE(account_number, '-', '') AS normalized, username, account_number, created_at
+                FROM users WHERE REPLACE(account_number, '-', '') IN ({placeholders})
+            ''', chunk)
+            for row in cursor.fetchall():
+                profile = dict(row)
+                profiles[profile.pop("normalized")] = profile
+    return profiles
+
+async def lookup_public_profiles(account_numbers: list) -> dict:
+    """Resolve account numbers (with or without dashes) to public profiles, via the recipient cache"""
+    profiles, misses = {}, {}
+    for account_number in account_numbers:
+        normalized = normalize_account_number(account_number)
+        profile, generation = recipient_profiles.get(normalized)
+        if profile is not None:
+            profiles[account_number] = profile
+        else:
+            misses.setdefault(normalized, (generation, []))[1].append(account_number)
+    
+    if misses:
+        found = await run_db(fetch_public_profiles, list(misses))
+        for normalized, (generation, requested) in misses.items():
+            profile = found.get(normalized)
+            if profile is None:
+                continue
+            recipient_profiles.put(normalized, profile, generation)
+            for account_number in requested:
+                profiles[account_number] = profile
+    return profiles
+
+@app.post("/users/lookup")
+async def lookup_users_by_account_number(
+    lookup: AccountLookupRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Resolve many account numbers in one call (transfer and batch-payout screens)"""
+    if len(lookup.account_numbers) > MAX_BATCH_TRANSFERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_TRANSFERS} account numbers per lookup"
+        )
+    
+    profiles = await lookup_public_profiles(lookup.account_numbers)
+    return {
+        "users": profiles,
+        "missing": [account_number for account_number in lookup.account_numbers if account_number not in profiles]
+    }
+
 @app.get("/users/{account_number}")
 async def get_user_by_account_number(
     account_number: str,
     current_user: dict = Depends(get_current_user)
 ):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT username, account_number, created_at FROM users WHERE REPLACE(account_number,'-','') = ?",
-        (account_number.replace("-", ""),)
-    )
+    user = (await lookup_public_profiles([account_number])).get(account_number)
     
-    user_row = cursor.fetchone()
-    
-    if user_row is None:
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    return dict(user_row)
+    return user
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
-        conn = get_db_connection()
-        conn.execute("SELECT 1")
+        await run_db(db_fetchone, "SELECT 1")
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
 
+def runtime_metric_samples():
+    """Gauges and counters read from the pools, caches and writers at scrape time"""
+    samples = []
+    for pool in (read_pool, write_pool, *(ledger_shards.pools() if ledger_shards is not None else ())):
+        stats = pool.stats()
+        for state in ("in_use", "idle"):
+            samples.append(("simplebanking_db_pool_connections", (("pool", pool.name), ("state", state)), stats[state]))
+        samples.append(("simplebanking_db_pool_waits_total", (("pool", pool.name),), stats["waits"]))
+    samples.append(("simplebanking_password_hash_queue_depth", (), password_hasher.pending))
+    samples.append(("simplebanking_settings_reloads_total", (), settings_cache.reloads))
+    
+    caches = {
+        "user_principals": user_principals.stats(),
+        "admin_principals": admin_principals.stats(),
+        "recipient_profiles": recipient_profiles.stats(),
+        "idempotency": idempotency_cache.stats(),
+        "dashboard": {"size": 1 if dashboard_cache else 0, **dashboard_cache_stats},
+    }
+    for name, stats in caches.items():
+        labels = (("cache", name),)
+        lookups = stats["hits"] + stats["misses"]
+        samples.append(("simplebanking_cache_hits_total", labels, stats["hits"]))
+        samples.append(("simplebanking_cache_misses_total", labels, stats["misses"]))
+        samples.append(("simplebanking_cache_hit_ratio", labels, round(stats["hits"] / lookups, 4) if lookups else 0))
+        samples.append(("simplebanking_cache_entries", labels, stats["size"]))
+    
+    for name, writer in (("login_attempts", login_attempt_writer), ("security_logs", security_log_writer)):
+        samples.append(("simplebanking_buffered_writes_pending", (("writer", name),), len(writer.pending)))
+    return samples
+
+@app.get("/metrics")
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus metrics for this worker"""
+    if METRICS_TOKEN and not (
+        authorization and secrets.compare_digest(authorization, f"Bearer {METRICS_TOKEN}")
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(
+        content=metrics.render(runtime_metric_samples()),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 @app.post("/change_password")
 async def change_password(
     current_password: str = Form(...),
     new_password: str = Form(...),
     current_user: dict = Depends(get_current_user)
 ):
-    if not pwd_context.verify(current_password, current_user["hashed_password"]):
+    user = await run_db(
+        db_fetchone,
+        "SELECT hashed_password FROM users WHERE username = ?",
+        (current_user["username"],)
+    )
+    if not await password_hasher.verify(current_password, user["hashed_password"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
 
     if not verify_password_complexity(new_password):
@@ -1015,16 +4861,13 @@ async def change_password(
             detail="New password must be different from current password"
         )
     
-    hashed_new = pwd_context.hash(new_password)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE users SET hashed_password = ? WHERE username = ?",
-        (hashed_new, current_user["username"])
-    )
-    conn.commit()
+    hashed_new = await password_hasher.hash(new_password)
+    generation = await run_db_write(set_user_password, current_user["username"], hashed_new)
     
-    return {"message": "Password updated successfully"}
+    # Every other session is signed out; this one continues with a new token
+    access_token = create_access_token(data={"sub": current_user["username"], "gen": generation})
+    
+    return {"message": "Password updated successfully", "access_token": access_token, "token_type": "bearer"}
 
 # ===== ADMIN ENDPOINTS =====
 @router.post("/login")
@@ -1032,9 +4875,9 @@ async def admin_login(login: AdminLogin, request: Request):
     """Admin login endpoint"""
     client_ip = request.client.host
     
-    admin = get_admin_by_username(login.username)
+    admin = await run_db(get_admin_by_username, login.username)
     if not admin:
-        log_security_event("failed_admin_login", login.username, client_ip, 
+        await log_security_event("failed_admin_login", login.username, client_ip, 
                           "Invalid username", "high")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1047,8 +4890,8 @@ async def admin_login(login: AdminLogin, request: Request):
             detail="Admin account is disabled"
         )
     
-    if not pwd_context.verify(login.password, admin["hashed_password"]):
-        log_security_event("failed_admin_login", login.username, client_ip,
+    if not await password_hasher.verify(login.password, admin["hashed_password"]):
+        await log_security_event("failed_admin_login", login.username, client_ip,
                           "Invalid password", "high")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1064,28 +4907,22 @@ async def admin_login(login: AdminLogin, request: Request):
         
         totp = pyotp.TOTP(admin["totp_secret"])
         if not totp.verify(login.otp):
-            log_security_event("failed_admin_2fa", login.username, client_ip,
+            await log_security_event("failed_admin_2fa", login.username, client_ip,
                               "Invalid 2FA code", "high")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid 2FA code"
             )
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE admins SET last_login = CURRENT_TIMESTAMP WHERE username = ?",
-        (admin["username"],)
-    )
-    conn.commit()
+    await run_db_write(update_last_login, admin["username"], "admins")
     
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token_expires = timedelta(minutes=settings_cache.get("session_timeout_minutes"))
     access_token = create_admin_access_token(
         data={"sub": admin["username"]},
         expires_delta=access_token_expires
     )
     
-    log_security_event("admin_login_success", login.username, client_ip,
+    await log_security_event("admin_login_success", login.username, client_ip,
                       "Admin logged in successfully", "info")
     
     return {
@@ -1096,157 +4933,258 @@ async def admin_login(login: AdminLogin, request: Request):
         "permissions": admin.get("permissions", "all")
     }
 
+def compute_dashboard_stats() -> AdminDashboardStats:
+    """Run the dashboard aggregate queries"""
+    with db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        
+        now = datetime.utcnow()
+        
+        cursor.execute("SELECT value FROM stats_totals WHERE name = 'users'")
+        row = cursor.fetchone()
+        total_users = row[0] if row else 0
+        
+        cursor.execute("""
+            SELECT COUNT(*) FROM users 
+            WHERE last_login >= datetime('now', '-30 minutes')
+        """)
+        active_sessions = cursor.fetchone()[0]
+        
+        cursor.execute("""
+            SELECT COALESCE(SUM(transactions), 0), COALESCE(SUM(transaction_total), 0),
+                   COALESCE(SUM(new_users), 0)
+            FROM stats_hourly WHERE hour >= ?
+        """, (now.strftime("%Y-%m-%d 00:00:00"),))
+        today_transactions, transaction_total, user_trend = cursor.fetchone()
+        if ledger_shards is not None:
+            shard_transactions, shard_total = ledger_shards.stats_since(now.strftime("%Y-%m-%d 00:00:00"))
+            today_transactions += shard_transactions
+            transaction_total += shard_total
+        
+        cursor.execute(
+            "SELECT COALESCE(SUM(failed_logins), 0) FROM stats_hourly WHERE hour >= ?",
+            (last_24h_start(),)
+        )
+        failed_logins_24h = cursor.fetchone()[0]
+        
+        cursor.execute("""
+            SELECT COUNT(*) FROM users 
+            WHERE locked_until IS NOT NULL AND locked_until > datetime('now')
+        """)
+        blocked_attempts = cursor.fetchone()[0]
+        
+        session_status = "Normal"
+        if active_sessions > 100:
+            session_status = "High"
+        elif active_sessions > 50:
+            session_status = "Medium"
+        
+        return AdminDashboardStats(
+            total_users=total_users,
+            active_sessions=active_sessions,
+            today_transactions=today_transactions,
+            failed_logins_24h=failed_logins_24h,
+            user_trend=user_trend,
+            session_status=session_status,
+            transaction_total=transaction_total,
+            blocked_attempts=blocked_attempts
+        )
+
+async def load_dashboard_stats() -> AdminDashboardStats:
+    """Dashboard figures, reusing this worker's snapshot while it is fresh"""
+    if dashboard_cache and dashboard_cache["expires"] > time.monotonic():
+        dashboard_cache_stats["hits"] += 1
+        return dashboard_cache["stats"]
+    dashboard_cache_stats["misses"] += 1
+    stats = await run_db(compute_dashboard_stats)
+    dashboard_cache.update(expires=time.monotonic() + DASHBOARD_CACHE_TTL, stats=stats)
+    return stats
+
 @router.get("/dashboard", response_model=AdminDashboardStats)
 async def get_dashboard_stats(admin: dict = Depends(verify_admin)):
     """Get admin dashboard statistics"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM users")
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute("""
-        SELECT COUNT(*) FROM users 
-        WHERE last_login >= datetime('now', '-30 minutes')
-    """)
-    active_sessions = cursor.fetchone()[0]
-    
-    cursor.execute("""
-        SELECT COUNT(*) FROM transactions 
-        WHERE DATE(timestamp) = DATE('now')
-    """)
-    today_transactions = cursor.fetchone()[0]
+    return await load_dashboard_stats()
+
+def hash_stream_ticket(ticket: str) -> str:
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+def create_stream_ticket(ticket_hash: str, username: str, token_expires: int):
+    """Store a stream ticket, dropping expired ones"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM admin_stream_tickets WHERE expires_at < datetime('now')")
+        cursor.execute(
+            "INSERT INTO admin_stream_tickets (ticket_hash, username, token_expires, expires_at) "
+            "VALUES (?, ?, ?, datetime('now', ?))",
+            (ticket_hash, username, token_expires, f"+{EVENT_STREAM_TICKET_SECONDS} seconds")
+        )
+        conn.commit()
+
+def redeem_stream_ticket(ticket_hash: str):
+    """Use up a ticket; returns (username, token_expires), or None if unknown or expired"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM admin_stream_tickets WHERE ticket_hash = ? "
+            "RETURNING username, token_expires, expires_at >= datetime('now') AS valid",
+            (ticket_hash,)
+        )
+        row = cursor.fetchone()
+        conn.commit()
+    if row is None or not row["valid"]:
+        return None
+    return row["username"], row["token_expires"]
+
+async def admin_session_active(username: str, token_expires: int) -> bool:
+    """Whether the admin is still active and their token has not expired"""
+    if time.time() >= token_expires:
+        return False
+    admin = await admin_principals.load(username, get_admin_principal)
+    return admin is not None and bool(admin["is_active"])
+
+@router.post("/events/ticket")
+async def create_event_stream_ticket(token: str = Depends(oauth2_scheme)):
+    """Issue a single-use ticket for opening the event stream"""
+    admin = await authenticate_admin(token)
+    token_expires = jwt.get_unverified_claims(token)["exp"]
+    ticket = secrets.token_urlsafe(32)
+    await run_db_write(create_stream_ticket, hash_stream_ticket(ticket), admin["username"], token_expires)
+    return {"ticket": ticket, "expires_in": EVENT_STREAM_TICKET_SECONDS}
+
+@router.get("/events/stream")
+async def admin_event_stream(request: Request, ticket: Optional[str] = None):
+    """Live dashboard deltas as Server-Sent Events
     
-    cursor.execute("""
-        SELECT COALESCE(SUM(amount), 0) FROM transactions 
-        WHERE DATE(timestamp) = DATE('now')
-    """)
-    transaction_total = cursor.fetchone()[0] or 0
+    EventSource cannot send headers, so browsers pass a ticket from POST
+    /admin/events/ticket as ?ticket=; other clients may send the admin token
+    as a Bearer header. The stream ends once the admin is deactivated or the
+    token expires, checked on every keepalive interval.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate admin credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if ticket is not None:
+        session = await run_db_write(redeem_stream_ticket, hash_stream_ticket(ticket))
+        if session is None:
+            raise credentials_exception
+        username, token_expires = session
+    else:
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        admin = await authenticate_admin(token if scheme.lower() == "bearer" else "")
+        username, token_expires = admin["username"], jwt.get_unverified_claims(token)["exp"]
+    if not await admin_session_active(username, token_expires):
+        raise credentials_exception
     
-    cursor.execute("""
-        SELECT COUNT(*) FROM login_attempts 
-        WHERE success = 0 AND timestamp >= datetime('now', '-24 hours')
-    """)
-    failed_logins_24h = cursor.fetchone()[0]
+    subscriber = event_hub.subscribe()
     
-    cursor.execute("""
-        SELECT COUNT(*) FROM users 
-        WHERE DATE(created_at) = DATE('now')
-    """)
-    user_trend = cursor.fetchone()[0]
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            next_check = time.monotonic() + EVENT_STREAM_KEEPALIVE
+            while not subscriber.closed:
+                try:
+                    await asyncio.wait_for(subscriber.wakeup.wait(), EVENT_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                else:
+                    # Let a burst accumulate so it goes out as one write
+                    await asyncio.sleep(EVENT_STREAM_INTERVAL_MS / 1000.0)
+                    for event, data in subscriber.drain():
+                        yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+                if time.monotonic() >= next_check:
+                    if not await admin_session_active(username, token_expires):
+                        break
+                    next_check = time.monotonic() + EVENT_STREAM_KEEPALIVE
+        finally:
+            event_hub.unsubscribe(subscriber)
     
-    cursor.execute("""
-        SELECT COUNT(*) FROM users 
-        WHERE locked_until IS NOT NULL AND locked_until > datetime('now')
-    """)
-    blocked_attempts = cursor.fetchone()[0]
-    
-    session_status = "Normal"
-    if active_sessions > 100:
-        session_status = "High"
-    elif active_sessions > 50:
-        session_status = "Medium"
-    
-    return AdminDashboardStats(
-        total_users=total_users,
-        active_sessions=active_sessions,
-        today_transactions=today_transactions,
-        failed_logins_24h=failed_logins_24h,
-        user_trend=user_trend,
-        session_status=session_status,
-        transaction_total=transaction_total,
-        blocked_attempts=blocked_attempts
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 @router.get("/users", response_model=List[UserInfo])
-async def get_all_users(admin: dict = Depends(verify_admin)):
-    """Get all users"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
+async def get_all_users(
+    response: Response,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    admin: dict = Depends(verify_admin)
+):
+    """Get all users, newest first, one page at a time"""
+    limit = clamp_page_size(limit)
+    after = decode_cursor(cursor, 1)
+    
+    users = await run_db(fetch_user_infos, """
         SELECT 
             id, username, account_number, email, balance, 
             CASE WHEN locked_until > datetime('now') THEN 1 ELSE 0 END as is_locked,
             created_at, last_login, 
-            (SELECT COUNT(*) FROM login_attempts 
-             WHERE username = users.username AND success = 0 
-             AND timestamp >= datetime('now', '-24 hours')) as failed_attempts,
             CASE WHEN totp_secret IS NOT NULL THEN 1 ELSE 0 END as two_factor_enabled,
             last_ip
         FROM users
+        WHERE id < ?
         ORDER BY id DESC
-    """)
+        LIMIT ?
+    """, (after[0] if after else 2**63 - 1, limit + 1))
     
-    users = []
-    for row in cursor.fetchall():
-        user = dict(row)
-        user["is_locked"] = bool(user.get("is_locked", 0))
-        user["two_factor_enabled"] = bool(user.get("two_factor_enabled", 0))
-        users.append(user)
+    if len(users) > limit:
+        users = users[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(users[-1]["id"])
     
     return users
 
 @router.get("/users/recent", response_model=List[UserInfo])
 async def get_recent_users(limit: int = 5, admin: dict = Depends(verify_admin)):
     """Get recent users"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
+    return await run_db(fetch_user_infos, """
         SELECT 
             id, username, account_number, email, balance, 
             CASE WHEN locked_until > datetime('now') THEN 1 ELSE 0 END as is_locked,
             created_at, last_login, 
-            (SELECT COUNT(*) FROM login_attempts 
-             WHERE username = users.username AND success = 0 
-             AND timestamp >= datetime('now', '-24 hours')) as failed_attempts,
             CASE WHEN totp_secret IS NOT NULL THEN 1 ELSE 0 END as two_factor_enabled,
             last_ip
         FROM users
         ORDER BY created_at DESC
         LIMIT ?
     """, (limit,))
-    
-    users = []
-    for row in cursor.fetchall():
-        user = dict(row)
-        user["is_locked"] = bool(user.get("is_locked", 0))
-        user["two_factor_enabled"] = bool(user.get("two_factor_enabled", 0))
-        users.append(user)
-    
-    return users
 
 @router.get("/users/{user_id}", response_model=UserInfo)
 async def get_user_details(user_id: int, admin: dict = Depends(verify_admin)):
     """Get specific user details"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
+    users = await run_db(fetch_user_infos, """
         SELECT 
             id, username, account_number, email, balance, 
             CASE WHEN locked_until > datetime('now') THEN 1 ELSE 0 END as is_locked,
             created_at, last_login, 
-            (SELECT COUNT(*) FROM login_attempts 
-             WHERE username = users.username AND success = 0 
-             AND timestamp >= datetime('now', '-24 hours')) as failed_attempts,
             CASE WHEN totp_secret IS NOT NULL THEN 1 ELSE 0 END as two_factor_enabled,
             last_ip
         FROM users
         WHERE id = ?
     """, (user_id,))
     
-    user_row = cursor.fetchone()
-    
-    if not user_row:
+    if not users:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    user = dict(user_row)
-    user["is_locked"] = bool(user.get("is_locked", 0))
-    user["two_factor_enabled"] = bool(user.get("two_factor_enabled", 0))
-    
-    return user
+    return users[0]
+
+def lock_user_by_id(user_id: int, locked_until: str):
+    """Lock a user until the given time and count the lock in the rollups"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE users SET locked_until = ? WHERE id = ? RETURNING username",
+            (locked_until, user_id)
+        )
+        row = cursor.fetchone()
+        bump_stats(cursor, locks=1)
+        emit_event(cursor, "lock", {"username": row[0] if row else None, "locked_until": locked_until})
+        conn.commit()
 
 @router.post("/users/{user_id}/lock")
 async def lock_user_endpoint(
@@ -1255,11 +5193,7 @@ async def lock_user_endpoint(
     admin: dict = Depends(verify_admin)
 ):
     """Lock or unlock user account"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
+    user = await run_db(db_fetchone, "SELECT username FROM users WHERE id = ?", (user_id,))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1269,24 +5203,23 @@ async def lock_user_endpoint(
     username = user["username"]
     
     if lock:
-        lock_until = (datetime.utcnow() + timedelta(minutes=15)).strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute(
-            "UPDATE users SET locked_until = ? WHERE id = ?",
-            (lock_until, user_id)
-        )
+        lock_minutes = settings_cache.get("lockout_duration_minutes")
+        lock_until = (datetime.utcnow() + timedelta(minutes=lock_minutes)).strftime("%Y-%m-%d %H:%M:%S")
+        await run_db_write(lock_user_by_id, user_id, lock_until)
+        user_principals.invalidate(username)
         message = f"User {username} locked until {lock_until} UTC"
-        log_security_event("user_locked", username, None, 
-                          f"Locked by admin {admin['username']}", "medium")
+        await log_security_event("user_locked", username, None, 
+                     f"Locked by admin {admin['username']}", "medium")
     else:
-        cursor.execute(
+        await run_db_write(
+            db_execute,
             "UPDATE users SET locked_until = NULL WHERE id = ?",
             (user_id,)
         )
+        user_principals.invalidate(username)
         message = f"User {username} unlocked"
-        log_security_event("user_unlocked", username, None,
-                          f"Unlocked by admin {admin['username']}", "low")
-    
-    conn.commit()
+        await log_security_event("user_unlocked", username, None,
+                     f"Unlocked by admin {admin['username']}", "low")
     
     return {"message": message}
 
@@ -1296,11 +5229,7 @@ async def reset_user_password(
     admin: dict = Depends(verify_admin)
 ):
     """Reset user password (generate temporary password)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
+    user = await run_db(db_fetchone, "SELECT username FROM users WHERE id = ?", (user_id,))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1311,17 +5240,12 @@ async def reset_user_password(
     
     alphabet = string.ascii_letters + string.digits + "!@#$%^&*"
     temp_password = ''.join(secrets.choice(alphabet) for i in range(12))
-    hashed_password = pwd_context.hash(temp_password)
-    
-    cursor.execute(
-        "UPDATE users SET hashed_password = ?, locked_until = NULL WHERE id = ?",
-        (hashed_password, user_id)
-    )
+    hashed_password = await password_hasher.hash(temp_password)
     
-    conn.commit()
+    await run_db_write(set_user_password, username, hashed_password, True)
     
-    log_security_event("password_reset", username, None,
-                      f"Password reset by admin {admin['username']}", "high")
+    await log_security_event("password_reset", username, None,
+                 f"Password reset by admin {admin['username']}", "high")
     
     return {
         "message": f"Password reset for user {username}",
@@ -1331,17 +5255,20 @@ async def reset_user_password(
 
 @router.get("/transactions", response_model=List[TransactionInfo])
 async def get_all_transactions(
+    response: Response,
     filter: Optional[str] = None,
-    limit: int = 100,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
     admin: dict = Depends(verify_admin)
 ):
     """Get all transactions with optional filter"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    limit = clamp_page_size(limit)
+    after = decode_cursor(cursor, 1)
     
     query = """
         SELECT 
             t.id, 
+            t.legacy_id,
             t.user_id as from_account,
             t.related_account as to_account,
             t.amount, 
@@ -1351,29 +5278,38 @@ async def get_all_transactions(
             t.is_flagged,
             u.username as from_username,
             u2.username as to_username
-        FROM transactions t
+        FROM {transactions} t
         LEFT JOIN users u ON t.user_id = u.username
         LEFT JOIN users u2 ON t.related_account = u2.account_number
         WHERE 1=1
     """
     
     params = []
+    lower_id = None
     
     if filter == "today":
-        query += " AND DATE(t.timestamp) = DATE('now')"
+        lower_id = snowflake_floor(datetime.utcnow().strftime("%Y-%m-%d 00:00:00"))
+        query += " AND t.id >= ?"
+        params.append(lower_id)
     elif filter == "suspicious":
         query += " AND t.is_flagged = 1"
     elif filter == "large":
         query += " AND ABS(t.amount) > 10000"
     
-    query += " ORDER BY t.timestamp DESC LIMIT ?"
-    params.append(limit)
+    if after:
+        query += " AND t.id < ?"
+        params.extend(after)
     
-    cursor.execute(query, params)
+    query += " ORDER BY t.id DESC LIMIT ?"
+    
+    rows = await run_db(query_transactions, query, params, limit + 1, lower_id)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["id"])
     
     transactions = []
-    for row in cursor.fetchall():
-        tx = dict(row)
+    for tx in rows:
+        tx["id"] = public_transaction_id(tx)
         tx["from_account"] = tx.get("from_username") or tx.get("from_account")
         tx["to_account"] = tx.get("to_username") or tx.get("to_account")
         tx["is_flagged"] = bool(tx.get("is_flagged", 0))
@@ -1381,13 +5317,46 @@ async def get_all_transactions(
     
     return transactions
 
+@router.get("/transactions/export")
+async def export_all_transactions(
+    format: str = "csv",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    username: Optional[str] = None,
+    admin: dict = Depends(verify_admin)
+):
+    """Stream all transactions, oldest first, optionally for one user"""
+    query = """
+        SELECT COALESCE(t.legacy_id, CAST(t.id AS TEXT)) AS id, t.user_id, t.type, t.amount, t.description,
+               t.balance_after, t.related_account, t.timestamp, t.is_flagged
+        FROM {transactions} t WHERE 1=1
+    """
+    params = []
+    start, end = parse_export_bound(start, "start"), parse_export_bound(end, "end")
+    lower_id = snowflake_floor(start) if start else None
+    upper_id = snowflake_floor(end) if end else None
+    if username:
+        query += " AND t.user_id = ?"
+        params.append(username)
+    if lower_id is not None:
+        query += " AND t.id >= ?"
+        params.append(lower_id)
+    if upper_id is not None:
+        query += " AND t.id < ?"
+        params.append(upper_id)
+    query += " ORDER BY t.id"
+    
+    await log_security_event("transactions_exported", admin["username"], None,
+                       f"Transaction export ({format}) from {start or 'beginning'} to {end or 'now'}", "medium")
+    return export_response(query, params, format, "transactions", lower_id, upper_id)
+
 @router.get("/transactions/recent", response_model=List[TransactionInfo])
 async def get_recent_transactions(
     limit: int = 5, 
     admin: dict = Depends(verify_admin)
 ):
     """Get recent transactions"""
-    return await get_all_transactions(None, limit, admin)
+    return await get_all_transactions(Response(), None, limit, None, admin)
 
 @router.post("/transactions/{tx_id}/flag")
 async def flag_transaction(
@@ -1396,122 +5365,171 @@ async def flag_transaction(
     admin: dict = Depends(verify_admin)
 ):
     """Flag or unflag transaction"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM transactions WHERE id = ?", (tx_id,))
-    transaction = cursor.fetchone()
-    if not transaction:
+    if not await run_db_write(set_transaction_flag, tx_id, flag):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Transaction not found"
         )
     
-    cursor.execute(
-        "UPDATE transactions SET is_flagged = ? WHERE id = ?",
-        (1 if flag else 0, tx_id)
-    )
-    
-    conn.commit()
-    
     action = "flagged" if flag else "unflagged"
-    log_security_event("transaction_" + action, None, None,
-                      f"Transaction {tx_id} {action} by admin {admin['username']}",
-                      "medium" if flag else "low")
+    await log_security_event("transaction_" + action, None, None,
+                 f"Transaction {tx_id} {action} by admin {admin['username']}",
+                 "medium" if flag else "low")
     
     return {"message": f"Transaction {tx_id} {action} successfully"}
 
 @router.get("/security/logs", response_model=List[SecurityLog])
 async def get_security_logs(
-    limit: int = 100,
+    response: Response,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
     admin: dict = Depends(verify_admin)
 ):
     """Get security logs"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT * FROM security_logs 
-        ORDER BY timestamp DESC 
-        LIMIT ?
-    """, (limit,))
+    limit = clamp_page_size(limit)
+    after = decode_cursor(cursor, 2)
+    # Include events still waiting in this worker's buffer
+    await security_log_writer.flush()
+    
+    query = "SELECT * FROM security_logs"
+    params = []
+    if after:
+        query += " WHERE (timestamp, id) < (?, ?)"
+        params.extend(after)
+    query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
     
-    logs = [dict(row) for row in cursor.fetchall()]
+    logs = await run_db(db_fetchall, query, params)
+    if len(logs) > limit:
+        logs = logs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(logs[-1]["timestamp"], logs[-1]["id"])
     return logs
 
+@router.get("/security/logs/export")
+async def export_security_logs(
+    format: str = "csv",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    admin: dict = Depends(verify_admin)
+):
+    """Stream security logs, oldest first"""
+    await security_log_writer.flush()
+    query = "SELECT id, timestamp, event_type, username, ip_address, details, severity FROM security_logs WHERE 1=1"
+    params = []
+    start, end = parse_export_bound(start, "start"), parse_export_bound(end, "end")
+    if start:
+        query += " AND timestamp >= ?"
+        params.append(start)
+    if end:
+        query += " AND timestamp < ?"
+        params.append(end)
+    query += " ORDER BY timestamp, id"
+    
+    return export_response(query, params, format, "security_logs")
+
 @router.get("/settings", response_model=SystemSettings)
 async def get_system_settings(admin: dict = Depends(verify_admin)):
     """Get current system settings"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT setting_key, setting_value FROM system_settings")
+    rows = await run_db(db_fetchall, "SELECT setting_key, setting_value FROM system_settings")
     
     settings_dict = {}
-    for row in cursor.fetchall():
+    for row in rows:
         settings_dict[row["setting_key"]] = row["setting_value"]
     
     return SystemSettings(
         max_attempts=int(settings_dict.get("max_login_attempts", 5)),
         lock_duration=int(settings_dict.get("lockout_duration_minutes", 15)),
-        enable_2fa=settings_dict.get("require_2fa_admins", "true").lower() == "true"
+        enable_2fa=settings_dict.get("require_2fa_admins", "true").lower() == "true",
+        transaction_limit=float(settings_dict.get("transaction_limit", 10000)),
+        session_timeout=int(settings_dict.get("session_timeout_minutes", ACCESS_TOKEN_EXPIRE_MINUTES))
     )
 
+def save_system_settings(settings: SystemSettings):
+    """Persist system settings in one transaction"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT OR REPLACE INTO system_settings (setting_key, setting_value)
+            VALUES (?, ?)
+        """, ("max_login_attempts", str(settings.max_attempts)))
+        
+        cursor.execute("""
+            INSERT OR REPLACE INTO system_settings (setting_key, setting_value)
+            VALUES (?, ?)
+        """, ("lockout_duration_minutes", str(settings.lock_duration)))
+        
+        cursor.execute("""
+            INSERT OR REPLACE INTO system_settings (setting_key, setting_value)
+            VALUES (?, ?)
+        """, ("require_2fa_admins", "true" if settings.enable_2fa else "false"))
+        
+        if settings.transaction_limit is not None:
+            cursor.execute("""
+                INSERT OR REPLACE INTO system_settings (setting_key, setting_value)
+                VALUES (?, ?)
+            """, ("transaction_limit", str(settings.transaction_limit)))
+        
+        if settings.session_timeout is not None:
+            cursor.execute("""
+                INSERT OR REPLACE INTO system_settings (setting_key, setting_value)
+                VALUES (?, ?)
+            """, ("session_timeout_minutes", str(settings.session_timeout)))
+        
+        conn.commit()
+    # Apply here at once; other workers follow within SETTINGS_REFRESH_SECONDS
+    settings_cache.refresh()
+
 @router.post("/settings")
 async def update_system_settings(
     settings: SystemSettings,
     admin: dict = Depends(verify_admin)
 ):
     """Update system settings"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        INSERT OR REPLACE INTO system_settings (setting_key, setting_value)
-        VALUES (?, ?)
-    """, ("max_login_attempts", str(settings.max_attempts)))
-    
-    cursor.execute("""
-        INSERT OR REPLACE INTO system_settings (setting_key, setting_value)
-        VALUES (?, ?)
-    """, ("lockout_duration_minutes", str(settings.lock_duration)))
-    
-    cursor.execute("""
-        INSERT OR REPLACE INTO system_settings (setting_key, setting_value)
-        VALUES (?, ?)
-    """, ("require_2fa_admins", "true" if settings.enable_2fa else "false"))
-    
-    conn.commit()
+    if settings.max_attempts < 1 or settings.lock_duration < 1:
+        raise HTTPException(status_code=400, detail="max_attempts and lock_duration must be at least 1")
+    if settings.transaction_limit is not None and settings.transaction_limit <= 0:
+        raise HTTPException(status_code=400, detail="transaction_limit must be positive")
+    if settings.session_timeout is not None and settings.session_timeout < 1:
+        raise HTTPException(status_code=400, detail="session_timeout must be at least 1")
+    await run_db_write(save_system_settings, settings)
     
-    log_security_event("settings_updated", admin["username"], None,
-                      "System settings updated", "info")
+    await log_security_event("settings_updated", admin["username"], None,
+                 "System settings updated", "info")
     
     return {"message": "Settings updated successfully"}
 
+def delete_old_logs(days: int):
+    """Delete security logs and login attempts older than the given days"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            DELETE FROM security_logs 
+            WHERE timestamp < datetime('now', ?)
+        """, (f'-{days} days',))
+        security_deleted = cursor.rowcount
+        
+        cursor.execute("""
+            DELETE FROM login_attempts 
+            WHERE timestamp < datetime('now', ?)
+        """, (f'-{days} days',))
+        login_deleted = cursor.rowcount
+        
+        conn.commit()
+        return security_deleted, login_deleted
+
 @router.post("/logs/clear")
 async def clear_old_logs(
     days: int = 30,
     admin: dict = Depends(verify_admin)
 ):
     """Clear logs older than specified days"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        DELETE FROM security_logs 
-        WHERE timestamp < datetime('now', ?)
-    """, (f'-{days} days',))
-    security_deleted = cursor.rowcount
+    security_deleted, login_deleted = await run_db_write(delete_old_logs, days)
     
-    cursor.execute("""
-        DELETE FROM login_attempts 
-        WHERE timestamp < datetime('now', ?)
-    """, (f'-{days} days',))
-    login_deleted = cursor.rowcount
-    
-    conn.commit()
-    
-    log_security_event("logs_cleared", admin["username"], None,
-                      f"Cleared {security_deleted} security logs and {login_deleted} login attempts",
-                      "info")
+    await log_security_event("logs_cleared", admin["username"], None,
+                 f"Cleared {security_deleted} security logs and {login_deleted} login attempts",
+                 "info")
     
     return {
         "message": f"Cleared logs older than {days} days",
@@ -1521,15 +5539,82 @@ async def clear_old_logs(
 
 @router.post("/sessions/lock-all")
 async def lock_all_sessions(admin: dict = Depends(verify_admin)):
-    """Invalidate all user sessions (clear all JWT tokens)"""
-    log_security_event("all_sessions_locked", admin["username"], None,
-                      "All user sessions invalidated by admin", "high")
+    """Invalidate all user sessions (revoke every user JWT issued so far)"""
+    generation = await run_db_write(revoke_all_user_tokens)
+    await log_security_event("all_sessions_locked", admin["username"], None,
+                 f"All user sessions invalidated by admin (token generation {generation})", "high")
     
     return {
-        "message": "All sessions marked for invalidation. Users will need to re-login.",
-        "note": "In a production system, implement JWT blacklisting or reduce token expiry."
+        "message": "All user sessions invalidated. Users will need to log in again.",
+        "token_generation": generation,
+        "sync_seconds": TOKEN_REVOCATION_SYNC_SECONDS
+    }
+
+def reset_test_tables():
+    """Restore balances and wipe test activity"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("UPDATE users SET balance = 1000 WHERE role != 'admin'")
+        cursor.execute("DELETE FROM transactions WHERE type != 'system'")
+        cursor.execute("DELETE FROM login_attempts")
+        cursor.execute("DELETE FROM security_logs")
+        cursor.execute("DELETE FROM idempotency_keys")
+        cursor.execute("SELECT month FROM transaction_archives")
+        archived_months = [row[0] for row in cursor.fetchall()]
+        cursor.execute("DELETE FROM transaction_archives")
+        cursor.execute("DELETE FROM transaction_archive_users")
+        rebuild_dashboard_rollups(cursor)
+        
+        conn.commit()
+    if ledger_shards is not None:
+        ledger_shards.reset()
+    for month in archived_months:
+        if os.path.exists(archive_path(month)):
+            os.remove(archive_path(month))
+    dashboard_cache.clear()
+    idempotency_cache.clear()
+
+@router.get("/system/db-pool")
+async def get_db_pool_stats(admin: dict = Depends(verify_admin)):
+    """Connection pool usage for this worker"""
+    pools = {"read": read_pool.stats(), "write": write_pool.stats()}
+    if ledger_shards is not None:
+        pools["shards"] = {pool.name: pool.stats() for pool in ledger_shards.pools()}
+    return pools
+
+@router.get("/system/queries")
+async def get_query_profile(
+    limit: int = 20,
+    order: str = "total",
+    admin: dict = Depends(verify_admin)
+):
+    """Statements with the most total (or mean, max, calls, rows) time in this worker"""
+    if order not in ("total", "mean", "max", "calls", "rows"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="order must be one of total, mean, max, calls, rows"
+        )
+    return {
+        "enabled": query_profiler.enabled,
+        "slow_query_ms": SLOW_QUERY_MS,
+        "queries": query_profiler.top(clamp_page_size(limit), order)
     }
 
+@router.delete("/system/queries")
+async def reset_query_profile(admin: dict = Depends(verify_admin)):
+    """Clear this worker's query profile"""
+    query_profiler.reset()
+    return {"message": "Query profile cleared"}
+
+@router.post("/system/rebuild-stats")
+async def rebuild_dashboard_stats(admin: dict = Depends(verify_admin)):
+    """Recompute dashboard rollups from the raw tables"""
+    await run_db_write(run_dashboard_rebuild)
+    await log_security_event("stats_rebuilt", admin["username"], None,
+                       "Dashboard rollups rebuilt", "low")
+    return {"message": "Dashboard statistics rebuilt"}
+
 @router.post("/system/reset-test")
 async def reset_test_data(admin: dict = Depends(verify_admin)):
     """Reset test data (DANGEROUS - for development only)"""
@@ -1539,18 +5624,12 @@ async def reset_test_data(admin: dict = Depends(verify_admin)):
             detail="Only superadmin can reset test data"
         )
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("UPDATE users SET balance = 1000 WHERE role != 'admin'")
-    cursor.execute("DELETE FROM transactions WHERE type != 'system'")
-    cursor.execute("DELETE FROM login_attempts")
-    cursor.execute("DELETE FROM security_logs")
-    
-    conn.commit()
+    # Buffered events predate the reset and are wiped with the rest
+    await security_log_writer.flush()
+    await run_db_write(reset_test_tables)
     
-    log_security_event("system_reset", admin["username"], None,
-                      "Test data reset by admin", "critical")
+    await log_security_event("system_reset", admin["username"], None,
+                 "Test data reset by admin", "critical")
     
     return {"message": "Test data reset completed"}
 
@@ -1569,7 +5648,7 @@ async def create_admin_user(
             detail="Only superadmin can create new admins"
         )
     
-    existing_admin = get_admin_by_username(username)
+    existing_admin = await run_db(get_admin_by_username, username)
     if existing_admin:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -1582,35 +5661,46 @@ async def create_admin_user(
             detail="Password must be at least 8 characters with uppercase, lowercase, number, and special character"
         )
     
-    hashed_password = pwd_context.hash(password)
+    hashed_password = await password_hasher.hash(password)
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
+    await run_db_write(db_execute, '''
         INSERT INTO admins (username, hashed_password, email, role)
         VALUES (?, ?, ?, ?)
     ''', (username, hashed_password, email, role))
     
-    conn.commit()
-    
-    log_security_event("admin_created", current_admin["username"], None,
-                      f"Created new admin: {username} with role: {role}", "high")
+    await log_security_event("admin_created", current_admin["username"], None,
+                 f"Created new admin: {username} with role: {role}", "high")
     
     return {"message": f"Admin user {username} created successfully"}
 
 @router.get("/admin/list")
 async def list_admins(current_admin: dict = Depends(verify_admin)):
     """List all admin users"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, email, role, created_at, last_login, is_active FROM admins")
-    
-    admins = [dict(row) for row in cursor.fetchall()]
+    admins = await run_db(
+        db_fetchall,
+        "SELECT id, username, email, role, created_at, last_login, is_active FROM admins"
+    )
     return admins
 
 # Mount the admin router
 app.include_router(router)
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    import sys
+    if sys.argv[1:] == ["rebuild-stats"]:
+        open_storage()
+        run_dashboard_rebuild()
+        print("Dashboard rollups rebuilt")
+    elif sys.argv[1:] == ["archive-transactions"]:
+        open_storage()
+        moved = 0
+        while True:
+            count = archive_transactions_batch()
+            if not count:
+                break
+            moved += count
+        print(f"Archived {moved} transactions")
+    else:
+        import uvicorn
+        # Open event streams would otherwise hold up the shutdown hooks that close them
+        uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True, timeout_graceful_shutdown=5)
\ No newline at end of file
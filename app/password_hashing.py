@@ -0,0 +1,18 @@
+"""Bcrypt work that runs inside the password-hashing process pool.
+
+Kept separate from main.py so worker processes only import passlib, not the
+whole application (and never re-run init_db) when they unpickle a task.
+"""
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password(password: str) -> str:
+    """Hash a password with bcrypt"""
+    return pwd_context.hash(password)
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    """Check a password against a bcrypt hash"""
+    return pwd_context.verify(password, hashed_password)
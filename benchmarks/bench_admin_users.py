@@ -0,0 +1,140 @@
+"""Admin user listing cost: correlated login_attempts subquery vs. rollup lookup.
+
+Seeds a throwaway database with --users users and --attempts login attempts
+spread over the last two days (1% of the users attract half of them), plus
+--attack-failures failed logins against user0 within the last hour, as
+during a password-guessing attack. Then it times the admin listing queries
+both ways:
+
+  legacy  - failed_attempts from a COUNT(*) subquery per user row
+  rollup  - one IN (...) lookup per page against failed_logins_hourly
+
+    python benchmarks/bench_admin_users.py --users 100000 --attempts 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import Timer, load_app, summarize  # noqa: E402
+
+USER_COLUMNS = """
+    id, username, account_number, email, balance,
+    CASE WHEN locked_until > datetime('now') THEN 1 ELSE 0 END as is_locked,
+    created_at, last_login,
+    CASE WHEN totp_secret IS NOT NULL THEN 1 ELSE 0 END as two_factor_enabled,
+    last_ip
+"""
+LEGACY_COLUMNS = USER_COLUMNS + """,
+    (SELECT COUNT(*) FROM login_attempts
+     WHERE username = users.username AND success = 0
+     AND timestamp >= datetime('now', '-24 hours')) as failed_attempts
+"""
+
+QUERIES = {
+    "page_first": ("FROM users WHERE id < ? ORDER BY id DESC LIMIT ?", lambda n: (2**63 - 1, 101)),
+    "page_deep": ("FROM users WHERE id < ? ORDER BY id DESC LIMIT ?", lambda n: (n // 2, 101)),
+    "page_max": ("FROM users WHERE id < ? ORDER BY id DESC LIMIT ?", lambda n: (2**63 - 1, 501)),
+    # The oldest page holds the heavily targeted accounts
+    "page_hot": ("FROM users WHERE id < ? ORDER BY id DESC LIMIT ?", lambda n: (102, 101)),
+    "recent": ("FROM users ORDER BY created_at DESC LIMIT ?", lambda n: (5,)),
+    "details": ("FROM users WHERE id = ?", lambda n: (1,)),
+}
+
+
+def seed(db_file, users, attempts, attack_failures, seed_value):
+    """Bulk-load users and login attempts straight into SQLite"""
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA synchronous = OFF")
+
+    conn.executemany(
+        "INSERT INTO users (username, hashed_password, account_number, balance, created_at) VALUES (?, ?, ?, ?, ?)",
+        (
+            (f"user{i}", "x", f"{i:016X}", 100.0,
+             (now - timedelta(minutes=users - i)).strftime("%Y-%m-%d %H:%M:%S"))
+            for i in range(users)
+        )
+    )
+
+    # 1% of users receive half of all attempts
+    hot = max(1, users // 100)
+
+    def attempt_rows():
+        for _ in range(attempts):
+            if rng.random() < 0.5:
+                user = rng.randrange(hot)
+            else:
+                user = rng.randrange(users)
+            when = now - timedelta(seconds=rng.randrange(48 * 3600))
+            yield (f"user{user}", f"10.0.{user % 256}.{rng.randrange(256)}",
+                   1 if rng.random() < 0.3 else 0, when.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def attack_rows():
+        for _ in range(attack_failures):
+            when = now - timedelta(seconds=rng.randrange(3600))
+            yield ("user0", f"203.0.113.{rng.randrange(256)}", 0, when.strftime("%Y-%m-%d %H:%M:%S"))
+
+    insert = "INSERT INTO login_attempts (username, ip, success, timestamp) VALUES (?, ?, ?, ?)"
+    conn.executemany(insert, attempt_rows())
+    conn.executemany(insert, attack_rows())
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def run_queries(main, rounds, users):
+    results = {}
+    for name, (tail, params) in QUERIES.items():
+        args = params(users)
+        legacy, rollup = [], []
+        for _ in range(rounds):
+            with Timer(legacy):
+                main.db_fetchall(f"SELECT {LEGACY_COLUMNS} {tail}", args)
+            with Timer(rollup):
+                main.fetch_user_infos(f"SELECT {USER_COLUMNS} {tail}", args)
+        results[name] = {
+            "legacy": summarize(legacy, sum(legacy)),
+            "rollup": summarize(rollup, sum(rollup)),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--attempts", type=int, default=1000000)
+    parser.add_argument("--attack-failures", type=int, default=100000,
+                        help="extra failed logins against one account in the last hour")
+    parser.add_argument("--rounds", type=int, default=20, help="timed runs of each query")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    app = load_app()
+
+    started = time.perf_counter()
+    seed(app.DB_FILE, args.users, args.attempts, args.attack_failures, args.seed)
+    app.run_dashboard_rebuild()
+    print(f"seeded {args.users} users and {args.attempts} login attempts in {time.perf_counter() - started:.1f}s")
+
+    results = run_queries(app, args.rounds, args.users)
+
+    print(f"{'query':<12} {'variant':<8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, variants in results.items():
+        for variant, stats in variants.items():
+            print(f"{name:<12} {variant:<8} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['max_ms']:>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""HTTP API load test: throughput and latency of the main endpoints.
+
+Seeds --users accounts (plus one 2FA account per ten users) with --history
+transactions each straight into SQLite, then drives every scenario with
+--requests requests from --concurrency concurrent clients (closed loop: each
+client sends its next request as soon as the previous one returns):
+
+  token            POST /token
+  token_2fa        POST /token_2fa with a fresh TOTP code
+  balance          GET  /balance
+  deposit          POST /deposit
+  transfer         POST /transfer to another seeded account
+  transactions     GET  /transactions (first page)
+  admin_dashboard  GET  /admin/dashboard
+
+Each transport runs in its own interpreter against its own database:
+
+  asgi     - the app in-process through httpx.ASGITransport (no network,
+             no server; isolates the application's own cost)
+  uvicorn  - a local uvicorn server with --server-workers processes
+
+Results go to --output as JSON keyed by transport, scenario and
+concurrency, so runs from two commits can be diffed directly.
+
+    python benchmarks/bench_api.py --concurrency 1,16,64 --output before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import APP_DIR, Timer, load_app, summarize  # noqa: E402
+
+PASSWORD = "Bench!Passw0rd"
+SCENARIOS = ("token", "token_2fa", "balance", "deposit", "transfer", "transactions", "admin_dashboard")
+HISTORY_DAYS = 30
+
+
+def account_number(i):
+    digits = f"{i:016X}"
+    return "-".join(digits[k:k + 4] for k in range(0, 16, 4))
+
+
+def seed(main, users, history):
+    """Insert users, 2FA users and their transaction history directly, hashing the password once"""
+    import pyotp
+
+    hashed = main.password_hashing.hash_password(PASSWORD)
+    plain = [(f"bench{i}", account_number(i)) for i in range(users)]
+    twofa = [(f"bench2fa{i}", account_number(users + i), pyotp.random_base32()) for i in range(max(1, users // 10))]
+
+    with main.db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO users (username, hashed_password, account_number, balance) VALUES (?, ?, ?, 1000000000)",
+            ((username, hashed, account) for username, account in plain)
+        )
+        cursor.executemany(
+            "INSERT INTO users (username, hashed_password, account_number, balance, totp_secret) "
+            "VALUES (?, ?, ?, 1000000000, ?)",
+            ((username, hashed, account, secret) for username, account, secret in twofa)
+        )
+
+        # Spread the history over the last HISTORY_DAYS days, oldest first,
+        # using a worker ID the server never uses
+        rows = users * history
+        now_ms = int(time.time() * 1000) - main.SNOWFLAKE_EPOCH_MS
+        step = max(1, HISTORY_DAYS * 86400000 // max(1, rows))
+
+        def history_rows():
+            for n in range(rows):
+                tx_id = ((now_ms - (rows - n) * step) << 22) | (1023 << 12)
+                username, account = plain[n % users]
+                yield (tx_id, username, 1.0, account, main.snowflake_timestamp(tx_id))
+
+        cursor.executemany(
+            "INSERT INTO transactions (id, user_id, type, amount, description, balance_after, related_account, "
+            "timestamp) VALUES (?, ?, 'deposit', ?, 'Deposit: $1.00', 1000000000, ?, ?)",
+            history_rows()
+        )
+        conn.commit()
+    main.run_dashboard_rebuild()
+
+    tokens = [main.create_access_token({"sub": username}) for username, _ in plain]
+    return {
+        "users": [username for username, _ in plain],
+        "accounts": [account for _, account in plain],
+        "twofa": [(username, secret) for username, _, secret in twofa],
+        "tokens": tokens,
+    }
+
+
+def build_requests(data, admin_token):
+    """Scenario name -> function(client, i) sending the i-th request of that scenario"""
+    import pyotp
+
+    users, accounts, twofa, tokens = data["users"], data["accounts"], data["twofa"], data["tokens"]
+    auth = [{"Authorization": f"Bearer {token}"} for token in tokens]
+    admin = {"Authorization": f"Bearer {admin_token}"}
+
+    def token_2fa(client, i):
+        username, secret = twofa[i % len(twofa)]
+        return client.post("/token_2fa", data={
+            "username": username, "password": PASSWORD, "otp": pyotp.TOTP(secret).now()
+        })
+
+    return {
+        "token": lambda client, i: client.post(
+            "/token", data={"username": users[i % len(users)], "password": PASSWORD}
+        ),
+        "token_2fa": token_2fa,
+        "balance": lambda client, i: client.get("/balance", headers=auth[i % len(auth)]),
+        "deposit": lambda client, i: client.post(
+            "/deposit", data={"amount": 1}, headers=auth[i % len(auth)]
+        ),
+        "transfer": lambda client, i: client.post(
+            "/transfer", data={"to_account_number": accounts[(i + 1) % len(accounts)], "amount": 1},
+            headers=auth[i % len(auth)]
+        ),
+        "transactions": lambda client, i: client.get("/transactions", headers=auth[i % len(auth)]),
+        "admin_dashboard": lambda client, i: client.get("/admin/dashboard", headers=admin),
+    }
+
+
+async def run_scenario(client, send, total, concurrency, warmup):
+    """Closed-loop load: concurrency clients share total requests; returns summary plus error count"""
+    for i in range(warmup):
+        await send(client, i)
+
+    latencies, errors = [], 0
+    remaining = iter(range(warmup, warmup + total))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            with Timer(latencies):
+                response = await send(client, i)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {**summarize(latencies, elapsed), "errors": errors}
+
+
+async def drive(client, data, args):
+    response = await client.post("/admin/login", json={"username": "admin", "password": "admin123"})
+    response.raise_for_status()
+    requests = build_requests(data, response.json()["access_token"])
+
+    results = {}
+    for name in args.scenarios:
+        results[name] = {}
+        for concurrency in args.concurrency:
+            results[name][f"c{concurrency}"] = await run_scenario(
+                client, requests[name], args.requests, concurrency, args.warmup
+            )
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_server(client, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("uvicorn did not start in time")
+
+
+async def run_transport(args):
+    import httpx
+
+    main = load_app()
+    data = seed(main, args.users, args.history)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    if args.transport == "asgi":
+        await main.app.router.startup()
+        transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 50000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits,
+                                     timeout=None) as client:
+            results = await drive(client, data, args)
+        await main.app.router.shutdown()
+        return results
+
+    # The server runs from the same working directory, so it opens the seeded database
+    main.read_pool.close_idle()
+    main.write_pool.close_idle()
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=APP_DIR)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", f"--port={port}",
+         f"--workers={args.server_workers}", "--log-level=warning", "--no-access-log"],
+        cwd=os.getcwd(), env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=None) as client:
+            await wait_for_server(client, server)
+            return await drive(client, data, args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def int_list(value):
+    return [int(part) for part in value.split(",") if part]
+
+
+def name_list(value):
+    names = [part for part in value.split(",") if part]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transports", default="asgi,uvicorn", help="comma-separated: asgi, uvicorn")
+    parser.add_argument("--scenarios", type=name_list, default=list(SCENARIOS), help="comma-separated subset")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 16], help="comma-separated client counts")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per scenario and concurrency")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests before each run")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--history", type=int, default=20, help="seeded transactions per user")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--transport", choices=["asgi", "uvicorn"], help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.transport:
+        print(json.dumps(asyncio.run(run_transport(args))))
+        return
+
+    # Each transport gets its own interpreter and database
+    results = {}
+    for transport in args.transports.split(","):
+        cmd = [sys.executable, os.path.abspath(__file__), f"--transport={transport}",
+               f"--scenarios={','.join(args.scenarios)}",
+               f"--concurrency={','.join(map(str, args.concurrency))}",
+               f"--requests={args.requests}", f"--warmup={args.warmup}", f"--users={args.users}",
+               f"--history={args.history}", f"--server-workers={args.server_workers}"]
+        out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+        results[transport] = json.loads(out.strip().splitlines()[-1])
+
+    print(f"{'transport':<10} {'scenario':<16} {'conc':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'errors':>7}")
+    for transport, scenarios in results.items():
+        for name, runs in scenarios.items():
+            for level, r in runs.items():
+                print(f"{transport:<10} {name:<16} {level[1:]:>5} {r['throughput_rps']:>9} {r['p50_ms']:>9} "
+                      f"{r['p95_ms']:>9} {r['p99_ms']:>9} {r['errors']:>7}")
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ("transport", "output")}
+        config.update(python=sys.version.split()[0], cpu_count=os.cpu_count())
+        with open(args.output, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Bulk payouts: one /transfer call per recipient vs. a single /transfers/batch.
+
+Seeds --recipients accounts straight into SQLite, funds a payer account and
+pays every recipient once each way. Each /transfer call authenticates,
+looks up its recipient and commits on its own; the batch does one
+set-based recipient lookup and one commit for all of them.
+
+    python benchmarks/bench_batch_transfer.py --recipients 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_app  # noqa: E402
+
+PASSWORD = "Bench!Passw0rd"
+
+
+def seed_recipients(db_file, count):
+    """Insert recipient accounts directly, skipping bcrypt"""
+    conn = sqlite3.connect(db_file)
+    conn.executemany(
+        "INSERT INTO users (username, hashed_password, account_number, balance) VALUES (?, 'x', ?, 0)",
+        ((f"payee{i}", f"PAYE-E{i:03X}-0000-{i:04X}") for i in range(count))
+    )
+    conn.commit()
+    accounts = [row[0] for row in conn.execute("SELECT account_number FROM users WHERE username LIKE 'payee%'")]
+    conn.close()
+    return accounts
+
+
+async def run(args):
+    import httpx
+
+    main = load_app()
+    await main.app.router.startup()
+    accounts = seed_recipients(main.DB_FILE, args.recipients)
+
+    transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 50000))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await client.post("/signup", data={"username": "payer", "password": PASSWORD})
+        token = (await client.post("/token", data={"username": "payer", "password": PASSWORD})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        await client.post("/deposit", data={"amount": 2 * args.recipients * args.amount}, headers=headers)
+
+        started = time.perf_counter()
+        for account in accounts:
+            response = await client.post(
+                "/transfer", data={"to_account_number": account, "amount": args.amount}, headers=headers
+            )
+            response.raise_for_status()
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        response = await client.post(
+            "/transfers/batch",
+            json={"transfers": [{"to_account_number": account, "amount": args.amount} for account in accounts]},
+            headers=headers
+        )
+        response.raise_for_status()
+        batch = time.perf_counter() - started
+
+    await main.app.router.shutdown()
+    return {
+        "recipients": args.recipients,
+        "single_s": round(single, 3),
+        "batch_s": round(batch, 3),
+        "speedup": round(single / batch, 1) if batch else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--amount", type=float, default=1.0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(f"{result['recipients']} payouts: {result['single_s']}s as single transfers, "
+          f"{result['batch_s']}s as one batch ({result['speedup']}x)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
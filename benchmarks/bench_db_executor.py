@@ -0,0 +1,141 @@
+"""Concurrent-request latency with and without the DB executor.
+
+A background connection repeatedly holds the SQLite write lock (as a long
+write from another worker would), while requests arrive at a fixed rate,
+mixing /deposit calls, which have to wait on busy_timeout, with /balance
+reads. With the database calls inline on the event loop
+(DB_EXECUTOR_WORKERS=0) every waiting deposit freezes the loop, so /balance
+latency and the loop-lag probe track the lock hold time. With the executors
+the reads stay fast while the deposits wait.
+
+    python benchmarks/bench_db_executor.py --requests 400 --rate 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_app, summarize  # noqa: E402
+
+PASSWORD = "Bench!Passw0rd"
+
+
+def hold_write_lock(db_file, hold_ms, stop):
+    """Keep grabbing the write lock for hold_ms at a time until stopped"""
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    while not stop.is_set():
+        conn.execute("BEGIN IMMEDIATE")
+        time.sleep(hold_ms / 1000.0)
+        conn.execute("COMMIT")
+        time.sleep(0.02)
+    conn.close()
+
+
+async def probe_loop_lag(samples, stop, interval=0.005):
+    """Measure how late the event loop wakes up a sleeping task"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def run_mode(args):
+    import httpx
+
+    workers = "0" if args.mode == "inline" else str(args.workers)
+    main = load_app({"DB_EXECUTOR_WORKERS": workers})
+    await main.app.router.startup()
+
+    transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 50000))
+    limits = httpx.Limits(max_connections=None)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits) as client:
+        await client.post("/signup", data={"username": "bench", "password": PASSWORD})
+        token = (await client.post("/token", data={"username": "bench", "password": PASSWORD})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        stop = threading.Event()
+        locker = threading.Thread(target=hold_write_lock, args=(main.DB_FILE, args.lock_ms, stop), daemon=True)
+        locker.start()
+
+        read_latency, write_latency, loop_lag = [], [], []
+        probe_stop = asyncio.Event()
+        probe = asyncio.create_task(probe_loop_lag(loop_lag, probe_stop))
+        loop = asyncio.get_running_loop()
+
+        # Open-loop arrivals: latency is measured from when a request was
+        # due, so time spent waiting for a frozen event loop is counted.
+        async def one_request(i, due):
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            if i % args.write_every == 0:
+                await client.post("/deposit", data={"amount": 1}, headers=headers)
+                write_latency.append(loop.time() - due)
+            else:
+                await client.get("/balance", headers=headers)
+                read_latency.append(loop.time() - due)
+
+        start = loop.time()
+        await asyncio.gather(*(
+            one_request(i, start + i / args.rate) for i in range(args.requests)
+        ))
+        elapsed = loop.time() - start
+        probe_stop.set()
+        await probe
+        stop.set()
+        locker.join()
+
+    await main.app.router.shutdown()
+    return {
+        "mode": args.mode,
+        "balance": summarize(read_latency, elapsed),
+        "deposit": summarize(write_latency, elapsed),
+        "loop_lag": summarize(loop_lag, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rate", type=float, default=200.0, help="request arrivals per second")
+    parser.add_argument("--workers", type=int, default=8, help="DB executor threads in executor mode")
+    parser.add_argument("--lock-ms", type=int, default=100, help="how long the competing writer holds the lock")
+    parser.add_argument("--write-every", type=int, default=10, help="every Nth request is a deposit")
+    parser.add_argument("--mode", choices=["inline", "executor"], help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(run_mode(args))))
+        return
+
+    # Each mode gets its own interpreter: main.py reads its config at import
+    results = []
+    for mode in ("inline", "executor"):
+        cmd = [sys.executable, os.path.abspath(__file__), "--mode", mode] + [
+            f"--requests={args.requests}", f"--rate={args.rate}",
+            f"--workers={args.workers}", f"--lock-ms={args.lock_ms}", f"--write-every={args.write_every}",
+        ]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"{'mode':<10} {'endpoint':<10} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for result in results:
+        for endpoint in ("balance", "deposit", "loop_lag"):
+            r = result[endpoint]
+            rps = "-" if endpoint == "loop_lag" else r["throughput_rps"]
+            print(f"{result['mode']:<10} {endpoint:<10} {rps:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
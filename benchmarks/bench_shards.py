@@ -0,0 +1,209 @@
+"""Ledger write throughput against the number of shards.
+
+For every shard count in --shards (1 is the unsharded main database) seeds
+--accounts funded accounts into a fresh database, then starts --processes
+writer processes that apply ledger operations as fast as they can for
+--seconds each, the way several uvicorn workers would:
+
+  deposit         POST /deposit on a random account (one shard per operation)
+  local_transfer  transfer to a random account on the payer's shard
+  transfer        transfer to any random account; with N shards (N-1)/N of
+                  them cross shards and take the two-phase path
+
+Operations go through the same entry points as the endpoints, without HTTP,
+so the numbers isolate the ledger. Both the main database and the shards run
+with --synchronous (default FULL, the shard default) so every shard count
+pays the same commit cost.
+
+    python benchmarks/bench_shards.py --shards 1,2,4,8 --processes 8 --output shards.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_app  # noqa: E402
+
+SCENARIOS = ("deposit", "local_transfer", "transfer")
+
+
+def account_number(i):
+    digits = f"{i:016X}"
+    return "-".join(digits[k:k + 4] for k in range(0, 16, 4))
+
+
+def seed(main, accounts):
+    """Insert funded accounts into the main database and, when sharded, straight into their shards"""
+    rows = [(f"bench{i}", account_number(i)) for i in range(accounts)]
+    with main.db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (username, hashed_password, account_number, balance) VALUES (?, 'x', ?, 1000000000)",
+            rows
+        )
+        conn.commit()
+    if main.ledger_shards is None:
+        return
+
+    def insert_accounts(cursor, shard_rows):
+        cursor.executemany(
+            "INSERT INTO users (username, account_number, balance) VALUES (?, ?, 1000000000)", shard_rows
+        )
+
+    for shard in range(main.ledger_shards.count):
+        main.ledger_shards.transaction(
+            shard, insert_accounts, [row for row in rows if main.ledger_shards.index(row[1]) == shard]
+        )
+
+
+def run_worker(args):
+    """One writer process: wait for the go signal, then apply operations for --seconds"""
+    main = load_app(workdir=args.workdir)
+    rng = random.Random(args.worker_id)
+    accounts = [(f"bench{i}", account_number(i)) for i in range(args.accounts)]
+    by_shard = {}
+    if main.ledger_shards is not None:
+        for account in accounts:
+            by_shard.setdefault(main.ledger_shards.index(account[1]), []).append(account)
+
+    def apply(operation, *op_args):
+        if main.ledger_shards is not None:
+            return main.run_sharded_operation(operation, op_args)
+        return main.run_ledger_transaction(operation, *op_args)
+
+    def next_operation():
+        username, account = rng.choice(accounts)
+        if args.scenario == "deposit":
+            return main.ledger_deposit, (username, account, 1.0)
+        if args.scenario == "local_transfer" and main.ledger_shards is not None:
+            candidates = by_shard[main.ledger_shards.index(account)]
+        else:
+            candidates = accounts
+        recipient = rng.choice(candidates)
+        while recipient[1] == account and len(candidates) > 1:
+            recipient = rng.choice(candidates)
+        return main.ledger_transfer, (username, account, recipient[1], 1.0)
+
+    print("ready", flush=True)
+    sys.stdin.readline()
+    ops = errors = 0
+    started = time.perf_counter()
+    deadline = started + args.seconds
+    while time.perf_counter() < deadline:
+        operation, op_args = next_operation()
+        try:
+            apply(operation, *op_args)
+            ops += 1
+        except Exception:
+            errors += 1
+    print(json.dumps({"ops": ops, "errors": errors, "elapsed": time.perf_counter() - started}), flush=True)
+
+
+def run_shard_count(args):
+    """Seed a database with --shard-count shards and drive every scenario against it"""
+    env = {
+        "LEDGER_SHARDS": args.shard_count,
+        "DB_SYNCHRONOUS": args.synchronous,
+        "SHARD_SYNCHRONOUS": args.synchronous,
+        "TRANSACTION_HOT_MONTHS": 0,
+    }
+    main = load_app(env)
+    seed(main, args.accounts)
+    main.read_pool.close_idle()
+    main.write_pool.close_idle()
+    if main.ledger_shards is not None:
+        main.ledger_shards.close_idle()
+    workdir = os.path.dirname(os.getcwd())
+
+    results = {}
+    for scenario in args.scenarios:
+        workers = [
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), f"--worker-id={n}", f"--workdir={workdir}",
+                 f"--scenario={scenario}", f"--accounts={args.accounts}", f"--seconds={args.seconds}"],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+            )
+            for n in range(args.processes)
+        ]
+        for worker in workers:
+            if worker.stdout.readline().strip() != "ready":
+                raise RuntimeError("benchmark worker failed to start")
+        for worker in workers:
+            worker.stdin.write("go\n")
+            worker.stdin.flush()
+        reports = [json.loads(worker.communicate()[0].strip().splitlines()[-1]) for worker in workers]
+
+        ops = sum(report["ops"] for report in reports)
+        elapsed = max(report["elapsed"] for report in reports)
+        results[scenario] = {
+            "ops": ops,
+            "errors": sum(report["errors"] for report in reports),
+            "ops_per_s": round(ops / elapsed, 1) if elapsed else 0.0,
+        }
+    return results
+
+
+def int_list(value):
+    return [int(part) for part in value.split(",") if part]
+
+
+def name_list(value):
+    names = [part for part in value.split(",") if part]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int_list, default=[1, 2, 4, 8], help="comma-separated shard counts")
+    parser.add_argument("--scenarios", type=name_list, default=list(SCENARIOS), help="comma-separated subset")
+    parser.add_argument("--processes", type=int, default=8, help="concurrent writer processes")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of each scenario")
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--synchronous", default="FULL", help="PRAGMA synchronous for every database file")
+    parser.add_argument("--shard-count", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-id", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.worker_id is not None:
+        run_worker(args)
+        return
+    if args.shard_count is not None:
+        print(json.dumps(run_shard_count(args)))
+        return
+
+    # Each shard count gets its own interpreter, since main.py reads LEDGER_SHARDS at import
+    results = {}
+    for count in args.shards:
+        cmd = [sys.executable, os.path.abspath(__file__), f"--shard-count={count}",
+               f"--scenarios={','.join(args.scenarios)}", f"--processes={args.processes}",
+               f"--seconds={args.seconds}", f"--accounts={args.accounts}", f"--synchronous={args.synchronous}"]
+        out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+        results[count] = json.loads(out.strip().splitlines()[-1])
+
+    baseline = results[args.shards[0]]
+    print(f"{'shards':>6} {'scenario':<15} {'ops/s':>9} {'vs first':>9} {'errors':>7}")
+    for count, scenarios in results.items():
+        for name, r in scenarios.items():
+            base = baseline[name]["ops_per_s"]
+            speedup = round(r["ops_per_s"] / base, 2) if base else 0.0
+            print(f"{count:>6} {name:<15} {r['ops_per_s']:>9} {speedup:>8}x {r['errors']:>7}")
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items()
+                  if key not in ("shard_count", "worker_id", "workdir", "scenario", "output")}
+        config.update(python=sys.version.split()[0], cpu_count=os.cpu_count())
+        with open(args.output, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
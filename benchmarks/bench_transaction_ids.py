@@ -0,0 +1,151 @@
+"""Transactions table keyed on tx_<time>_<uuid> TEXT IDs vs. snowflake rowids.
+
+Builds the table both ways in throwaway databases and reports:
+
+  insert   - time to insert --rows transactions in batches of --batch
+  size     - database file size after VACUUM
+  history  - newest page of one user's history (keyset pagination)
+  scan     - a time-ordered range scan over the most recent --scan-rows rows
+
+The legacy IDs only carry 32 random bits per second, so at bulk insert rates
+they collide; colliding rows are skipped and counted.
+
+    python benchmarks/bench_transaction_ids.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import Timer, load_app, summarize  # noqa: E402
+
+LEGACY_SCHEMA = [
+    """CREATE TABLE transactions (
+        id TEXT PRIMARY KEY, user_id TEXT NOT NULL, type TEXT NOT NULL, amount REAL NOT NULL,
+        description TEXT, balance_after REAL, related_account TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, is_flagged BOOLEAN DEFAULT 0)""",
+    "CREATE INDEX idx_transactions_user_time_id ON transactions (user_id, timestamp, id)",
+    "CREATE INDEX idx_transactions_time_id ON transactions (timestamp, id)",
+]
+SNOWFLAKE_SCHEMA = [
+    """CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY, legacy_id TEXT, user_id TEXT NOT NULL, type TEXT NOT NULL, amount REAL NOT NULL,
+        description TEXT, balance_after REAL, related_account TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, is_flagged BOOLEAN DEFAULT 0)""",
+    "CREATE INDEX idx_transactions_user ON transactions (user_id)",
+    "CREATE UNIQUE INDEX idx_transactions_legacy_id ON transactions (legacy_id) WHERE legacy_id IS NOT NULL",
+]
+
+QUERIES = {
+    "legacy": {
+        "history": "SELECT * FROM transactions WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT 100",
+        "scan": "SELECT id, amount FROM transactions WHERE timestamp >= ? ORDER BY timestamp, id",
+    },
+    "snowflake": {
+        "history": "SELECT * FROM transactions WHERE user_id = ? ORDER BY id DESC LIMIT 100",
+        "scan": "SELECT id, amount FROM transactions WHERE id >= ? ORDER BY id",
+    },
+}
+
+
+def legacy_id(now):
+    return f"tx_{now.strftime('%Y%m%d%H%M%S')}_{str(uuid.uuid4())[:8]}"
+
+
+def build(variant, app, db_file, rows, batch, users, rng):
+    """Insert rows in committed batches, as the ledger does; return (elapsed seconds, ID collisions)"""
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    for statement in LEGACY_SCHEMA if variant == "legacy" else SNOWFLAKE_SCHEMA:
+        conn.execute(statement)
+
+    generator = app.SnowflakeGenerator(1)
+    insert = ("INSERT OR IGNORE INTO transactions (id, user_id, type, amount, description, balance_after, "
+              "related_account, timestamp) VALUES (?, ?, 'deposit', ?, 'Deposit', 0, 'ACC', ?)")
+    started = time.perf_counter()
+    for offset in range(0, rows, batch):
+        values = []
+        for _ in range(min(batch, rows - offset)):
+            if variant == "legacy":
+                now = datetime.utcnow()
+                tx_id, stamp = legacy_id(now), now.strftime("%Y-%m-%d %H:%M:%S")
+            else:
+                tx_id = generator.next_id()
+                stamp = app.snowflake_timestamp(tx_id)
+            values.append((tx_id, f"user{rng.randrange(users)}", 1.0, stamp))
+        conn.execute("BEGIN")
+        conn.executemany(insert, values)
+        conn.execute("COMMIT")
+    elapsed = time.perf_counter() - started
+    collisions = rows - conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    conn.execute("VACUUM")
+    conn.close()
+    return elapsed, collisions
+
+
+def run_queries(variant, app, db_file, rounds, users, scan_rows):
+    conn = sqlite3.connect(db_file)
+    queries = QUERIES[variant]
+    if variant == "legacy":
+        scan_from = conn.execute(
+            "SELECT timestamp FROM transactions ORDER BY timestamp DESC LIMIT 1 OFFSET ?", (scan_rows,)
+        ).fetchone()[0]
+    else:
+        scan_from = conn.execute(
+            "SELECT id FROM transactions ORDER BY id DESC LIMIT 1 OFFSET ?", (scan_rows,)
+        ).fetchone()[0]
+    history, scan = [], []
+    for i in range(rounds):
+        with Timer(history):
+            conn.execute(queries["history"], (f"user{i % users}",)).fetchall()
+        with Timer(scan):
+            conn.execute(queries["scan"], (scan_from,)).fetchall()
+    conn.close()
+    return {"history": summarize(history, sum(history)), "scan": summarize(scan, sum(scan))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--batch", type=int, default=100, help="rows per committed insert batch")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--scan-rows", type=int, default=100000, help="rows covered by the range scan")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    app = load_app()
+    workdir = tempfile.mkdtemp(prefix="simplebanking-txids-")
+    results = {}
+    for variant in ("legacy", "snowflake"):
+        db_file = os.path.join(workdir, f"{variant}.db")
+        insert_s, collisions = build(variant, app, db_file, args.rows, args.batch, args.users, random.Random(7))
+        results[variant] = {
+            "insert_s": round(insert_s, 2),
+            "id_collisions": collisions,
+            "size_mb": round(os.path.getsize(db_file) / 1e6, 1),
+            **run_queries(variant, app, db_file, args.rounds, args.users, args.scan_rows),
+        }
+    shutil.rmtree(workdir)
+
+    print(f"{'variant':<10} {'insert s':>9} {'size MB':>8} {'history p50 ms':>15} {'scan p50 ms':>12} {'collisions':>11}")
+    for variant, r in results.items():
+        print(f"{variant:<10} {r['insert_s']:>9} {r['size_mb']:>8} {r['history']['p50_ms']:>15} "
+              f"{r['scan']['p50_ms']:>12} {r['id_collisions']:>11}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Shared helpers for the benchmark scripts.
+
+Every benchmark runs the real app from app/main.py against a throwaway
+database in a temporary directory, so it never touches simple_banking.db.
+"""
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(REPO_ROOT, "app")
+
+
+def load_app(env=None, workdir=None):
+    """Import app/main.py inside a fresh temporary working directory.
+
+    main.py resolves its database and template paths relative to the current
+    directory, so we recreate the app/ + templates/ + static/ layout in a
+    temp dir before importing it. Environment overrides must be applied
+    before import because main.py reads its configuration at import time.
+    Pass the workdir of an earlier load_app() (the parent of the directory
+    it switched to) to share its database from another process. The
+    database is created (or migrated) here, so it can be seeded before the
+    app's startup hook runs.
+    """
+    for key, value in (env or {}).items():
+        os.environ[key] = str(value)
+
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="simplebanking-bench-")
+        os.makedirs(os.path.join(workdir, "app"))
+        for name in ("templates", "static"):
+            os.symlink(os.path.join(REPO_ROOT, name), os.path.join(workdir, name))
+    os.chdir(os.path.join(workdir, "app"))
+
+    sys.path.insert(0, APP_DIR)
+    import main
+    main.open_storage()
+    return main
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples, elapsed):
+    """Throughput and latency percentiles (ms) for a list of latencies in seconds"""
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2) if samples else 0.0,
+    }
+
+
+class Timer:
+    """Context manager that appends the elapsed wall time to a list"""
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self.start)
+        return False
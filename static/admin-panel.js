@@ -3,6 +3,22 @@
         const API_BASE = "http://127.0.0.1:8000";
         let adminToken = localStorage.getItem('adminToken');
         
+        // Latest data shown on the dashboard; live events are applied on top
+        let dashboardState = null;
+        let recentUsers = [];
+        let recentTransactions = [];
+        let securityLogs = null;
+        let eventSource = null;
+        
+        // Paged lists: rows loaded so far and the cursor for the next page
+        // (null once the last page is in)
+        let allUsers = [];
+        let usersCursor = null;
+        let allTransactions = [];
+        let transactionsCursor = null;
+        let transactionsFilter = 'all';
+        let securityLogsCursor = null;
+        
         // Check authentication
         if (!adminToken) {
             window.location.href = '/admin/login';
@@ -29,6 +45,7 @@
             await loadDashboardData();
             await loadRecentUsers();
             await loadRecentTransactions();
+            connectEventStream();
             
             // Navigation
             navItems.forEach(item => {
@@ -70,8 +87,10 @@
             });
             
             // Refresh buttons
-            document.getElementById('refreshUsers')?.addEventListener('click', loadAllUsers);
-            document.getElementById('refreshTransactions')?.addEventListener('click', loadAllTransactions);
+            document.getElementById('refreshUsers')?.addEventListener('click', () => loadAllUsers());
+            document.getElementById('refreshTransactions')?.addEventListener('click', () => {
+                loadAllTransactions(transactionsFilter);
+            });
             
             // User search
             document.getElementById('userSearch')?.addEventListener('input', function(e) {
@@ -112,68 +131,110 @@
         
         // ===== API FUNCTIONS =====
         
+        async function adminFetch(endpoint, method = 'GET', body = null) {
+            const options = {
+                method,
+                headers: {
+                    'Authorization': `Bearer ${adminToken}`,
+                    'Content-Type': 'application/json'
+                }
+            };
+            
+            if (body) {
+                options.body = JSON.stringify(body);
+            }
+            
+            const response = await fetch(`${API_BASE}${endpoint}`, options);
+            
+            if (response.status === 401) {
+                // Token expired
+                localStorage.removeItem('adminToken');
+                window.location.href = '/admin/login';
+                return null;
+            }
+            
+            return response;
+        }
+        
         async function makeAdminRequest(endpoint, method = 'GET', body = null) {
             try {
-                const options = {
-                    method,
-                    headers: {
-                        'Authorization': `Bearer ${adminToken}`,
-                        'Content-Type': 'application/json'
-                    }
+                const response = await adminFetch(endpoint, method, body);
+                return response ? await response.json() : null;
+            } catch (error) {
+                console.error('Admin API error:', error);
+                return null;
+            }
+        }
+        
+        // One page of a list endpoint: { items, nextCursor } or null
+        async function fetchAdminPage(endpoint, cursor = null) {
+            if (cursor) {
+                endpoint += `${endpoint.includes('?') ? '&' : '?'}cursor=${encodeURIComponent(cursor)}`;
+            }
+            try {
+                const response = await adminFetch(endpoint);
+                if (!response || !response.ok) return null;
+                return {
+                    items: await response.json(),
+                    nextCursor: response.headers.get('X-Next-Cursor')
                 };
-                
-                if (body) {
-                    options.body = JSON.stringify(body);
-                }
-                
-                const response = await fetch(`${API_BASE}${endpoint}`, options);
-                
-                if (response.status === 401) {
-                    // Token expired
-                    localStorage.removeItem('adminToken');
-                    window.location.href = '/admin/login';
-                    return null;
-                }
-                
-                return await response.json();
             } catch (error) {
                 console.error('Admin API error:', error);
                 return null;
             }
         }
         
+        function loadMoreButton(id, cursor) {
+            return cursor
+                ? `<div style="text-align: center; margin-top: 15px;"><button class="btn btn-primary btn-sm" id="${id}">Load more</button></div>`
+                : '';
+        }
+        
         async function loadDashboardData() {
             const data = await makeAdminRequest('/admin/dashboard');
             if (data) {
-                document.getElementById('totalUsers').textContent = data.total_users || 0;
-                document.getElementById('activeSessions').textContent = data.active_sessions || 0;
-                document.getElementById('todayTransactions').textContent = data.today_transactions || 0;
-                document.getElementById('failedLogins').textContent = data.failed_logins_24h || 0;
-                
-                // Update trends
-                if (data.user_trend) {
-                    document.getElementById('userTrend').innerHTML = 
-                        `<span>+${data.user_trend} today</span>`;
-                }
-                
-                if (data.session_status) {
-                    document.getElementById('sessionStatus').textContent = data.session_status;
-                }
-                
-                if (data.transaction_total) {
-                    document.getElementById('transactionTrend').innerHTML = 
-                        `<span>$${data.transaction_total.toLocaleString()} total</span>`;
-                }
-                
-                if (data.blocked_attempts) {
-                    document.getElementById('securityStatus').innerHTML = 
-                        `<span>${data.blocked_attempts} blocked</span>`;
-                }
+                renderDashboard(data);
+            }
+        }
+        
+        function renderDashboard(data) {
+            dashboardState = data;
+            document.getElementById('totalUsers').textContent = data.total_users || 0;
+            document.getElementById('activeSessions').textContent = data.active_sessions || 0;
+            document.getElementById('todayTransactions').textContent = data.today_transactions || 0;
+            document.getElementById('failedLogins').textContent = data.failed_logins_24h || 0;
+            
+            // Update trends
+            if (data.user_trend) {
+                document.getElementById('userTrend').innerHTML = 
+                    `<span>+${data.user_trend} today</span>`;
+            }
+            
+            if (data.session_status) {
+                document.getElementById('sessionStatus').textContent = data.session_status;
+            }
+            
+            if (data.transaction_total) {
+                document.getElementById('transactionTrend').innerHTML = 
+                    `<span>$${data.transaction_total.toLocaleString()} total</span>`;
+            }
+            
+            if (data.blocked_attempts) {
+                document.getElementById('securityStatus').innerHTML = 
+                    `<span>${data.blocked_attempts} blocked</span>`;
             }
         }
         
         async function loadRecentUsers() {
             const data = await makeAdminRequest('/admin/users/recent?limit=5');
+            if (data) {
+                recentUsers = data;
+                renderRecentUsers();
+            }
+        }
+        
+        function renderRecentUsers() {
+            const data = recentUsers;
             if (data && data.length > 0) {
                 const table = generateUsersTable(data, true);
                 document.getElementById('recentUsersTable').innerHTML = table;
@@ -190,11 +251,24 @@
             }
         }
         
-        async function loadAllUsers() {
-            const data = await makeAdminRequest('/admin/users');
+        async function loadAllUsers(append = false) {
+            const page = await fetchAdminPage('/admin/users', append ? usersCursor : null);
+            if (!page) return;
+            allUsers = append ? allUsers.concat(page.items) : page.items;
+            usersCursor = page.nextCursor;
+            renderAllUsers();
+        }
+        
+        function renderAllUsers() {
+            const data = allUsers;
             if (data && data.length > 0) {
                 const table = generateUsersTable(data, false);
-                document.getElementById('usersTable').innerHTML = table;
+                document.getElementById('usersTable').innerHTML = table + loadMoreButton('loadMoreUsers', usersCursor);
+                document.getElementById('loadMoreUsers')?.addEventListener('click', () => loadAllUsers(true));
+                
+                // Keep the current search applied to newly loaded rows
+                const search = document.getElementById('userSearch');
+                if (search && search.value) filterUsers(search.value);
                 
                 // Add click handlers
                 document.querySelectorAll('.view-user-btn').forEach(btn => {
@@ -276,6 +350,14 @@
         
         async function loadRecentTransactions() {
             const data = await makeAdminRequest('/admin/transactions/recent?limit=5');
+            if (data) {
+                recentTransactions = data;
+                renderRecentTransactions();
+            }
+        }
+        
+        function renderRecentTransactions() {
+            const data = recentTransactions;
             if (data && data.length > 0) {
                 const table = generateTransactionsTable(data);
                 document.getElementById('recentTransactionsTable').innerHTML = table;
@@ -293,16 +375,29 @@
             }
         }
         
-        async function loadAllTransactions(filter = 'all') {
+        async function loadAllTransactions(filter = 'all', append = false) {
             let endpoint = '/admin/transactions';
             if (filter !== 'all') {
                 endpoint += `?filter=${filter}`;
             }
             
-            const data = await makeAdminRequest(endpoint);
+            const page = await fetchAdminPage(endpoint, append ? transactionsCursor : null);
+            if (!page) return;
+            allTransactions = append ? allTransactions.concat(page.items) : page.items;
+            transactionsCursor = page.nextCursor;
+            transactionsFilter = filter;
+            renderAllTransactions();
+        }
+        
+        function renderAllTransactions() {
+            const data = allTransactions;
             if (data && data.length > 0) {
                 const table = generateTransactionsTable(data);
-                document.getElementById('transactionsTable').innerHTML = table;
+                document.getElementById('transactionsTable').innerHTML =
+                    table + loadMoreButton('loadMoreTransactions', transactionsCursor);
+                document.getElementById('loadMoreTransactions')?.addEventListener('click', () => {
+                    loadAllTransactions(transactionsFilter, true);
+                });
                 
                 // Add flag/unflag buttons
                 document.querySelectorAll('.flag-transaction-btn').forEach(btn => {
@@ -366,8 +461,17 @@
             return html;
         }
         
-        async function loadSecurityLogs() {
-            const data = await makeAdminRequest('/admin/security/logs?limit=50');
+        async function loadSecurityLogs(append = false) {
+            const page = await fetchAdminPage('/admin/security/logs?limit=50', append ? securityLogsCursor : null);
+            if (page) {
+                securityLogs = append ? securityLogs.concat(page.items) : page.items;
+                securityLogsCursor = page.nextCursor;
+                renderSecurityLogs();
+            }
+        }
+        
+        function renderSecurityLogs() {
+            const data = securityLogs;
             if (data) {
                 document.getElementById('securityFailedLogins').textContent = data.length || 0;
                 
@@ -381,7 +485,9 @@
                 
                 if (data.length > 0) {
                     const table = generateSecurityLogsTable(data);
-                    document.getElementById('securityLogsTable').innerHTML = table;
+                    document.getElementById('securityLogsTable').innerHTML =
+                        table + loadMoreButton('loadMoreSecurityLogs', securityLogsCursor);
+                    document.getElementById('loadMoreSecurityLogs')?.addEventListener('click', () => loadSecurityLogs(true));
                 } else {
                     document.getElementById('securityLogsTable').innerHTML = '<p>No security logs found</p>';
                 }
@@ -481,7 +587,12 @@
         const data = await makeAdminRequest(`/admin/users/${userId}/lock?lock=${lock}`, 'POST');
         if (data) {
             alert(data.message || 'User status updated');
-            loadAllUsers();
+            // Update the row in place so rows from later pages stay loaded
+            const user = allUsers.find(u => String(u.id) === String(userId));
+            if (user) {
+                user.is_locked = lock;
+                renderAllUsers();
+            }
             loadDashboardData();
         }
     }
@@ -503,7 +614,11 @@
         const data = await makeAdminRequest(`/admin/transactions/${txId}/flag?flag=${flag}`, 'POST');
         if (data) {
             alert(data.message || 'Transaction flag updated');
-            loadAllTransactions(document.getElementById('transactionFilter').value);
+            const tx = allTransactions.find(t => String(t.id) === String(txId));
+            if (tx) {
+                tx.is_flagged = flag;
+                renderAllTransactions();
+            }
         }
     }
 }
@@ -565,12 +680,85 @@
             });
         }
         
-        // Auto-refresh dashboard every 30 seconds
-        setInterval(() => {
-            if (pages.dashboard.style.display !== 'none') {
-                loadDashboardData();
+        // ===== LIVE UPDATES =====
+        // One Server-Sent Events stream replaces polling: the server pushes
+        // new transactions, users, locks, security events and failed-login
+        // counts, plus a periodic dashboard snapshot.
+        
+        async function connectEventStream() {
+            // A single-use ticket keeps the admin token out of the URL
+            const ticket = await makeAdminRequest('/admin/events/ticket', 'POST');
+            if (!ticket || !ticket.ticket) {
+                setTimeout(connectEventStream, 5000);
+                return;
             }
-        }, 30000);
+            const url = `${API_BASE}/admin/events/stream?ticket=${encodeURIComponent(ticket.ticket)}`;
+            eventSource = new EventSource(url);
+            
+            eventSource.addEventListener('dashboard', e => renderDashboard(JSON.parse(e.data)));
+            
+            eventSource.addEventListener('transaction', e => {
+                const tx = JSON.parse(e.data);
+                if (dashboardState) {
+                    dashboardState.today_transactions += 1;
+                    dashboardState.transaction_total += tx.amount;
+                    renderDashboard(dashboardState);
+                }
+                recentTransactions = [tx, ...recentTransactions].slice(0, 5);
+                renderRecentTransactions();
+            });
+            
+            eventSource.addEventListener('user', e => {
+                const user = JSON.parse(e.data);
+                if (dashboardState) {
+                    dashboardState.total_users += 1;
+                    dashboardState.user_trend += 1;
+                    renderDashboard(dashboardState);
+                }
+                recentUsers = [user, ...recentUsers].slice(0, 5);
+                renderRecentUsers();
+            });
+            
+            eventSource.addEventListener('lock', () => {
+                if (dashboardState) {
+                    dashboardState.blocked_attempts += 1;
+                    renderDashboard(dashboardState);
+                }
+            });
+            
+            eventSource.addEventListener('counts', e => {
+                const counts = JSON.parse(e.data);
+                if (dashboardState && counts.failed_login) {
+                    dashboardState.failed_logins_24h += counts.failed_login;
+                    renderDashboard(dashboardState);
+                }
+            });
+            
+            eventSource.addEventListener('security', e => {
+                if (securityLogs) {
+                    // Not trimmed: older pages the admin loaded stay in view
+                    securityLogs = [JSON.parse(e.data), ...securityLogs];
+                    renderSecurityLogs();
+                }
+            });
+            
+            // We fell too far behind for deltas; reload everything once
+            eventSource.addEventListener('resync', () => {
+                loadDashboardData();
+                loadRecentUsers();
+                loadRecentTransactions();
+                if (securityLogs) loadSecurityLogs();
+            });
+            
+            eventSource.onerror = async function() {
+                // The ticket is used up, so reconnect with a new one instead of
+                // letting EventSource retry the same URL
+                eventSource.close();
+                // Redirects to the login page if the token has expired
+                await loadDashboardData();
+                setTimeout(connectEventStream, 5000);
+            };
+        }
         
         // Check token every 5 minutes
         setInterval(() => {
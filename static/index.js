@@ -239,6 +239,10 @@ async function changePassword() {
 
         const data = await response.json();
         if (response.ok) {
+            // Older tokens are revoked; keep this session on the new one
+            if (data.access_token) {
+                localStorage.setItem('authToken', data.access_token);
+            }
             msg.textContent = 'Password updated successfully!';
             msg.style.color = '#4ade80';
             // Clear form after successful update
@@ -0,0 +1,150 @@
+"""Shared fixtures for the test suite.
+
+Every test runs the real app from app/main.py against a throwaway database
+in pytest's tmp_path, so it never touches simple_banking.db. main.py reads
+its configuration at import time and keeps its caches in module globals, so
+each test imports a fresh copy with its own environment (sharded, group
+commit, ...). Importing opens nothing; the database is created by the
+startup hook when the TestClient starts.
+"""
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(REPO_ROOT, "app")
+
+PASSWORD = "Passw0rd!"
+
+
+@pytest.fixture
+def load_app(tmp_path, monkeypatch):
+    """Return a function that imports main.py with environment overrides.
+
+    main.py resolves its template and static paths relative to the current
+    directory, so we recreate the app/ + templates/ + static/ layout in
+    tmp_path before importing it. The database lives in tmp_path/app.
+    """
+    def load(**env):
+        for key, value in env.items():
+            monkeypatch.setenv(key, str(value))
+        os.makedirs(tmp_path / "app", exist_ok=True)
+        for name in ("templates", "static"):
+            if not os.path.exists(tmp_path / name):
+                os.symlink(os.path.join(REPO_ROOT, name), tmp_path / name)
+        monkeypatch.chdir(tmp_path / "app")
+        monkeypatch.setenv("DB_FILE", str(tmp_path / "app" / "simple_banking.db"))
+        monkeypatch.syspath_prepend(APP_DIR)
+        sys.modules.pop("main", None)
+        import main
+        return main
+
+    yield load
+    sys.modules.pop("main", None)
+
+
+class Bank:
+    """TestClient wrapper with helpers for accounts and tokens"""
+
+    def __init__(self, main, client):
+        self.main = main
+        self.client = client
+        self.accounts = {}
+        self.tokens = {}
+
+    def signup(self, username, deposit=0):
+        response = self.client.post("/signup", data={"username": username, "password": PASSWORD})
+        assert response.status_code == 200, response.text
+        self.accounts[username] = response.json()["account_number"]
+        self.tokens[username] = self.login(username)
+        if deposit:
+            response = self.client.post("/deposit", data={"amount": deposit}, headers=self.auth(username))
+            assert response.status_code == 200, response.text
+        return self.accounts[username]
+
+    def login(self, username, password=PASSWORD):
+        response = self.client.post("/token", data={"username": username, "password": password})
+        assert response.status_code == 200, response.text
+        return response.json()["access_token"]
+
+    def auth(self, username, **headers):
+        return {"Authorization": f"Bearer {self.tokens[username]}", **headers}
+
+    def balance(self, username):
+        response = self.client.get("/balance", headers=self.auth(username))
+        assert response.status_code == 200, response.text
+        return response.json()["balance"]
+
+    def transactions(self, username):
+        return self.main.db_fetchall(
+            "SELECT type, amount FROM transactions WHERE user_id = ? ORDER BY id", (username,)
+        )
+
+    def fail_credits_to(self, username):
+        """Make any balance increase for username fail, as if the process died mid-transfer"""
+        conn = sqlite3.connect(self.main.DB_FILE)
+        conn.execute(f'''
+            CREATE TRIGGER fail_credit BEFORE UPDATE OF balance ON users
+            WHEN NEW.username = '{username}' AND NEW.balance > OLD.balance
+            BEGIN SELECT RAISE(ABORT, 'simulated crash before the credit leg'); END
+        ''')
+        conn.commit()
+        conn.close()
+
+    def admin_auth(self):
+        if "admin" not in self.tokens:
+            response = self.client.post("/admin/login",
+                                        json={"username": "admin", "password": self.main.ADMIN_PASSWORD})
+            assert response.status_code == 200, response.text
+            self.tokens["admin"] = response.json()["access_token"]
+        return {"Authorization": f"Bearer {self.tokens['admin']}"}
+
+    def insert_old_deposits(self, username, when, count):
+        """Insert deposits at a past time directly, with IDs no live worker uses"""
+        main = self.main
+        ms = int((when - datetime(2020, 1, 1)).total_seconds() * 1000)
+        ids = [(ms << 22) | (1023 << 12) | n for n in range(count)]
+        with main.db_connection() as conn:
+            conn.executemany(
+                "INSERT INTO transactions (id, user_id, type, amount, description, balance_after, "
+                "related_account, timestamp) VALUES (?, ?, 'deposit', 1, 'Deposit: $1.00', 0, ?, ?)",
+                [(tx_id, username, self.accounts[username], main.snowflake_timestamp(tx_id)) for tx_id in ids]
+            )
+            conn.commit()
+        return ids
+
+    def archive_all(self):
+        """Run the archiver until nothing is left to move; returns the rows moved"""
+        moved = 0
+        while True:
+            count = self.main.archive_transactions_batch()
+            if not count:
+                return moved
+            moved += count
+
+
+@pytest.fixture
+def bank_factory(load_app):
+    """Return a function that starts the app with environment overrides"""
+    clients = []
+
+    def start(**env):
+        main = load_app(**env)
+        client = TestClient(main.app)
+        client.__enter__()
+        clients.append(client)
+        return Bank(main, client)
+
+    yield start
+    for client in clients:
+        client.__exit__(None, None, None)
+
+
+@pytest.fixture
+def bank(bank_factory):
+    """The app with its default configuration"""
+    return bank_factory()
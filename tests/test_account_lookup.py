@@ -0,0 +1,63 @@
+"""Account-number lookups through idx_users_account_number_norm and the recipient cache"""
+
+
+def test_account_numbers_match_with_or_without_dashes(bank):
+    account_number = bank.signup("bob")
+    bank.signup("alice")
+    bare = account_number.replace("-", "").lower()
+
+    dashed = bank.client.get(f"/users/{account_number}", headers=bank.auth("alice"))
+    undashed = bank.client.get(f"/users/{bare}", headers=bank.auth("alice"))
+
+    assert dashed.status_code == 200 and undashed.status_code == 200
+    assert dashed.json() == undashed.json()
+    assert dashed.json()["username"] == "bob" and dashed.json()["account_number"] == account_number
+    assert bank.client.get("/users/0000-0000-0000-0000", headers=bank.auth("alice")).status_code == 404
+
+
+def test_bulk_lookup_reports_missing_numbers(bank, monkeypatch):
+    main = bank.main
+    monkeypatch.setattr(main, "SQL_IN_CHUNK", 2)
+    accounts = [bank.signup(f"user{n}") for n in range(5)]
+    requested = accounts + ["FFFF-FFFF-FFFF-FFFF"]
+
+    response = bank.client.post("/users/lookup", json={"account_numbers": requested},
+                                headers=bank.auth("user0"))
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert {number: user["username"] for number, user in body["users"].items()} == {
+        account: f"user{n}" for n, account in enumerate(accounts)
+    }
+    assert body["missing"] == ["FFFF-FFFF-FFFF-FFFF"]
+
+
+def test_repeated_lookups_are_served_from_the_recipient_cache(bank, monkeypatch):
+    main = bank.main
+    account_number = bank.signup("bob")
+    bank.signup("alice")
+    queries = []
+    fetch_public_profiles = main.fetch_public_profiles
+
+    def counting(normalized):
+        queries.append(list(normalized))
+        return fetch_public_profiles(normalized)
+
+    monkeypatch.setattr(main, "fetch_public_profiles", counting)
+
+    for number in (account_number, account_number.replace("-", ""), account_number):
+        assert bank.client.get(f"/users/{number}", headers=bank.auth("alice")).status_code == 200
+
+    assert queries == [[account_number.replace("-", "")]]
+
+
+def test_lookup_uses_the_normalized_index(bank):
+    main = bank.main
+
+    with main.db_connection(readonly=True) as conn:
+        plan = " ".join(row["detail"] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT username FROM users WHERE REPLACE(account_number, '-', '') IN (?, ?)",
+            ("A", "B")
+        ))
+
+    assert "idx_users_account_number_norm" in plan
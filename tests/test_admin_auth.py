@@ -0,0 +1,40 @@
+"""Admin authentication against the admins table and the admin principal cache"""
+import sqlite3
+
+
+def set_admin_active(bank, active):
+    # Changed by another worker (or by hand): nothing in this worker is invalidated
+    conn = sqlite3.connect(bank.main.DB_FILE)
+    conn.execute("UPDATE admins SET is_active = ? WHERE username = 'admin'", (int(active),))
+    conn.commit()
+    conn.close()
+
+
+def test_deactivated_admin_is_rejected_on_the_next_request(bank):
+    admin = bank.admin_auth()
+    assert bank.client.get("/admin/settings", headers=admin).status_code == 200
+
+    set_admin_active(bank, False)
+
+    assert bank.client.get("/admin/settings", headers=admin).status_code == 401
+
+
+def test_deactivated_admin_cannot_log_in(bank):
+    set_admin_active(bank, False)
+
+    response = bank.client.post("/admin/login", json={"username": "admin", "password": bank.main.ADMIN_PASSWORD})
+
+    assert response.status_code == 403
+
+
+def test_cached_admin_is_dropped_after_a_principal_sync(bank_factory):
+    bank = bank_factory(ADMIN_PRINCIPAL_CACHE_TTL="60", PRINCIPAL_SYNC_SECONDS="3600")
+    admin = bank.admin_auth()
+    assert bank.client.get("/admin/settings", headers=admin).status_code == 200
+
+    set_admin_active(bank, False)
+    # Served from the cache until the change is synced
+    assert bank.client.get("/admin/settings", headers=admin).status_code == 200
+    assert bank.main.sync_principal_invalidations() == 1
+
+    assert bank.client.get("/admin/settings", headers=admin).status_code == 401
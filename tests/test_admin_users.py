@@ -0,0 +1,48 @@
+"""Admin user listings and their failed-login counts from failed_logins_hourly"""
+from datetime import datetime, timedelta
+
+
+def failed_attempts(bank, endpoint="/admin/users"):
+    response = bank.client.get(endpoint, headers=bank.admin_auth())
+    assert response.status_code == 200, response.text
+    return {user["username"]: user["failed_attempts"] for user in response.json()}
+
+
+def test_listings_count_failed_logins_of_the_last_day(bank):
+    bank.signup("alice")
+    bank.signup("bob")
+    for _ in range(3):
+        bank.client.post("/token", data={"username": "alice", "password": "wrong"})
+    bank.client.portal.call(bank.main.login_attempt_writer.flush)
+    # An hour outside the 24-hour window
+    old_hour = (datetime.utcnow() - timedelta(days=2)).strftime("%Y-%m-%d %H:00:00")
+    with bank.main.db_connection() as conn:
+        conn.execute("INSERT INTO failed_logins_hourly (username, hour, failures) VALUES ('bob', ?, 4)", (old_hour,))
+        conn.commit()
+
+    assert failed_attempts(bank) == {"alice": 3, "bob": 0}
+    assert failed_attempts(bank, "/admin/users/recent") == {"alice": 3, "bob": 0}
+
+
+def test_successful_login_resets_the_listed_count(bank):
+    bank.signup("alice")
+    for _ in range(2):
+        bank.client.post("/token", data={"username": "alice", "password": "wrong"})
+
+    bank.login("alice")
+
+    assert failed_attempts(bank) == {"alice": 0}
+
+
+def test_rebuild_recounts_failed_logins_per_user(bank):
+    bank.signup("alice")
+    for _ in range(2):
+        bank.client.post("/token", data={"username": "alice", "password": "wrong"})
+    bank.client.portal.call(bank.main.login_attempt_writer.flush)
+    with bank.main.db_connection() as conn:
+        conn.execute("DELETE FROM failed_logins_hourly")
+        conn.commit()
+
+    bank.main.run_dashboard_rebuild()
+
+    assert failed_attempts(bank) == {"alice": 2}
@@ -0,0 +1,67 @@
+"""Monthly transaction archives and reads across them"""
+from datetime import datetime, timedelta
+
+
+def test_history_pages_across_the_hot_table_and_an_archive(bank):
+    main = bank.main
+    bank.signup("alice", deposit=5)
+    old = bank.insert_old_deposits("alice", datetime.utcnow() - timedelta(days=200), 3)
+    assert bank.archive_all() == 3
+    assert main.db_fetchone("SELECT COUNT(*) AS n FROM transactions WHERE user_id = 'alice'")["n"] == 1
+
+    first = bank.client.get("/transactions?limit=2", headers=bank.auth("alice")).json()
+    second = bank.client.get(f"/transactions?limit=2&cursor={first['next_cursor']}",
+                             headers=bank.auth("alice")).json()
+
+    ids = [tx["id"] for tx in first["transactions"] + second["transactions"]]
+    assert [tx["amount"] for tx in first["transactions"]] == [5, 1]
+    assert ids[1:] == [str(tx_id) for tx_id in reversed(old)]
+    assert second["next_cursor"] is None
+
+
+def test_user_history_skips_archives_without_the_users_rows(bank):
+    main = bank.main
+    bank.signup("alice")
+    bank.signup("bob")
+    now = datetime.utcnow()
+    bank.insert_old_deposits("alice", now - timedelta(days=200), 2)
+    bank.insert_old_deposits("bob", now - timedelta(days=300), 2)
+    bank.archive_all()
+
+    with main.db_connection(readonly=True) as conn:
+        everyone = main.transaction_partitions(conn)
+        alice = main.transaction_partitions(conn, user_id="alice")
+        carol = main.transaction_partitions(conn, user_id="carol")
+
+    assert len(everyone) == 3
+    assert len(alice) == 2 and alice[1][0] in [path for path, _ in everyone]
+    assert carol == [(None, "main.transactions")]
+    history = bank.client.get("/transactions", headers=bank.auth("bob")).json()["transactions"]
+    assert [tx["amount"] for tx in history] == [1, 1]
+
+
+def test_archive_user_counts_are_backfilled_by_the_migration(bank):
+    main = bank.main
+    bank.signup("alice")
+    bank.insert_old_deposits("alice", datetime.utcnow() - timedelta(days=200), 4)
+    bank.archive_all()
+    with main.db_connection() as conn:
+        conn.execute("DELETE FROM transaction_archive_users")
+        main.create_transaction_archive_users_table(conn.cursor())
+        conn.commit()
+
+    assert [dict(row) for row in main.db_fetchall("SELECT user_id, rows FROM transaction_archive_users")] == [
+        {"user_id": "alice", "rows": 4}
+    ]
+
+
+def test_sharded_ledger_warns_that_archiving_is_off(bank_factory, capsys):
+    bank = bank_factory(LEDGER_SHARDS="2", TRANSACTION_HOT_MONTHS="3")
+    assert "transaction archiving is not supported with LEDGER_SHARDS" in capsys.readouterr().out
+    assert bank.main.transaction_archiver is None
+
+
+def test_no_archiving_warning_when_archiving_is_disabled(bank_factory, capsys):
+    bank = bank_factory(LEDGER_SHARDS="2", TRANSACTION_HOT_MONTHS="0")
+    assert "transaction archiving" not in capsys.readouterr().out
+    assert bank.main.transaction_archiver is None
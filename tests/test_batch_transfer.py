@@ -0,0 +1,81 @@
+"""Batch transfers: all-or-nothing and best-effort payouts"""
+
+
+def pay(bank, transfers, mode="all_or_nothing", **headers):
+    return bank.client.post("/transfers/batch", json={"transfers": transfers, "mode": mode},
+                            headers=bank.auth("alice", **headers))
+
+
+def test_payout_to_many_recipients_in_one_transaction(bank):
+    bank.signup("alice", deposit=100)
+    bob = bank.signup("bob")
+    carol = bank.signup("carol", deposit=1)
+
+    response = pay(bank, [{"to_account_number": bob, "amount": 10},
+                          {"to_account_number": carol, "amount": 20},
+                          {"to_account_number": bob, "amount": 5}])
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert (body["transferred"], body["failed"], body["total_amount"], body["new_balance"]) == (3, 0, 35, 65)
+    assert all(result["transaction_id"].isdigit() for result in body["results"])
+    assert bank.balance("bob") == 15 and bank.balance("carol") == 21
+    # Each received row carries the recipient's running balance
+    rows = bank.main.db_fetchall(
+        "SELECT amount, balance_after FROM transactions WHERE user_id = 'bob' ORDER BY id"
+    )
+    assert [(row["amount"], row["balance_after"]) for row in rows] == [(10, 10), (5, 15)]
+
+
+def test_all_or_nothing_rejects_the_whole_batch(bank):
+    bank.signup("alice", deposit=100)
+    bob = bank.signup("bob")
+
+    response = pay(bank, [{"to_account_number": bob, "amount": 10},
+                          {"to_account_number": "0000-0000-0000", "amount": 5}])
+
+    assert response.status_code == 400
+    statuses = [result["status"] for result in response.json()["detail"]["results"]]
+    assert statuses == ["skipped", "failed"]
+    assert bank.balance("alice") == 100 and bank.balance("bob") == 0
+
+
+def test_best_effort_pays_in_order_while_funds_last(bank):
+    bank.signup("alice", deposit=50)
+    bob = bank.signup("bob")
+
+    response = pay(bank, [{"to_account_number": bob, "amount": 30},
+                          {"to_account_number": bob, "amount": 30},
+                          {"to_account_number": bank.accounts["alice"], "amount": 1},
+                          {"to_account_number": bob, "amount": 20}], mode="best_effort")
+
+    assert response.status_code == 200, response.text
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == ["completed", "failed", "failed", "completed"]
+    assert [result["error"] for result in results][1:3] == ["Insufficient funds", "Cannot transfer to yourself"]
+    assert bank.balance("alice") == 0 and bank.balance("bob") == 50
+
+
+def test_batch_limits_and_mode_are_checked(bank_factory):
+    bank = bank_factory(MAX_BATCH_TRANSFERS="2")
+    bank.signup("alice", deposit=50)
+    bob = bank.signup("bob")
+    item = {"to_account_number": bob, "amount": 1}
+
+    assert pay(bank, [item] * 3).status_code == 400
+    assert pay(bank, []).status_code == 400
+    assert pay(bank, [item], mode="sometimes").status_code == 400
+    assert bank.balance("alice") == 50
+
+
+def test_batch_with_an_idempotency_key_pays_once(bank):
+    bank.signup("alice", deposit=50)
+    bob = bank.signup("bob")
+    transfers = [{"to_account_number": bob, "amount": 10}]
+
+    first = pay(bank, transfers, **{"Idempotency-Key": "payroll-1"})
+    replay = pay(bank, transfers, **{"Idempotency-Key": "payroll-1"})
+
+    assert first.status_code == 200 and replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json() == first.json()
+    assert bank.balance("bob") == 10
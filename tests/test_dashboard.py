@@ -0,0 +1,50 @@
+"""Dashboard rollups: upkeep as activity happens and rebuilds from the raw tables"""
+from datetime import datetime, timedelta
+
+
+def hourly(main):
+    return [tuple(row.values()) for row in main.db_fetchall(
+        "SELECT hour, transactions, transaction_total FROM stats_hourly WHERE transactions > 0 ORDER BY hour"
+    )]
+
+
+def test_rebuild_keeps_the_hours_of_archived_months(bank):
+    main = bank.main
+    bank.signup("alice", deposit=5)
+    old = datetime.utcnow() - timedelta(days=200)
+    bank.insert_old_deposits("alice", old, 3)
+    main.run_dashboard_rebuild()
+    before = hourly(main)
+    assert before[0] == (old.strftime("%Y-%m-%d %H:00:00"), 3, 3)
+
+    assert bank.archive_all() == 3
+    response = bank.client.post("/admin/system/rebuild-stats", headers=bank.admin_auth())
+
+    assert response.status_code == 200, response.text
+    assert hourly(main) == before
+
+
+def rollups(main):
+    return ([tuple(row.values()) for row in main.db_fetchall("SELECT * FROM stats_hourly ORDER BY hour")],
+            [tuple(row.values()) for row in main.db_fetchall("SELECT * FROM stats_totals ORDER BY name")])
+
+
+def test_rollups_follow_activity_and_match_a_rebuild(bank_factory):
+    bank = bank_factory(DASHBOARD_CACHE_TTL="0")
+    main = bank.main
+    bank.signup("alice", deposit=100)
+    bob = bank.signup("bob", deposit=20)
+    bank.client.post("/transfer", data={"to_account_number": bob, "amount": 30}, headers=bank.auth("alice"))
+    for _ in range(2):
+        bank.client.post("/token", data={"username": "alice", "password": "wrong"})
+    bank.client.portal.call(main.login_attempt_writer.flush)
+
+    stats = bank.client.get("/admin/dashboard", headers=bank.admin_auth()).json()
+    maintained = rollups(main)
+    main.run_dashboard_rebuild()
+
+    assert rollups(main) == maintained
+    assert stats["total_users"] == 2
+    assert stats["today_transactions"] == 4
+    assert stats["transaction_total"] == 120
+    assert stats["failed_logins_24h"] == 2
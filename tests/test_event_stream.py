@@ -0,0 +1,77 @@
+"""Admin event stream: single-use tickets and the session recheck"""
+import asyncio
+import signal
+import sqlite3
+import threading
+from datetime import timedelta
+
+
+def ticket(bank):
+    response = bank.client.post("/admin/events/ticket", headers=bank.admin_auth())
+    assert response.status_code == 200, response.text
+    return response.json()["ticket"]
+
+
+def deactivate_admin_later(bank, delay):
+    def deactivate():
+        conn = sqlite3.connect(bank.main.DB_FILE)
+        conn.execute("UPDATE admins SET is_active = 0 WHERE username = 'admin'")
+        conn.commit()
+        conn.close()
+    timer = threading.Timer(delay, deactivate)
+    timer.start()
+    return timer
+
+
+def test_ticket_opens_the_stream_once(bank):
+    bank.main.EVENT_STREAM_KEEPALIVE = 0.2
+    stream_ticket = ticket(bank)
+    # The stream only ends when its recheck fails
+    timer = deactivate_admin_later(bank, 0.5)
+
+    response = bank.client.get(f"/admin/events/stream?ticket={stream_ticket}")
+    timer.join()
+
+    assert response.status_code == 200
+    assert response.text.startswith("retry: 5000\n\n")
+    assert bank.client.get(f"/admin/events/stream?ticket={stream_ticket}").status_code == 401
+
+
+def test_token_in_the_url_is_not_accepted(bank):
+    token = bank.admin_auth()["Authorization"].split()[1]
+
+    assert bank.client.get(f"/admin/events/stream?token={token}").status_code == 401
+
+
+def test_expired_ticket_is_refused(bank):
+    stream_ticket = ticket(bank)
+    with bank.main.db_connection() as conn:
+        conn.execute("UPDATE admin_stream_tickets SET expires_at = datetime('now', '-1 second')")
+        conn.commit()
+
+    assert bank.client.get(f"/admin/events/stream?ticket={stream_ticket}").status_code == 401
+
+
+def test_stream_ends_when_the_token_expires(bank):
+    main = bank.main
+    main.EVENT_STREAM_KEEPALIVE = 0.2
+    token = main.create_admin_access_token({"sub": "admin"}, timedelta(seconds=1))
+
+    response = bank.client.get("/admin/events/stream", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200
+    assert response.text.startswith("retry: 5000\n\n")
+
+
+def test_event_hub_leaves_signal_handlers_alone(load_app):
+    main = load_app()
+    before = [signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)]
+    hub = main.EventHub(10, 60)
+
+    async def start_and_stop():
+        await hub.start()
+        await hub.stop()
+
+    asyncio.run(start_and_stop())
+
+    assert [signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)] == before
@@ -0,0 +1,79 @@
+"""Streaming CSV/NDJSON exports, ExportCursor and the export slots"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+
+def test_csv_export_streams_the_hot_table_and_archives_in_order(bank_factory):
+    bank = bank_factory(EXPORT_CHUNK_ROWS="2")
+    bank.signup("alice", deposit=5)
+    old = bank.insert_old_deposits("alice", datetime.utcnow() - timedelta(days=200), 3)
+    bank.archive_all()
+
+    response = bank.client.get("/transactions/export", headers=bank.auth("alice"))
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in rows[:3]] == [str(tx_id) for tx_id in old]
+    assert [float(row["amount"]) for row in rows] == [1, 1, 1, 5]
+    assert bank.main.active_exports == 0
+
+
+def test_admin_ndjson_export_filters_by_user_and_time(bank):
+    bank.signup("alice", deposit=5)
+    bank.signup("bob", deposit=7)
+    now = datetime.utcnow()
+    bank.insert_old_deposits("alice", now - timedelta(days=10), 2)
+    start = (now - timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S")
+
+    response = bank.client.get(f"/admin/transactions/export?format=ndjson&username=alice&start={start}",
+                               headers=bank.admin_auth())
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(row["user_id"], row["amount"]) for row in rows] == [("alice", 5)]
+
+
+def test_bad_format_or_bound_is_refused(bank):
+    bank.signup("alice")
+
+    assert bank.client.get("/transactions/export?format=xml", headers=bank.auth("alice")).status_code == 400
+    assert bank.client.get("/transactions/export?start=yesterday", headers=bank.auth("alice")).status_code == 400
+    assert bank.main.active_exports == 0
+
+
+def test_exports_beyond_the_slot_limit_get_503(bank_factory):
+    bank = bank_factory(EXPORT_MAX_CONCURRENT="1")
+    main = bank.main
+    bank.signup("alice")
+
+    slot = main.ExportSlot()
+    busy = bank.client.get("/transactions/export", headers=bank.auth("alice"))
+    slot.release()
+    slot.release()
+    free = bank.client.get("/transactions/export", headers=bank.auth("alice"))
+
+    assert busy.status_code == 503 and busy.headers["Retry-After"] == "30"
+    assert free.status_code == 200
+    assert main.active_exports == 0
+
+
+def test_export_cursor_closed_mid_archive_returns_a_clean_connection(bank):
+    main = bank.main
+    bank.signup("alice")
+    bank.insert_old_deposits("alice", datetime.utcnow() - timedelta(days=200), 3)
+    bank.archive_all()
+    in_use = main.read_pool.in_use
+
+    export = main.ExportCursor("SELECT id FROM {transactions} t ORDER BY id", [])
+    assert export.open() == ["id"]
+    assert len(export.fetch(1)) == 1
+    assert export.attached
+    export.close()
+    export.close()
+
+    assert main.read_pool.in_use == in_use
+    with main.db_connection(readonly=True) as conn:
+        assert [row["name"] for row in conn.execute("PRAGMA database_list")] == ["main"]
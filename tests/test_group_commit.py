@@ -0,0 +1,111 @@
+"""Group commit: ledger operations batched into one transaction with savepoints"""
+import asyncio
+import sqlite3
+
+from fastapi import HTTPException
+
+
+def record_batches(main, monkeypatch):
+    """Sizes of the batches the group-commit writer applies"""
+    batches = []
+    apply_ledger_batch = main.apply_ledger_batch
+
+    def recording(cursor, batch):
+        batches.append(len(batch))
+        return apply_ledger_batch(cursor, batch)
+
+    monkeypatch.setattr(main, "apply_ledger_batch", recording)
+    return batches
+
+
+def test_group_commit_isolates_a_failed_transfer_in_its_savepoint(bank_factory, monkeypatch):
+    bank = bank_factory(LEDGER_GROUP_COMMIT="true", LEDGER_BATCH_WINDOW_MS="500")
+    main = bank.main
+    alice = bank.signup("alice", deposit=100)
+    bob = bank.signup("bob")
+    carol = bank.signup("carol")
+    bank.fail_credits_to("carol")
+
+    batches = record_batches(main, monkeypatch)
+
+    async def submit_together():
+        return await asyncio.gather(
+            main.ledger_batcher.submit(main.ledger_transfer, "alice", alice, bob, 10.0),
+            # Debits alice, then fails on the credit: only this savepoint may roll back
+            main.ledger_batcher.submit(main.ledger_transfer, "alice", alice, carol, 20.0),
+            main.ledger_batcher.submit(main.ledger_transfer, "alice", alice, bob, 1000.0),
+            main.ledger_batcher.submit(main.ledger_transfer, "alice", alice, bob, 5.0),
+            return_exceptions=True
+        )
+
+    first, crashed, overdraft, last = bank.client.portal.call(submit_together)
+
+    assert batches == [4]
+    assert first["new_balance"] == 90
+    assert isinstance(crashed, sqlite3.IntegrityError)
+    assert isinstance(overdraft, HTTPException) and overdraft.status_code == 400
+    assert last["new_balance"] == 85
+    assert bank.balance("alice") == 85
+    assert bank.balance("bob") == 15
+    assert bank.balance("carol") == 0
+    assert [row["amount"] for row in bank.transactions("alice")] == [100, -10, -5]
+    assert bank.transactions("carol") == []
+
+
+def test_group_commit_fails_every_waiter_when_the_commit_fails(bank_factory, monkeypatch):
+    bank = bank_factory(LEDGER_GROUP_COMMIT="true", LEDGER_BATCH_WINDOW_MS="200")
+    main = bank.main
+    alice = bank.signup("alice", deposit=100)
+
+    apply_ledger_batch = main.apply_ledger_batch
+
+    def broken(cursor, batch):
+        apply_ledger_batch(cursor, batch)
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(main, "apply_ledger_batch", broken)
+
+    async def submit_together():
+        return await asyncio.gather(
+            *(main.ledger_batcher.submit(main.ledger_deposit, "alice", alice, 1.0) for _ in range(3)),
+            return_exceptions=True
+        )
+
+    results = bank.client.portal.call(submit_together)
+
+    assert all(isinstance(result, sqlite3.OperationalError) for result in results)
+    assert bank.balance("alice") == 100
+    assert [row["type"] for row in bank.transactions("alice")] == ["deposit"]
+
+
+def test_batches_are_capped_at_max_ops(bank_factory, monkeypatch):
+    bank = bank_factory(LEDGER_GROUP_COMMIT="true", LEDGER_BATCH_WINDOW_MS="500", LEDGER_BATCH_MAX_OPS="3")
+    main = bank.main
+    alice = bank.signup("alice")
+    batches = record_batches(main, monkeypatch)
+
+    async def submit_together():
+        return await asyncio.gather(
+            *(main.ledger_batcher.submit(main.ledger_deposit, "alice", alice, 1.0) for _ in range(7))
+        )
+
+    results = bank.client.portal.call(submit_together)
+
+    assert batches == [3, 3, 1]
+    assert [result["new_balance"] for result in results] == [1, 2, 3, 4, 5, 6, 7]
+    assert bank.balance("alice") == 7
+
+
+def test_endpoints_go_through_the_batcher(bank_factory, monkeypatch):
+    bank = bank_factory(LEDGER_GROUP_COMMIT="true", LEDGER_BATCH_WINDOW_MS="1")
+    batches = record_batches(bank.main, monkeypatch)
+
+    bank.signup("alice", deposit=100)
+    bob = bank.signup("bob")
+    response = bank.client.post("/transfer", data={"to_account_number": bob, "amount": 40},
+                                headers=bank.auth("alice"))
+
+    assert response.status_code == 200, response.text
+    assert batches == [1, 1]
+    assert bank.balance("alice") == 60
+    assert bank.balance("bob") == 40
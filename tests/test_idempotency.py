@@ -0,0 +1,144 @@
+"""Idempotency-Key handling on the money-movement endpoints"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+
+def deposit(bank, amount, key):
+    return bank.client.post("/deposit", data={"amount": amount},
+                            headers=bank.auth("alice", **{"Idempotency-Key": key}))
+
+
+def test_repeated_key_replays_the_stored_response(bank):
+    bank.signup("alice")
+
+    first = deposit(bank, 50, "k1")
+    replay = deposit(bank, 50, "k1")
+    bank.main.idempotency_cache.clear()
+    from_table = deposit(bank, 50, "k1")
+
+    assert first.status_code == 200 and "Idempotent-Replayed" not in first.headers
+    for response in (replay, from_table):
+        assert response.status_code == 200
+        assert response.headers["Idempotent-Replayed"] == "true"
+        assert response.json() == first.json()
+    assert bank.balance("alice") == 50
+
+
+def test_key_reused_for_a_different_request_is_refused(bank):
+    bank.signup("alice")
+
+    assert deposit(bank, 50, "k1").status_code == 200
+    assert deposit(bank, 60, "k1").status_code == 422
+    assert bank.balance("alice") == 50
+
+
+def test_failed_request_stores_nothing_and_may_be_retried(bank):
+    bank.signup("alice", deposit=10)
+    headers = bank.auth("alice", **{"Idempotency-Key": "k1"})
+
+    failed = bank.client.post("/withdraw", data={"amount": 20}, headers=headers)
+    bank.client.post("/deposit", data={"amount": 10}, headers=bank.auth("alice"))
+    retried = bank.client.post("/withdraw", data={"amount": 20}, headers=headers)
+
+    assert failed.status_code == 400
+    assert retried.status_code == 200 and "Idempotent-Replayed" not in retried.headers
+    assert bank.balance("alice") == 0
+
+
+def test_concurrent_requests_with_the_same_key_apply_once(bank):
+    bank.signup("alice")
+
+    async def send_together():
+        transport = httpx.ASGITransport(app=bank.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(
+                client.post("/deposit", data={"amount": 25},
+                            headers=bank.auth("alice", **{"Idempotency-Key": "same"}))
+                for _ in range(10)
+            ))
+
+    responses = bank.client.portal.call(send_together)
+
+    assert [response.status_code for response in responses] == [200] * 10
+    assert sum("Idempotent-Replayed" not in response.headers for response in responses) == 1
+    assert len({response.json()["new_balance"] for response in responses}) == 1
+    assert bank.balance("alice") == 25
+    assert [row["type"] for row in bank.transactions("alice")] == ["deposit"]
+
+
+def test_same_key_racing_across_workers_applies_once(bank):
+    # Each worker has its own cache and in-flight table; only the ledger transaction arbitrates
+    bank.signup("alice")
+    main = bank.main
+    account_number = bank.accounts["alice"]
+
+    def apply():
+        return main.run_ledger_transaction(
+            main.ledger_idempotent, "alice", "same", "fingerprint",
+            main.ledger_deposit, ("alice", account_number, 25.0)
+        )
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: apply(), range(8)))
+
+    assert sum(not result["replayed"] for result in results) == 1
+    assert bank.balance("alice") == 25
+    assert [row["type"] for row in bank.transactions("alice")] == ["deposit"]
+
+
+def test_concurrent_same_key_under_group_commit_applies_once(bank_factory):
+    bank = bank_factory(LEDGER_GROUP_COMMIT="true", LEDGER_BATCH_WINDOW_MS="50")
+    bank.signup("alice")
+    main = bank.main
+    account_number = bank.accounts["alice"]
+
+    async def submit_together():
+        # Both land in one batch, so the second sees the first's row through its savepoint
+        return await asyncio.gather(*(
+            main.ledger_batcher.submit(
+                main.ledger_idempotent, "alice", "same", "fingerprint",
+                main.ledger_deposit, ("alice", account_number, 25.0)
+            )
+            for _ in range(4)
+        ))
+
+    results = bank.client.portal.call(submit_together)
+
+    assert [result["replayed"] for result in results] == [False, True, True, True]
+    assert bank.balance("alice") == 25
+
+
+def test_key_older_than_the_ttl_applies_again(bank):
+    bank.signup("alice")
+    assert deposit(bank, 50, "k1").status_code == 200
+    with bank.main.db_connection() as conn:
+        conn.execute("UPDATE idempotency_keys SET created_at = datetime('now', '-2 days')")
+        conn.commit()
+    bank.main.idempotency_cache.clear()
+
+    again = deposit(bank, 50, "k1")
+
+    assert again.status_code == 200 and "Idempotent-Replayed" not in again.headers
+    assert bank.balance("alice") == 100
+
+
+def test_keys_are_scoped_to_the_user(bank):
+    bank.signup("alice")
+    bank.signup("bob")
+
+    for username in ("alice", "bob"):
+        response = bank.client.post("/deposit", data={"amount": 50},
+                                    headers=bank.auth(username, **{"Idempotency-Key": "shared"}))
+        assert response.status_code == 200 and "Idempotent-Replayed" not in response.headers
+
+    assert bank.balance("alice") == 50
+    assert bank.balance("bob") == 50
+
+
+def test_overlong_key_is_refused(bank):
+    bank.signup("alice")
+
+    assert deposit(bank, 50, "k" * 256).status_code == 400
+    assert bank.balance("alice") == 0
@@ -0,0 +1,102 @@
+"""Atomic money movement: deposits, withdrawals and transfers"""
+import asyncio
+import sqlite3
+
+from fastapi import HTTPException
+
+
+def test_transfer_moves_funds_and_records_both_legs(bank):
+    bank.signup("alice", deposit=100)
+    bob = bank.signup("bob")
+
+    response = bank.client.post("/transfer", data={"to_account_number": bob, "amount": 30},
+                                headers=bank.auth("alice"))
+
+    assert response.status_code == 200, response.text
+    assert response.json()["new_balance"] == 70
+    assert bank.balance("alice") == 70
+    assert bank.balance("bob") == 30
+    assert [row["type"] for row in bank.transactions("alice")] == ["deposit", "transfer_sent"]
+    assert [row["type"] for row in bank.transactions("bob")] == ["transfer_received"]
+
+
+def test_crash_between_debit_and_credit_rolls_back_the_debit(bank):
+    bank.signup("alice", deposit=100)
+    bob = bank.signup("bob")
+    bank.fail_credits_to("bob")
+
+    response = bank.client.post("/transfer", data={"to_account_number": bob, "amount": 30},
+                                headers=bank.auth("alice"))
+
+    assert response.status_code == 500
+    assert bank.balance("alice") == 100
+    assert bank.balance("bob") == 0
+    assert [row["type"] for row in bank.transactions("alice")] == ["deposit"]
+    assert bank.transactions("bob") == []
+
+
+def test_deposit_rolls_back_when_its_history_row_fails(bank):
+    bank.signup("alice", deposit=100)
+    conn = sqlite3.connect(bank.main.DB_FILE)
+    conn.execute('''
+        CREATE TRIGGER fail_history BEFORE INSERT ON transactions
+        BEGIN SELECT RAISE(ABORT, 'simulated crash before the history row'); END
+    ''')
+    conn.commit()
+    conn.close()
+
+    response = bank.client.post("/deposit", data={"amount": 50}, headers=bank.auth("alice"))
+
+    assert response.status_code == 500
+    assert bank.balance("alice") == 100
+    assert [row["type"] for row in bank.transactions("alice")] == ["deposit"]
+
+
+def test_transfer_to_an_unknown_account_changes_nothing(bank):
+    bank.signup("alice", deposit=100)
+
+    response = bank.client.post("/transfer", data={"to_account_number": "0000-0000-0000", "amount": 30},
+                                headers=bank.auth("alice"))
+
+    assert response.status_code == 404
+    assert bank.balance("alice") == 100
+    assert [row["type"] for row in bank.transactions("alice")] == ["deposit"]
+
+
+def test_concurrent_transfers_both_ways_conserve_money(bank):
+    alice = bank.signup("alice", deposit=100)
+    bob = bank.signup("bob", deposit=100)
+    main = bank.main
+
+    async def transfer_back_and_forth():
+        return await asyncio.gather(*(
+            main.execute_ledger_operation(main.ledger_transfer, *pair, 7.0)
+            for _ in range(10)
+            for pair in (("alice", alice, bob), ("bob", bob, alice))
+        ))
+
+    results = bank.client.portal.call(transfer_back_and_forth)
+
+    assert len(results) == 20
+    assert bank.balance("alice") == 100
+    assert bank.balance("bob") == 100
+    assert len(bank.transactions("alice")) == 21
+
+
+def test_withdraw_never_overdraws_under_concurrency(bank):
+    bank.signup("alice", deposit=100)
+    main = bank.main
+
+    async def withdraw_all():
+        return await asyncio.gather(
+            *(main.execute_ledger_operation(main.ledger_withdraw, "alice", bank.accounts["alice"], 30.0)
+              for _ in range(10)),
+            return_exceptions=True
+        )
+
+    results = bank.client.portal.call(withdraw_all)
+
+    assert sum(isinstance(result, dict) for result in results) == 3
+    assert all(isinstance(result, HTTPException) and result.status_code == 400
+               for result in results if not isinstance(result, dict))
+    assert bank.balance("alice") == 10
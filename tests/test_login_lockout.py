@@ -0,0 +1,83 @@
+"""Failed-login counters, the lockout tiers and their sync across workers"""
+import pytest
+
+# Flushes and syncs only happen when a test asks for them
+QUIET = {"LOGIN_ATTEMPT_FLUSH_MS": "60000", "FAILED_LOGIN_SYNC_SECONDS": "3600"}
+
+
+def fail_login(bank, username, times=1):
+    for _ in range(times):
+        response = bank.client.post("/token", data={"username": username, "password": "wrong"})
+        assert response.status_code == 401, response.text
+
+
+@pytest.fixture
+def workers(bank_factory):
+    """Two workers sharing one database"""
+    first = bank_factory(**QUIET)
+    first.signup("alice")
+    return first, bank_factory(**QUIET)
+
+
+def test_user_is_locked_after_max_attempts(bank_factory):
+    bank = bank_factory(**QUIET)
+    bank.signup("alice")
+
+    fail_login(bank, "alice", 5)
+    response = bank.client.post("/token", data={"username": "alice", "password": "Passw0rd!"})
+
+    assert response.status_code == 403
+    assert bank.main.count_failed_attempts("alice") == (5, 5, 5)
+
+
+def test_failures_only_count_against_the_username(bank_factory):
+    bank = bank_factory(**QUIET)
+    bank.signup("alice")
+    bank.signup("bob")
+
+    fail_login(bank, "alice", 4)
+    fail_login(bank, "bob", 4)
+
+    assert bank.login("alice") and bank.login("bob")
+    assert not bank.main.failed_login_counter.series
+
+
+def test_successful_login_deletes_failures_before_it_returns(workers):
+    first, _ = workers
+    fail_login(first, "alice", 4)
+    first.login("alice")
+
+    # Nothing was left queued, so a worker restarting now counts no failures
+    rows = first.main.db_fetchall("SELECT success FROM login_attempts WHERE username = 'alice'")
+    assert [row["success"] for row in rows] == [1, 1]
+    assert not first.main.login_attempt_writer.pending
+    first.main.failed_login_counter.series.clear()
+    first.main.load_failed_login_counters()
+    assert first.main.count_failed_attempts("alice") == (0, 0, 0)
+
+
+def test_failures_on_other_workers_count_after_a_sync(workers):
+    first, second = workers
+    fail_login(first, "alice", 3)
+    first.client.portal.call(first.main.login_attempt_writer.flush)
+    assert second.client.portal.call(second.main.sync_failed_login_counters) == 3
+    fail_login(second, "alice", 2)
+
+    response = second.client.post("/token", data={"username": "alice", "password": "Passw0rd!"})
+    assert response.status_code == 403
+    second.client.portal.call(second.main.login_attempt_writer.flush)
+    first.client.portal.call(first.main.sync_failed_login_counters)
+    assert first.main.count_failed_attempts("alice")[0] == 5
+
+
+def test_successful_login_clears_other_workers_after_a_sync(workers):
+    first, second = workers
+    fail_login(first, "alice", 4)
+    first.client.portal.call(first.main.login_attempt_writer.flush)
+    second.client.portal.call(second.main.sync_failed_login_counters)
+    assert second.main.count_failed_attempts("alice")[0] == 4
+
+    first.login("alice")
+    second.client.portal.call(second.main.sync_failed_login_counters)
+
+    assert second.main.count_failed_attempts("alice") == (0, 0, 0)
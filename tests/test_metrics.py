@@ -0,0 +1,59 @@
+"""Per-thread metric shards, their Prometheus rendering and GET /metrics"""
+import threading
+
+
+def test_shards_from_every_thread_are_summed_at_scrape(load_app):
+    main = load_app()
+    metrics = main.Metrics((0.01, 0.1))
+
+    def record():
+        for _ in range(500):
+            metrics.inc("test_total", (("kind", "a"),))
+        metrics.observe("test_seconds", (), 0.005)
+        metrics.observe("test_seconds", (), 0.05)
+        metrics.observe("test_seconds", (), 1.0)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    lines = metrics.render().splitlines()
+
+    assert len(metrics.shards) == 4
+    assert 'test_total{kind="a"} 2000' in lines
+    # Buckets are cumulative and +Inf equals the count
+    assert 'test_seconds_bucket{le="0.01"} 4' in lines
+    assert 'test_seconds_bucket{le="0.1"} 8' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 12' in lines
+    assert "test_seconds_count 12" in lines
+    assert any(line.startswith("test_seconds_sum 4.2") for line in lines)
+    assert "# TYPE test_total untyped" in lines
+
+
+def test_label_values_are_escaped(load_app):
+    main = load_app()
+
+    assert main.format_labels(()) == ""
+    assert main.format_labels((("route", 'a"b\\c\nd'),)) == '{route="a\\"b\\\\c\\nd"}'
+
+
+def test_requests_are_recorded_under_their_route_template(bank):
+    account_number = bank.signup("alice")
+    bank.client.get(f"/users/{account_number}", headers=bank.auth("alice"))
+    bank.client.get("/no-such-page")
+
+    text = bank.client.get("/metrics").text
+
+    assert "# TYPE simplebanking_http_request_duration_seconds histogram" in text
+    assert 'route="/users/{account_number}",status="200"' in text
+    assert 'route="unmatched",status="404"' in text
+    assert account_number not in text
+
+
+def test_metrics_token_is_required_when_set(bank_factory):
+    bank = bank_factory(METRICS_TOKEN="scrape-secret")
+
+    assert bank.client.get("/metrics").status_code == 401
+    assert bank.client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert bank.client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).status_code == 200
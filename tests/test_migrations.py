@@ -0,0 +1,77 @@
+"""Versioned schema migrations and the expected-index check"""
+import threading
+
+
+def schema_versions(main):
+    return [row["version"] for row in main.db_fetchall("SELECT version FROM schema_version ORDER BY version")]
+
+
+def test_fresh_database_gets_every_migration_and_index(load_app, capsys):
+    main = load_app()
+    main.init_db()
+
+    assert schema_versions(main) == [version for version, _, _ in main.MIGRATIONS]
+    with main.db_connection(readonly=True) as conn:
+        assert main.check_schema_indexes(conn) == {}
+    assert "WARNING" not in capsys.readouterr().out
+
+
+def test_migrations_run_once(load_app, capsys):
+    main = load_app()
+    main.init_db()
+    capsys.readouterr()
+
+    main.init_db()
+
+    assert "Applied schema migration" not in capsys.readouterr().out
+    assert len(schema_versions(main)) == len(main.MIGRATIONS)
+
+
+def test_workers_starting_together_apply_each_migration_once(load_app, capsys):
+    main = load_app()
+    start = threading.Barrier(4)
+    errors = []
+
+    def migrate():
+        start.wait()
+        try:
+            main.init_db()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=migrate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert capsys.readouterr().out.count("Applied schema migration 1:") == 1
+    assert schema_versions(main) == [version for version, _, _ in main.MIGRATIONS]
+
+
+def test_missing_index_is_reported(load_app, capsys):
+    main = load_app()
+    main.init_db()
+    with main.db_connection() as conn:
+        conn.execute("DROP INDEX idx_login_attempts_user")
+        conn.commit()
+    capsys.readouterr()
+
+    main.init_db()
+
+    assert "table login_attempts is missing expected indexes: idx_login_attempts_user" in capsys.readouterr().out
+
+
+def test_history_query_uses_the_user_index(load_app):
+    main = load_app()
+    main.init_db()
+
+    with main.db_connection(readonly=True) as conn:
+        plan = " ".join(row["detail"] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM transactions WHERE user_id = ? ORDER BY id DESC LIMIT 50",
+            ("alice",)
+        ))
+
+    assert "idx_transactions_user" in plan
+    assert "TEMP B-TREE" not in plan
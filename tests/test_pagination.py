@@ -0,0 +1,84 @@
+"""Keyset (cursor) pagination on the list endpoints"""
+import pytest
+from fastapi import HTTPException
+
+
+def admin_pages(bank, endpoint, limit):
+    """Follow X-Next-Cursor through an admin list endpoint; returns the pages"""
+    pages = []
+    url = f"{endpoint}?limit={limit}"
+    while True:
+        response = bank.client.get(url, headers=bank.admin_auth())
+        assert response.status_code == 200, response.text
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+        url = f"{endpoint}?limit={limit}&cursor={cursor}"
+
+
+def test_cursor_round_trips(load_app):
+    main = load_app()
+
+    for values in ([42], ["2026-01-02 03:04:05", 7], ["ünïcode", None, 1.5]):
+        assert main.decode_cursor(main.encode_cursor(*values), len(values)) == values
+    assert main.decode_cursor(None, 1) is None
+
+
+def test_malformed_or_mismatched_cursor_is_refused(load_app):
+    main = load_app()
+
+    for cursor, size in (("not base64!", 1), (main.encode_cursor(1, 2), 1), (main.encode_cursor(1), 2)):
+        with pytest.raises(HTTPException) as raised:
+            main.decode_cursor(cursor, size)
+        assert raised.value.status_code == 400
+
+
+def test_transaction_history_pages_without_gaps_or_repeats(bank):
+    bank.signup("alice")
+    for amount in range(1, 8):
+        bank.client.post("/deposit", data={"amount": amount}, headers=bank.auth("alice"))
+
+    amounts = []
+    url = "/transactions?limit=3"
+    while url:
+        page = bank.client.get(url, headers=bank.auth("alice")).json()
+        assert len(page["transactions"]) <= 3
+        amounts += [tx["amount"] for tx in page["transactions"]]
+        url = page["next_cursor"] and f"/transactions?limit=3&cursor={page['next_cursor']}"
+
+    assert amounts == [7, 6, 5, 4, 3, 2, 1]
+
+
+def test_admin_user_list_pages_newest_first(bank):
+    for n in range(5):
+        bank.signup(f"user{n}")
+
+    pages = admin_pages(bank, "/admin/users", 2)
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [user["username"] for page in pages for user in page] == [f"user{n}" for n in reversed(range(5))]
+
+
+def test_security_logs_in_the_same_second_page_by_id(bank):
+    with bank.main.db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO security_logs (event_type, details, timestamp) VALUES ('test', ?, '2026-01-02 03:04:05')",
+            [(str(n),) for n in range(5)]
+        )
+        conn.commit()
+
+    pages = admin_pages(bank, "/admin/security/logs", 2)
+    ids = [log["id"] for page in pages for log in page]
+
+    same_second = [log["details"] for page in pages for log in page if log["event_type"] == "test"]
+
+    assert len(ids) == len(set(ids))
+    assert same_second == ["4", "3", "2", "1", "0"]
+
+
+def test_invalid_cursor_returns_400(bank):
+    bank.signup("alice")
+
+    assert bank.client.get("/transactions?cursor=bogus", headers=bank.auth("alice")).status_code == 400
+    assert bank.client.get("/admin/users?cursor=bogus", headers=bank.admin_auth()).status_code == 400
@@ -0,0 +1,62 @@
+"""Per-worker principal caches and their invalidation across workers"""
+import sqlite3
+
+
+def two_factor_enabled(bank, username):
+    response = bank.client.get("/2fa/status", headers=bank.auth(username))
+    assert response.status_code == 200, response.text
+    return response.json()["has_2fa"]
+
+
+def test_invalidating_one_key_does_not_block_loads_of_another(load_app):
+    cache = load_app().PrincipalCache(60, 10)
+    _, alice_generation = cache.get("alice")
+    _, bob_generation = cache.get("bob")
+
+    cache.invalidate("bob")
+    cache.put("alice", "alice row", alice_generation)
+    cache.put("bob", "stale bob row", bob_generation)
+
+    assert cache.get("alice")[0] == "alice row"
+    assert cache.get("bob")[0] is None
+
+
+def test_load_started_before_a_forgotten_invalidation_is_not_stored(load_app):
+    cache = load_app().PrincipalCache(60, 2)
+    _, generation = cache.get("alice")
+
+    # alice's stamp is pushed out by newer ones
+    for username in ("alice", "bob", "carol"):
+        cache.invalidate(username)
+    cache.put("alice", "stale alice row", generation)
+
+    assert "alice" not in cache.invalidated
+    assert cache.get("alice")[0] is None
+
+
+def test_change_made_by_another_worker_reaches_the_cache_after_a_sync(bank_factory):
+    bank = bank_factory(PRINCIPAL_SYNC_SECONDS="3600")
+    main = bank.main
+    bank.signup("alice")
+    assert two_factor_enabled(bank, "alice") is False
+
+    # Another worker (or a manual edit) turns on 2FA; nothing here is invalidated
+    conn = sqlite3.connect(main.DB_FILE)
+    conn.execute("UPDATE users SET totp_secret = 'JBSWY3DPEHPK3PXP' WHERE username = 'alice'")
+    conn.commit()
+    conn.close()
+    assert two_factor_enabled(bank, "alice") is False
+
+    assert main.sync_principal_invalidations() == 1
+    assert two_factor_enabled(bank, "alice") is True
+
+
+def test_balance_updates_are_not_recorded_as_principal_changes(bank_factory):
+    bank = bank_factory(PRINCIPAL_SYNC_SECONDS="3600")
+    main = bank.main
+    bank.signup("alice", deposit=50)
+    main.sync_principal_invalidations()
+
+    bank.client.post("/deposit", data={"amount": 10}, headers=bank.auth("alice"))
+
+    assert main.sync_principal_invalidations() == 0
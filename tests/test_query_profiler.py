@@ -0,0 +1,58 @@
+"""Query profiler totals, the slow-query log and /admin/system/queries"""
+import json
+
+
+def profile(bank, **params):
+    response = bank.client.get("/admin/system/queries", params=params, headers=bank.admin_auth())
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_statements_are_grouped_by_normalized_sql(bank_factory):
+    bank = bank_factory(QUERY_PROFILER="true", SLOW_QUERY_MS="60000")
+    main = bank.main
+
+    for n in range(3):
+        main.db_fetchall(f"SELECT username FROM users WHERE username = 'user{n}' OR id IN (1, 2, {n})")
+    body = profile(bank, order="calls", limit=100)
+
+    assert body["enabled"] is True
+    entries = {entry["query"]: entry for entry in body["queries"]}
+    entry = entries["SELECT username FROM users WHERE username = ? OR id IN (?, ...)"]
+    assert entry["calls"] == 3 and entry["slow"] == 0 and entry["plan"] is None
+
+
+def test_slow_statement_is_logged_with_its_plan_but_not_its_parameters(bank_factory, tmp_path):
+    log_path = tmp_path / "slow.log"
+    bank = bank_factory(QUERY_PROFILER="true", SLOW_QUERY_MS="0", SLOW_QUERY_LOG=str(log_path))
+    main = bank.main
+    main.db_fetchall("SELECT username FROM users WHERE account_number = ?", ("SECRET-NUMBER",))
+
+    records = [json.loads(line) for line in log_path.read_text().splitlines()]
+    record = next(r for r in records if r["query"] == "SELECT username FROM users WHERE account_number = ?")
+    assert record["plan"] and all(isinstance(line, str) for line in record["plan"])
+    assert record["duration_ms"] >= 0 and record["rows"] == 0
+    assert "SECRET-NUMBER" not in log_path.read_text()
+    listed = {entry["query"]: entry for entry in profile(bank, limit=100)["queries"]}
+    assert listed[record["query"]]["plan"] == record["plan"]
+    assert listed[record["query"]]["slow"] >= 1
+
+
+def test_profile_order_is_checked_and_reset_clears_it(bank_factory):
+    bank = bank_factory(QUERY_PROFILER="true")
+    bank.signup("alice")
+
+    assert bank.client.get("/admin/system/queries?order=random", headers=bank.admin_auth()).status_code == 400
+    assert any(entry["query"].startswith("INSERT INTO users") for entry in profile(bank, limit=100)["queries"])
+    assert bank.client.delete("/admin/system/queries", headers=bank.admin_auth()).status_code == 200
+
+    # Only the statements run since the reset remain
+    assert not any(entry["query"].startswith("INSERT INTO users") for entry in profile(bank, limit=100)["queries"])
+
+
+def test_profiler_is_off_by_default(bank):
+    bank.signup("alice")
+
+    body = profile(bank)
+
+    assert body["enabled"] is False and body["queries"] == []
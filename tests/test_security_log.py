@@ -0,0 +1,59 @@
+"""Buffered security-event sink and its overflow policies"""
+import pytest
+
+# Nothing is flushed unless a test asks for it
+QUIET = {"SECURITY_LOG_FLUSH_MS": "60000", "SECURITY_LOG_MAX_PENDING": "2"}
+
+
+def log_events(bank, *events, severity="info"):
+    async def log():
+        for details in events:
+            await bank.main.log_security_event("test", None, None, details, severity)
+    bank.client.portal.call(log)
+
+
+def written(bank):
+    rows = bank.main.db_fetchall("SELECT details FROM security_logs WHERE event_type = 'test' ORDER BY id")
+    return [row["details"] for row in rows]
+
+
+@pytest.mark.parametrize("overflow, expected, dropped", [
+    ("write_through", ["e1", "e2", "e3", "e4"], False),
+    ("drop_oldest", ["e3", "e4"], True),
+    ("drop_newest", ["e1", "e2"], True),
+])
+def test_full_buffer_follows_the_overflow_policy(bank_factory, capsys, overflow, expected, dropped):
+    bank = bank_factory(SECURITY_LOG_OVERFLOW=overflow, **QUIET)
+
+    log_events(bank, "e1", "e2", "e3", "e4")
+    bank.client.portal.call(bank.main.security_log_writer.flush)
+
+    assert written(bank) == expected
+    assert ("dropped 2 buffered writes" in capsys.readouterr().out) is dropped
+
+
+def test_critical_event_is_written_before_returning_and_after_queued_ones(bank_factory):
+    bank = bank_factory(**QUIET)
+
+    log_events(bank, "queued")
+    assert written(bank) == []
+    log_events(bank, "critical", severity="critical")
+
+    assert written(bank) == ["queued", "critical"]
+
+
+def test_listing_the_logs_flushes_the_buffer(bank_factory):
+    bank = bank_factory(**QUIET)
+    log_events(bank, "e1")
+
+    response = bank.client.get("/admin/security/logs", headers=bank.admin_auth())
+
+    assert response.status_code == 200
+    assert "e1" in [log["details"] for log in response.json()]
+
+
+def test_unknown_overflow_policy_falls_back_to_write_through(load_app, capsys):
+    main = load_app(SECURITY_LOG_OVERFLOW="drop_everything")
+
+    assert main.SECURITY_LOG_OVERFLOW == "write_through"
+    assert "Unknown SECURITY_LOG_OVERFLOW" in capsys.readouterr().out
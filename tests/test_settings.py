@@ -0,0 +1,68 @@
+"""Per-worker settings cache and PRAGMA data_version refreshes"""
+import sqlite3
+
+# Background refreshes stay out of the way; tests call refresh() themselves
+IDLE = {"SETTINGS_REFRESH_SECONDS": "3600"}
+
+
+def store_setting(main, key, value):
+    conn = sqlite3.connect(main.DB_FILE)
+    conn.execute("INSERT OR REPLACE INTO system_settings (setting_key, setting_value) VALUES (?, ?)", (key, value))
+    conn.commit()
+    conn.close()
+
+
+def deposit(bank, username, amount):
+    return bank.client.post("/deposit", data={"amount": amount}, headers=bank.auth(username))
+
+
+def test_change_committed_by_another_connection_is_picked_up(bank_factory):
+    bank = bank_factory(**IDLE)
+    main = bank.main
+    bank.signup("alice")
+    assert main.settings_cache.refresh() is False
+    reloads = main.settings_cache.reloads
+
+    store_setting(main, "transaction_limit", "50")
+    assert deposit(bank, "alice", 60).status_code == 200
+
+    assert main.settings_cache.refresh() is True
+    assert main.settings_cache.reloads == reloads + 1
+    assert main.settings_cache.get("transaction_limit") == 50.0
+    assert deposit(bank, "alice", 60).status_code == 400
+    assert main.settings_cache.refresh() is False
+
+
+def test_update_applies_at_once_here_and_after_a_refresh_elsewhere(bank_factory):
+    first = bank_factory(**IDLE)
+    second = bank_factory(**IDLE)
+    settings = {"max_attempts": 3, "lock_duration": 10, "enable_2fa": False,
+                "transaction_limit": 25, "session_timeout": 30}
+
+    response = first.client.post("/admin/settings", json=settings, headers=first.admin_auth())
+
+    assert response.status_code == 200, response.text
+    assert first.main.settings_cache.get("transaction_limit") == 25.0
+    assert second.main.settings_cache.get("transaction_limit") == 10000.0
+    assert second.main.settings_cache.refresh() is True
+    assert second.main.settings_cache.get("max_login_attempts") == 3
+    assert second.main.settings_cache.get("require_2fa_admins") is False
+    assert second.main.settings_cache.get("session_timeout_minutes") == 30
+
+
+def test_invalid_stored_value_falls_back_to_the_default_with_one_warning(bank_factory, capsys):
+    bank = bank_factory(**IDLE)
+    main = bank.main
+
+    store_setting(main, "max_login_attempts", "many")
+    store_setting(main, "lockout_tier_minutes", "1,2")
+    main.settings_cache.refresh()
+    store_setting(main, "transaction_limit", "75")
+    main.settings_cache.refresh()
+
+    assert main.settings_cache.get("max_login_attempts") == 5
+    assert main.settings_cache.get("lockout_tier_minutes") == (5, 60, 1440)
+    assert main.settings_cache.get("transaction_limit") == 75.0
+    out = capsys.readouterr().out
+    assert out.count("Ignoring invalid setting max_login_attempts") == 1
+    assert out.count("Ignoring invalid setting lockout_tier_minutes") == 1
@@ -0,0 +1,156 @@
+"""Two-phase transfers across ledger shards and their recovery"""
+import asyncio
+import hashlib
+import json
+import random
+import sqlite3
+
+import httpx
+import pytest
+
+
+@pytest.fixture
+def sharded(bank_factory):
+    """Two shards, recovery job idle, and a payer and payee on different shards"""
+    bank = bank_factory(LEDGER_SHARDS="2", SHARD_RECOVERY_SECONDS="3600")
+    shards = bank.main.ledger_shards
+    bank.signup("alice", deposit=100)
+    payer_shard = shards.index(bank.accounts["alice"])
+    for n in range(50):
+        account_number = bank.signup(f"bob{n}")
+        if shards.index(account_number) != payer_shard:
+            bank.payee = f"bob{n}"
+            return bank
+    pytest.fail("no account landed on the second shard")
+
+
+def shard_of(bank, username):
+    return bank.main.ledger_shards.index(bank.accounts[username])
+
+
+def legs(bank, username):
+    """(role, state) of every shard_transfers row on the user's shard"""
+    shards = bank.main.ledger_shards
+    with bank.main.pool_connection(shards.read_pools[shard_of(bank, username)]) as conn:
+        return [tuple(row) for row in conn.execute("SELECT role, state FROM shard_transfers ORDER BY role")]
+
+
+def age_prepared_legs(bank):
+    """Make every leg look older than the recovery job's grace period"""
+    shards = bank.main.ledger_shards
+    for shard in range(shards.count):
+        shards.execute(shard, "UPDATE shard_transfers SET created_at = datetime('now', '-1 hour')")
+
+
+def transfer_fingerprint(bank, to_account_number, amount):
+    """The fingerprint /transfer stores with an Idempotency-Key"""
+    args = ("alice", bank.accounts["alice"], to_account_number, amount)
+    return hashlib.sha256(json.dumps(["transfer", args], default=str).encode()).hexdigest()
+
+
+def test_cross_shard_transfer_commits_both_legs(sharded):
+    bank = sharded
+    payee = bank.accounts[bank.payee]
+
+    response = bank.client.post("/transfer", data={"to_account_number": payee, "amount": 30},
+                                headers=bank.auth("alice"))
+
+    assert response.status_code == 200, response.text
+    assert bank.balance("alice") == 70
+    assert bank.balance(bank.payee) == 30
+    assert legs(bank, "alice") == [("debit", "committed")]
+    assert legs(bank, bank.payee) == [("credit", "committed")]
+
+
+def test_crash_between_debit_and_credit_is_finished_by_recovery(sharded):
+    bank = sharded
+    main = bank.main
+    payee = bank.accounts[bank.payee]
+    # The payee's shard fails the credit after the debit decision is durable
+    conn = sqlite3.connect(main.ledger_shards.paths[shard_of(bank, bank.payee)])
+    conn.execute('''
+        CREATE TRIGGER fail_credit BEFORE UPDATE OF balance ON users
+        BEGIN SELECT RAISE(ABORT, 'simulated crash before the credit leg'); END
+    ''')
+    conn.commit()
+
+    response = bank.client.post("/transfer", data={"to_account_number": payee, "amount": 30},
+                                headers=bank.auth("alice"))
+
+    assert response.status_code == 200, response.text
+    assert bank.balance("alice") == 70
+    assert bank.balance(bank.payee) == 0
+    assert legs(bank, "alice") == [("debit", "committed")]
+    assert legs(bank, bank.payee) == [("credit", "prepared")]
+
+    conn.execute("DROP TRIGGER fail_credit")
+    conn.commit()
+    conn.close()
+    assert main.recover_shard_transfers(60) == 0
+    age_prepared_legs(bank)
+    assert main.recover_shard_transfers(60) == 1
+
+    assert bank.balance("alice") == 70
+    assert bank.balance(bank.payee) == 30
+    assert legs(bank, bank.payee) == [("credit", "committed")]
+    assert main.recover_shard_transfers(60) == 0
+
+
+def test_recovery_rolls_back_a_transfer_that_crashed_before_its_decision(sharded):
+    bank = sharded
+    main = bank.main
+    shards = main.ledger_shards
+    payee = bank.accounts[bank.payee]
+    key = ("retry-1", transfer_fingerprint(bank, payee, 30.0))
+    # Phase one on both shards, then the process dies before the commit
+    transfer_id = main.generate_transaction_id()
+    shards.transaction(shard_of(bank, "alice"), main.shard_prepare_debit, transfer_id, shard_of(bank, bank.payee),
+                       "alice", bank.accounts["alice"], payee, 30.0, key)
+    shards.transaction(shard_of(bank, bank.payee), main.shard_prepare_credit, transfer_id, shard_of(bank, "alice"),
+                       bank.payee, payee, bank.accounts["alice"], 30.0)
+
+    assert bank.balance("alice") == 70
+    retry = bank.client.post("/transfer", data={"to_account_number": payee, "amount": 30},
+                             headers=bank.auth("alice", **{"Idempotency-Key": "retry-1"}))
+    assert retry.status_code == 409
+
+    age_prepared_legs(bank)
+    assert main.recover_shard_transfers(60) == 1
+
+    assert bank.balance("alice") == 100
+    assert bank.balance(bank.payee) == 0
+    assert legs(bank, "alice") == [("debit", "aborted")]
+    assert legs(bank, bank.payee) == [("credit", "aborted")]
+    # The key was released with the abort, so the client's retry now goes through
+    retry = bank.client.post("/transfer", data={"to_account_number": payee, "amount": 30},
+                             headers=bank.auth("alice", **{"Idempotency-Key": "retry-1"}))
+    assert retry.status_code == 200, retry.text
+    assert bank.balance("alice") == 70
+    assert bank.balance(bank.payee) == 30
+
+
+def test_concurrent_cross_shard_transfers_conserve_money(bank_factory):
+    bank = bank_factory(LEDGER_SHARDS="4", SHARD_RECOVERY_SECONDS="3600")
+    users = [f"user{n}" for n in range(6)]
+    for username in users:
+        bank.signup(username, deposit=100)
+    rng = random.Random(7)
+
+    async def storm():
+        transport = httpx.ASGITransport(app=bank.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def one():
+                sender, recipient = rng.sample(users, 2)
+                response = await client.post(
+                    "/transfer", headers=bank.auth(sender),
+                    data={"to_account_number": bank.accounts[recipient], "amount": rng.randint(1, 40)}
+                )
+                return response.status_code
+            return await asyncio.gather(*(one() for _ in range(60)))
+
+    statuses = bank.client.portal.call(storm)
+
+    assert set(statuses) <= {200, 400}
+    assert statuses.count(200) > 0
+    assert sum(bank.balance(username) for username in users) == 600
+    assert bank.main.recover_shard_transfers(0) == 0
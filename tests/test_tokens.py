@@ -0,0 +1,72 @@
+"""Token revocation after password changes and session locks"""
+
+
+def test_password_change_revokes_older_tokens(bank):
+    bank.signup("alice")
+    other_session = bank.login("alice")
+
+    response = bank.client.post("/change_password", headers=bank.auth("alice"),
+                                data={"current_password": "Passw0rd!", "new_password": "N3w!Passw0rd"})
+    assert response.status_code == 200, response.text
+    new_token = response.json()["access_token"]
+
+    old = bank.client.get("/balance", headers={"Authorization": f"Bearer {other_session}"})
+    new = bank.client.get("/balance", headers={"Authorization": f"Bearer {new_token}"})
+    assert old.status_code == 401
+    assert new.status_code == 200
+
+
+def test_revoked_token_stays_rejected_after_its_entry_is_pruned(bank):
+    bank.signup("alice")
+    main = bank.main
+    old_token = bank.tokens["alice"]
+    # Another worker bumps the generation; this one never hears about it
+    with main.db_connection() as conn:
+        conn.execute("UPDATE users SET token_generation = token_generation + 1 WHERE username = 'alice'")
+        conn.commit()
+    main.user_principals.invalidate("alice")
+
+    response = bank.client.get("/balance", headers={"Authorization": f"Bearer {old_token}"})
+    assert response.status_code == 401
+
+
+def test_admin_password_reset_revokes_the_users_tokens(bank):
+    bank.signup("alice")
+    user_id = bank.main.db_fetchone("SELECT id FROM users WHERE username = 'alice'")["id"]
+
+    response = bank.client.post(f"/admin/users/{user_id}/reset-password", headers=bank.admin_auth())
+    assert response.status_code == 200, response.text
+
+    assert bank.client.get("/balance", headers=bank.auth("alice")).status_code == 401
+    new_token = bank.login("alice", response.json()["temp_password"])
+    assert bank.client.get("/balance", headers={"Authorization": f"Bearer {new_token}"}).status_code == 200
+
+
+def test_revocation_on_another_worker_applies_after_a_sync(bank_factory):
+    quiet = {"TOKEN_REVOCATION_SYNC_SECONDS": "3600", "PRINCIPAL_SYNC_SECONDS": "3600"}
+    first = bank_factory(**quiet)
+    first.signup("alice")
+    second = bank_factory(**quiet)
+    second.tokens["alice"] = second.login("alice")
+    old_token = first.tokens["alice"]
+    # Caches alice's principal on the first worker
+    assert first.balance("alice") == 0
+
+    response = second.client.post("/change_password", headers=second.auth("alice"),
+                                  data={"current_password": "Passw0rd!", "new_password": "N3w!Passw0rd"})
+    assert response.status_code == 200, response.text
+    assert first.client.get("/balance", headers={"Authorization": f"Bearer {old_token}"}).status_code == 200
+
+    assert first.main.token_revocations.sync() == 1
+    assert first.client.get("/balance", headers={"Authorization": f"Bearer {old_token}"}).status_code == 401
+
+
+def test_lock_all_sessions_revokes_user_tokens_but_not_admin(bank):
+    bank.signup("alice")
+    admin = bank.admin_auth()
+
+    assert bank.client.post("/admin/sessions/lock-all", headers=admin).status_code == 200
+
+    assert bank.client.get("/balance", headers=bank.auth("alice")).status_code == 401
+    assert bank.client.get("/balance", headers={"Authorization": f"Bearer {bank.login('alice')}"}).status_code == 200
+    assert bank.client.get("/admin/settings", headers=admin).status_code == 200
@@ -0,0 +1,105 @@
+"""Snowflake transaction IDs, worker number leases and the upgrade from string IDs"""
+import sqlite3
+from datetime import datetime, timedelta
+
+# The users and transactions tables as created before migration 6
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    hashed_password TEXT NOT NULL,
+    balance REAL DEFAULT 0,
+    account_number TEXT UNIQUE NOT NULL,
+    email TEXT,
+    totp_secret TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    last_login DATETIME,
+    locked_until DATETIME,
+    last_ip TEXT,
+    role TEXT DEFAULT 'user',
+    is_active BOOLEAN DEFAULT 1
+);
+CREATE TABLE transactions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    amount REAL NOT NULL,
+    description TEXT,
+    balance_after REAL,
+    related_account TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    is_flagged BOOLEAN DEFAULT 0
+);
+"""
+
+# Recent enough to stay out of the monthly archives
+LEGACY_TIMES = [datetime.utcnow() - timedelta(days=2), datetime.utcnow() - timedelta(days=1)]
+LEGACY_IDS = [f"tx_{when:%Y%m%d%H%M%S}_{suffix}" for when, suffix in zip(LEGACY_TIMES, ("1a2b3c4d", "5e6f7a8b"))]
+
+
+def test_baseline_database_upgrades_with_legacy_ids(load_app, bank_factory):
+    main = load_app()
+    account_number = main.generate_account_number("alice")
+    conn = sqlite3.connect(main.DB_FILE)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO users (username, hashed_password, balance, account_number) VALUES (?, ?, 30, ?)",
+                 ("alice", main.password_hashing.hash_password("Passw0rd!"), account_number))
+    conn.executemany(
+        "INSERT INTO transactions (id, user_id, type, amount, description, balance_after, related_account, timestamp) "
+        "VALUES (?, 'alice', 'deposit', ?, 'Deposit', ?, ?, ?)",
+        [(LEGACY_IDS[0], 10, 10, account_number, f"{LEGACY_TIMES[0]:%Y-%m-%d %H:%M:%S}"),
+         (LEGACY_IDS[1], 20, 30, account_number, f"{LEGACY_TIMES[1]:%Y-%m-%d %H:%M:%S}")]
+    )
+    conn.commit()
+    conn.close()
+
+    bank = bank_factory()
+    bank.accounts["alice"] = account_number
+    bank.tokens["alice"] = bank.login("alice")
+    bank.client.post("/deposit", data={"amount": 5}, headers=bank.auth("alice"))
+
+    history = bank.client.get("/transactions", headers=bank.auth("alice")).json()["transactions"]
+    assert [tx["id"] for tx in history][1:] == list(reversed(LEGACY_IDS))
+    assert history[0]["id"].isdigit()
+    assert bank.balance("alice") == 35
+
+    response = bank.client.post(f"/admin/transactions/{LEGACY_IDS[0]}/flag", headers=bank.admin_auth())
+    assert response.status_code == 200, response.text
+    flagged = bank.main.db_fetchall("SELECT legacy_id FROM transactions WHERE is_flagged = 1")
+    assert [row["legacy_id"] for row in flagged] == [LEGACY_IDS[0]]
+
+
+def test_two_leases_never_share_a_worker_number(load_app):
+    main = load_app()
+    main.open_storage()
+    other = main.WorkerIdLease()
+    try:
+        assert other.claim() != main.worker_id_lease.worker_id
+        # A cleanly released number is handed out again at once
+        released = other.worker_id
+        other.release()
+        third = main.WorkerIdLease()
+        assert third.claim() == released
+        third.release()
+    finally:
+        other.release()
+        main.worker_id_lease.release()
+
+
+def test_sequence_overflow_moves_to_the_next_millisecond(load_app, monkeypatch):
+    main = load_app()
+    generator = main.SnowflakeGenerator(5)
+    now = 1_800_000_000.0
+    monkeypatch.setattr(main.time, "time", lambda: now)
+
+    ids = [generator.next_id() for _ in range(4096 * 2 + 1)]
+    frozen_ms = int(now * 1000) - main.SNOWFLAKE_EPOCH_MS
+
+    assert len(set(ids)) == len(ids) and ids == sorted(ids)
+    assert [tx_id >> 22 for tx_id in (ids[0], ids[4095], ids[4096], ids[8192])] == [
+        frozen_ms, frozen_ms, frozen_ms + 1, frozen_ms + 2
+    ]
+    assert {(tx_id >> 12) & 0x3FF for tx_id in ids} == {5}
+    # The clock catching up never reuses the borrowed milliseconds
+    now += 0.001
+    assert generator.next_id() > ids[-1]